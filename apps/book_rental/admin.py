@@ -78,12 +78,15 @@ class RentedBookAdmin(SimpleHistoryAdmin):
     list_display = ('book', 'user',
                     'rent_date', 'return_date', 'days_rented',
                     'fine_charged', 'total_charge', 'has_charges_paid')
+    # frozen by return API (see rentals.py)
+    readonly_fields = ('final_charge',)
 
     search_fields = ['name']
 
     def get_queryset(self, request):
         """
         Get the book and user, so we don't have hundreds of queries. i.e. DB hits
+        Charges are annotated so that list can be ordered on them
         """
         return super(
             RentedBookAdmin, self
@@ -93,7 +96,17 @@ class RentedBookAdmin(SimpleHistoryAdmin):
             'book',
             'book__category',
             'user',
-        )
+        ).with_charges()
+
+    def days_rented(self, obj):
+        return obj.days_rented_db
+
+    days_rented.admin_order_field = 'days_rented_db'
+
+    def total_charge(self, obj):
+        return obj.total_charge_db
+
+    total_charge.admin_order_field = 'total_charge_db'
 
 
 admin.site.register(RentedBook, RentedBookAdmin)
@@ -0,0 +1,163 @@
+"""
+Prefix autocomplete of book names, served from memory.
+
+Normalised names and slugs of all the books are kept in a sorted array,
+a prefix is looked up with bisect and the matching run is scanned for top-k,
+so a keystroke never touches the database.
+
+The index is built lazily on first use with one query and is then kept up
+to date from Book post_save/post_delete signals (see models.py), after the
+transaction commits. Like compiled tariffs, it is per process: other processes
+see the change of version (see versions.py) and build their index again on next
+use. Bulk writes skip signals and call `invalidate` instead.
+"""
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from apps.book_rental import versions
+
+VERSION = 'autocomplete'
+
+_lock = threading.RLock()
+_index = None
+
+
+def normalize(text):
+    """
+    Lower case, accents dropped and everything but letters and digits collapsed to single spaces
+    e.g. 'Les Misérables - Vol.1' -> 'les miserables vol 1'
+    """
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'[^\W_]+', text.lower()))
+
+
+class AutocompleteIndex:
+    """
+    Sorted keys with parallel book ids, plus (name, *keys) of books to answer with
+    and to find their keys on removal. Key strings are shared, not copied
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.ids = array('q')
+        self.books = {}
+
+    @staticmethod
+    def book_keys(name, slug):
+        return {key for key in (normalize(name), normalize(slug.replace('-', ' '))) if key}
+
+    @classmethod
+    def build(cls, books):
+        """
+        books are (id, name, slug)
+        """
+        index = cls()
+        entries = []
+        for book_id, name, slug in books:
+            keys = cls.book_keys(name, slug)
+            index.books[book_id] = (name,) + tuple(keys)
+            entries.extend((key, book_id) for key in keys)
+        entries.sort()
+        index.keys = [key for key, book_id in entries]
+        index.ids = array('q', (book_id for key, book_id in entries))
+        return index
+
+    def find(self, key, book_id):
+        """
+        Position of (key, book_id), or where it should be inserted
+        """
+        position = bisect_left(self.keys, key)
+        while position < len(self.keys) and self.keys[position] == key and self.ids[position] < book_id:
+            position += 1
+        return position
+
+    def add(self, book_id, name, slug):
+        self.remove(book_id)
+        keys = self.book_keys(name, slug)
+        self.books[book_id] = (name,) + tuple(keys)
+        for key in keys:
+            position = self.find(key, book_id)
+            self.keys.insert(position, key)
+            self.ids.insert(position, book_id)
+
+    def remove(self, book_id):
+        book = self.books.pop(book_id, None)
+        if book is None:
+            return
+        for key in book[1:]:
+            position = self.find(key, book_id)
+            del self.keys[position]
+            del self.ids[position]
+
+    def lookup(self, prefix, limit):
+        """
+        [(id, name)] of first limit books whose name or slug starts with prefix, in key order
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = {}
+        position = bisect_left(self.keys, prefix)
+        while len(results) < limit and position < len(self.keys) and self.keys[position].startswith(prefix):
+            book_id = self.ids[position]
+            results.setdefault(book_id, self.books[book_id][0])
+            position += 1
+        return list(results.items())
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                from apps.book_rental.models import Book
+                _index = AutocompleteIndex.build(Book.objects.values_list('id', 'name', 'slug').iterator())
+    return _index
+
+
+def autocomplete_books(prefix, limit=10):
+    index = get_index()
+    with _lock:
+        return index.lookup(prefix, limit)
+
+
+def update_book(book_id, name, slug):
+    """
+    Index is updated only once built, else it is built with the change on first use
+    """
+    with _lock:
+        if _index is not None:
+            _index.add(book_id, name, slug)
+    versions.bump(VERSION)
+
+
+def remove_book(book_id):
+    with _lock:
+        if _index is not None:
+            _index.remove(book_id)
+    versions.bump(VERSION)
+
+
+def reset():
+    """
+    Drops the index, it is built again on next use
+    """
+    global _index
+    with _lock:
+        _index = None
+
+
+def invalidate():
+    """
+    Drops the index here and in the other processes, e.g. after bulk writes of books
+    """
+    reset()
+    versions.bump(VERSION)
+
+
+versions.register(VERSION, reset)
@@ -0,0 +1,124 @@
+"""
+Bulk charge computation for billing runs.
+
+Instead of calling RentedBook.total_charge object by object, rentals are
+pulled as columns with values_list and charged with NumPy, using the pieces
+of each category's compiled tariff (see tariffs.py) as arrays.
+Results are exactly same as RentedBook.total_charge.
+"""
+from datetime import date
+
+import numpy as np
+from django.utils import timezone
+
+from apps.book_rental.models import RentedBook
+from apps.book_rental.tariffs import CURRENT_TARIFF, RENT_DATE_TARIFF, compile_slabs, get_tariff_histories, \
+    get_tariffs
+
+CHARGE_COLUMNS = ('id', 'book__category_id', 'rent_date', 'return_date', 'has_charges_paid', 'fine_charged',
+                  'final_charge')
+
+
+def _tariff_arrays(tariff):
+    pieces = tariff.pieces
+    return (
+        np.array(tariff.bounds, dtype=np.int64),
+        np.array([piece.total for piece in pieces], dtype=np.float64),
+        np.array([piece.days_calculated for piece in pieces], dtype=np.int64),
+        np.array([piece.per_day_charge or 0 for piece in pieces], dtype=np.float64),
+        np.array([piece.per_day_charge is None for piece in pieces], dtype=bool),
+    )
+
+
+def _history_dates(history):
+    return np.array([history_date.astimezone(timezone.utc).replace(tzinfo=None) for history_date in history.dates],
+                    dtype='datetime64[us]')
+
+
+def _tariff_groups(category_ids, rent_dates, pricing):
+    """
+    Yields (rows, CompiledTariff) where rows are indexes of rentals charged on the tariff
+    """
+    unique_category_ids = np.unique(category_ids).tolist()
+    if pricing != RENT_DATE_TARIFF:
+        for category_id, tariff in get_tariffs(unique_category_ids).items():
+            yield np.flatnonzero(category_ids == category_id), tariff
+        return
+
+    histories = get_tariff_histories(unique_category_ids)
+    for category_id, history in histories.items():
+        rows = np.flatnonzero(category_ids == category_id)
+        if not history.slab_sets:
+            yield rows, history.tariff_on(None)
+            continue
+        # version active at end of rent date, see TariffHistory.version_on
+        ends_of_day = (rent_dates[rows] + np.timedelta64(1, 'D')).astype('datetime64[us]')
+        versions = np.maximum(np.searchsorted(_history_dates(history), ends_of_day, side='left') - 1, 0)
+        for version in np.unique(versions).tolist():
+            yield rows[versions == version], compile_slabs(history.slab_sets[version])
+
+
+def charge_arrays(category_ids, days_rented, has_charges_paid, fine_charged, rent_dates=None,
+                  pricing=CURRENT_TARIFF, final_charges=None):
+    """
+    Charges of rentals given as arrays, same as RentedBook.get_total_charge.
+    rent_dates (datetime64[D]) are needed only for RENT_DATE_TARIFF pricing,
+    final_charges are NaN for rentals whose charge is not frozen
+    """
+    charges = np.zeros(len(days_rented), dtype=np.float64)
+    for rows, tariff in _tariff_groups(category_ids, rent_dates, pricing):
+        bounds, totals, days_calculated, per_day_charges, constants = _tariff_arrays(tariff)
+        days = days_rented[rows]
+        piece = np.searchsorted(bounds, days, side='left')
+        charges[rows] = np.where(
+            constants[piece],
+            totals[piece],
+            totals[piece] + ((days - days_calculated[piece]) * per_day_charges[piece])
+        )
+    if final_charges is not None:
+        frozen = ~np.isnan(final_charges)
+        charges[frozen] = final_charges[frozen]
+    charges += fine_charged
+    charges[has_charges_paid] = 0
+    return charges
+
+
+def compute_charge_arrays(queryset=None, as_of=None, pricing=CURRENT_TARIFF):
+    """
+    Returns (ids, charges) arrays for given RentedBook queryset.
+    as_of is used in place of today for rentals which are not returned yet
+    """
+    if queryset is None:
+        queryset = RentedBook.objects.all()
+    rows = list(queryset.values_list(*CHARGE_COLUMNS))
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    ids, category_ids, rent_dates, return_dates, has_charges_paid, fine_charged, final_charges = zip(*rows)
+    del rows
+
+    rent_dates = np.array(rent_dates, dtype='datetime64[D]')
+    return_dates = np.array(return_dates, dtype='datetime64[D]')
+    return_dates[np.isnat(return_dates)] = np.datetime64(as_of or date.today(), 'D')
+    days_rented = (return_dates - rent_dates).astype(np.int64)
+
+    ids = np.array(ids, dtype=np.int64)
+    charges = charge_arrays(
+        np.array(category_ids, dtype=np.int64),
+        days_rented,
+        np.array(has_charges_paid, dtype=bool),
+        np.array(fine_charged, dtype=np.float64),
+        rent_dates=rent_dates,
+        pricing=pricing,
+        # None becomes NaN
+        final_charges=np.array(final_charges, dtype=np.float64),
+    )
+    return ids, charges
+
+
+def compute_charges(queryset=None, as_of=None, pricing=CURRENT_TARIFF):
+    """
+    Returns {rented_book_id: total_charge} for given RentedBook queryset, all rentals by default
+    """
+    ids, charges = compute_charge_arrays(queryset, as_of=as_of, pricing=pricing)
+    return dict(zip(ids.tolist(), charges.tolist()))
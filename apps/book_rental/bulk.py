@@ -0,0 +1,20 @@
+"""
+Bulk inserts.
+
+Only PostgreSQL returns ids of the rows inserted by bulk_create, on other databases
+they are read back afterwards by a unique key of the rows.
+"""
+
+
+def fill_pks(model, objs, key_fields):
+    """
+    Sets pk of objs inserted by model.objects.bulk_create, found by the values of
+    key_fields (attribute names), which are unique together. Does nothing when the
+    database returned them
+    """
+    if not objs or objs[0].pk is not None:
+        return
+    lookups = {'{}__in'.format(field): {getattr(obj, field) for obj in objs} for field in key_fields}
+    ids = {row[:-1]: row[-1] for row in model._default_manager.filter(**lookups).values_list(*key_fields, 'pk')}
+    for obj in objs:
+        obj.pk = ids[tuple(getattr(obj, field) for field in key_fields)]
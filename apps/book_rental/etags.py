@@ -0,0 +1,46 @@
+"""
+Validators for conditional GET of books and user-books endpoints, an unchanged
+resource is answered with 304 Not Modified before anything is serialised.
+
+Books list is validated on a version which every write of books, categories
+and author names changes, see BOOKS_VERSION in models.py. There is no Last-Modified: MAX(updated_at)
+does not move on deletes, a client sending only If-Modified-Since would be told
+a deleted book is not modified.
+
+User-books are validated on aggregates of the user's rentals (MAX(updated_at), COUNT(*)).
+
+Charges of not returned books grow every day and follow the tariffs, so
+ETag of user-books also depends on today's date and on the last change of
+day wise charges (id of their latest history row, which covers deletes too).
+"""
+import hashlib
+from datetime import date
+
+from django.db.models import Count, Max
+
+from apps.book_rental import versions
+from apps.book_rental.models import BOOKS_VERSION, CategoryDayCharge, RentedBook
+
+
+def make_etag(request, *parts):
+    """
+    Hash of the parts, representation (Accept) is part of the ETag
+    """
+    parts = (request.META.get('HTTP_ACCEPT', ''),) + parts
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def books_etag(request, *args, **kwargs):
+    """
+    Version of books (see versions.py), set on every change of books, categories and
+    author names. Costs no query, unlike COUNT and MAX over all the books
+    """
+    return make_etag(request, versions.current(BOOKS_VERSION))
+
+
+def user_books_etag(request, user_id, *args, **kwargs):
+    rented_books = RentedBook.objects.filter(user=user_id).aggregate(
+        count=Count('id'), updated_at=Max('updated_at'), book_updated_at=Max('book__updated_at'))
+    tariffs = CategoryDayCharge.history.aggregate(version=Max('history_id'))
+    return make_etag(request, user_id, rented_books['count'], rented_books['updated_at'],
+                     rented_books['book_updated_at'], tariffs['version'], date.today())
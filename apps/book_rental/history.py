@@ -0,0 +1,156 @@
+"""
+Buffered writing of historical records (django-simple-history).
+
+HistoricalRecords inserts a Historical* row with every save and delete.
+With settings.HISTORY_BUFFERED on, BufferedHistoricalRecords instead keeps a copy
+of every instance saved or deleted inside a transaction, with the date and user
+of the change, and writes their records after the transaction commits, in the
+order of the changes: creations and updates with one `bulk_history_create` of
+the history manager for every run of them of a model, deletions one by one with
+`create_historical_record`. post_create_historical_record is sent once they are
+written. Records are built by the public API of simple-history, so this works
+with any version having `bulk_history_create` and `_history_date`/`_history_user`.
+
+Every change is the transaction.on_commit callback of itself and the buffer only
+keeps weak references to it, so changes of rolled back transactions and
+savepoints die with their callbacks (as in tariffs.Invalidation). Changes outside
+transactions (autocommit) are written right away, as by HistoricalRecords.
+
+Records are written after the commit, in a transaction of their own, so a
+crash between the two commits loses them. History is not visible inside the
+transaction which made the changes, caches built from history (tariffs.TariffHistory)
+are invalidated from post_create_historical_record.
+"""
+import copy
+import threading
+import weakref
+from itertools import groupby
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+from simple_history.models import HistoricalRecords
+from simple_history.signals import post_create_historical_record
+
+_local = threading.local()
+
+
+class BufferedChange:
+    """
+    Copy of an instance changed in a transaction, waiting for the transaction to
+    commit. It is the on_commit callback of the change too
+    """
+
+    def __init__(self, buffer, records, instance, history_type, using):
+        self.buffer = buffer
+        self.records = records
+        self.instance = instance
+        self.history_type = history_type
+        self.using = using
+        self.committed = False
+
+    def __call__(self):
+        self.committed = True
+        self.buffer.committed(self)
+
+
+class HistoryBuffer:
+    """
+    Buffered changes of one database connection, in order of the changes
+    """
+
+    def __init__(self, using):
+        self.using = using
+        # weak references to changes whose transaction is not committed yet
+        self.pending = []
+        # committed changes, waiting for the callbacks of the others
+        self.ready = []
+
+    def add(self, change):
+        self.pending = [reference for reference in self.pending if reference() is not None]
+        self.pending.append(weakref.ref(change))
+        transaction.on_commit(change, using=self.using)
+
+    def committed(self, change):
+        """
+        Writes committed changes once the last callback of the transaction runs,
+        changes whose callbacks are still alive and not run are committed too
+        """
+        self.ready.append(change)
+        for reference in self.pending:
+            pending = reference()
+            if pending is not None and not pending.committed:
+                return
+        changes, self.pending, self.ready = self.ready, [], []
+        write_changes(changes)
+
+
+def get_buffer(using):
+    buffers = _local.__dict__.setdefault('buffers', {})
+    if using not in buffers:
+        buffers[using] = HistoryBuffer(using)
+    return buffers[using]
+
+
+def write_changes(changes):
+    """
+    Inserts historical records of changes in order, then sends post_create_historical_record
+    """
+    created = []
+    with transaction.atomic(using=changes[0].using):
+        for (records, model, history_type), run in groupby(
+                changes, lambda change: (change.records, type(change.instance), change.history_type)):
+            run = list(run)
+            if history_type == '-':
+                # sends post_create_historical_record itself
+                for change in run:
+                    records.create_historical_record(change.instance, history_type, using=change.using)
+                continue
+            history_instances = getattr(model, records.manager_name).bulk_history_create(
+                [change.instance for change in run], update=history_type == '~')
+            created.extend(zip(run, history_instances))
+
+    for change, history_instance in created:
+        post_create_historical_record.send(
+            sender=type(history_instance),
+            instance=change.instance,
+            history_instance=history_instance,
+            history_date=history_instance.history_date,
+            history_user=history_instance.history_user,
+            history_change_reason=history_instance.history_change_reason,
+            using=change.using,
+        )
+
+
+class BufferedHistoricalRecords(HistoricalRecords):
+    """
+    HistoricalRecords which buffers records of changes made in transactions
+    when settings.HISTORY_BUFFERED is on
+    """
+
+    def post_save(self, instance, created, using=None, **kwargs):
+        if kwargs.get('raw', False) or not self.is_buffered(instance, using):
+            return super(BufferedHistoricalRecords, self).post_save(instance, created, using=using, **kwargs)
+        if created or not hasattr(instance, 'skip_history_when_saving'):
+            self.buffer_change(instance, created and '+' or '~', using)
+
+    def post_delete(self, instance, using=None, **kwargs):
+        if self.cascade_delete_history or not self.is_buffered(instance, using):
+            return super(BufferedHistoricalRecords, self).post_delete(instance, using=using, **kwargs)
+        self.buffer_change(instance, '-', using)
+
+    @staticmethod
+    def is_buffered(instance, using):
+        using = using or router.db_for_write(type(instance), instance=instance)
+        return getattr(settings, 'HISTORY_BUFFERED', False) and transaction.get_connection(using).in_atomic_block
+
+    def buffer_change(self, instance, history_type, using):
+        """
+        Buffers a copy of the instance as it is now, dated and attributed to the user now
+        """
+        using = using or router.db_for_write(type(instance), instance=instance)
+        change = copy.copy(instance)
+        change._history_date = getattr(instance, '_history_date', timezone.now())
+        change._history_user = self.get_history_user(instance)
+        buffer = get_buffer(using)
+        buffer.add(BufferedChange(buffer, self, change, history_type, using))
@@ -0,0 +1,233 @@
+"""
+Per user outstanding balance ledger (UserBalance).
+
+Every unpaid rental contributes to its user's balance:
+
+ * returned rentals are frozen into settled_charges
+ * not returned rentals are kept in open_rentals grouped by
+   (category, rent_date) with their count and fine, so balance on any date
+   is priced from the cached tariffs without touching RentedBook
+
+Ledger is updated from RentedBook and CategoryDayCharge signals inside
+the transaction of the change (see models.py). Writes which bypass
+signals (queryset.update, bulk_create) have to call `record_rental_change`
+(or `record_rental_changes` for many rentals) or `rebuild_balances` themselves,
+`reconcile_balances` command finds the drift.
+
+Rentals are kept under the category of their book, books moving to another
+category rebuild balances of the users renting them (`rebuild_book_balances`).
+"""
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.book_rental.tariffs import get_tariff
+
+RentalState = namedtuple('RentalState', ['user_id', 'category_id', 'rent_date', 'return_date',
+                                         'has_charges_paid', 'fine_charged', 'final_charge'])
+
+STATE_COLUMNS = ('user_id', 'book__category_id', 'rent_date', 'return_date', 'has_charges_paid', 'fine_charged',
+                 'final_charge')
+
+
+def open_rental_key(category_id, rent_date):
+    return '{}:{}'.format(category_id, rent_date.isoformat())
+
+
+def rental_state(rented_book):
+    """
+    Ledger relevant state of a RentedBook object
+    """
+    return RentalState(rented_book.user_id, rented_book.book.category_id, rented_book.rent_date,
+                       rented_book.return_date, rented_book.has_charges_paid, rented_book.fine_charged,
+                       rented_book.final_charge)
+
+
+def stored_rental_state(rented_book_id):
+    """
+    Ledger relevant state of a RentedBook as stored in database, None if not stored
+    """
+    from apps.book_rental.models import RentedBook
+
+    row = RentedBook.objects.filter(pk=rented_book_id).values_list(*STATE_COLUMNS).first()
+    return RentalState(*row) if row else None
+
+
+class Balance:
+    """
+    Contributions of rentals to a user's balance
+    """
+
+    def __init__(self):
+        self.settled_charges = 0
+        self.open_rentals = defaultdict(lambda: [0, 0])
+
+    def add(self, state, sign=1):
+        if state is None or state.has_charges_paid:
+            return
+        if state.final_charge is not None:
+            self.settled_charges += sign * (state.final_charge + state.fine_charged)
+        elif state.return_date:
+            days_rented = (state.return_date - state.rent_date).days
+            self.settled_charges += sign * (get_tariff(state.category_id).charge(days_rented) + state.fine_charged)
+        else:
+            open_rental = self.open_rentals[open_rental_key(state.category_id, state.rent_date)]
+            open_rental[0] += sign
+            open_rental[1] += sign * state.fine_charged
+
+    def __bool__(self):
+        return bool(self.settled_charges) or any(count or fine for count, fine in self.open_rentals.values())
+
+
+def apply_balance_change(user_balance, change):
+    """
+    Adds a Balance change to a stored UserBalance, without saving it
+    """
+    user_balance.settled_charges += change.settled_charges
+    open_rentals = user_balance.get_open_rentals()
+    for key, (count, fine) in change.open_rentals.items():
+        stored_count, stored_fine = open_rentals.get(key, (0, 0))
+        count, fine = stored_count + count, stored_fine + fine
+        if count:
+            open_rentals[key] = [count, fine]
+        else:
+            open_rentals.pop(key, None)
+    user_balance.set_open_rentals(open_rentals)
+
+
+@transaction.atomic(savepoint=False)
+def record_rental_change(previous, current):
+    """
+    Moves contribution of a rental from its previous state to current state.
+    previous is None for new rentals and current is None for deleted ones
+    """
+    from apps.book_rental.models import UserBalance
+
+    changes = defaultdict(Balance)
+    if previous is not None:
+        changes[previous.user_id].add(previous, sign=-1)
+    if current is not None:
+        changes[current.user_id].add(current)
+
+    # balances are always locked in order of user to avoid dead locks
+    for user_id in sorted(changes):
+        change = changes[user_id]
+        if not change:
+            continue
+        balance, _ = UserBalance.objects.select_for_update().get_or_create(user_id=user_id)
+        apply_balance_change(balance, change)
+        balance.save()
+
+
+@transaction.atomic(savepoint=False)
+def record_rental_changes(changes):
+    """
+    record_rental_change of many rentals at once, changes are (previous, current) pairs.
+    Balances are read, updated and created in a fixed number of queries
+    """
+    from apps.book_rental.models import UserBalance
+
+    balance_changes = defaultdict(Balance)
+    for previous, current in changes:
+        if previous is not None:
+            balance_changes[previous.user_id].add(previous, sign=-1)
+        if current is not None:
+            balance_changes[current.user_id].add(current)
+    balance_changes = {user_id: change for user_id, change in balance_changes.items() if change}
+    if not balance_changes:
+        return
+
+    to_update = []
+    now = timezone.now()
+    for user_balance in UserBalance.objects.select_for_update().filter(
+            user_id__in=balance_changes).order_by('user_id'):
+        apply_balance_change(user_balance, balance_changes.pop(user_balance.user_id))
+        # bulk_update skips auto_now
+        user_balance.updated_at = now
+        to_update.append(user_balance)
+    UserBalance.objects.bulk_update(to_update, ['settled_charges', 'open_rentals', 'updated_at'])
+
+    to_create = []
+    for user_id, change in sorted(balance_changes.items()):
+        user_balance = UserBalance(user_id=user_id)
+        apply_balance_change(user_balance, change)
+        to_create.append(user_balance)
+    UserBalance.objects.bulk_create(to_create)
+
+
+def compute_balances(user_ids=None):
+    """
+    Computes balances from all the rentals, of given users or of everyone when None.
+    Returns {user_id: Balance}
+    """
+    from apps.book_rental.models import RentedBook
+
+    queryset = RentedBook.objects.filter(has_charges_paid=False).order_by('pk')
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    balances = defaultdict(Balance)
+    for row in queryset.values_list(*STATE_COLUMNS).iterator():
+        state = RentalState(*row)
+        balances[state.user_id].add(state)
+    return balances
+
+
+@transaction.atomic(savepoint=False)
+def rebuild_balances(user_ids=None):
+    """
+    Rewrites ledger of given users, or of everyone when None, from a full computation
+    """
+    from apps.book_rental.models import UserBalance
+
+    balances = compute_balances(user_ids)
+    existing = UserBalance.objects.select_for_update().order_by('user_id')
+    if user_ids is not None:
+        existing = existing.filter(user_id__in=user_ids)
+
+    to_update = []
+    for user_balance in existing:
+        balance = balances.pop(user_balance.user_id, None) or Balance()
+        user_balance.settled_charges = balance.settled_charges
+        user_balance.set_open_rentals(balance.open_rentals)
+        to_update.append(user_balance)
+    UserBalance.objects.bulk_update(to_update, ['settled_charges', 'open_rentals'])
+
+    to_create = []
+    for user_id, balance in balances.items():
+        user_balance = UserBalance(user_id=user_id, settled_charges=balance.settled_charges)
+        user_balance.set_open_rentals(balance.open_rentals)
+        to_create.append(user_balance)
+    UserBalance.objects.bulk_create(to_create)
+
+
+def rebuild_book_balances(book_ids):
+    """
+    Rentals are kept and settled under the category of their book, users having
+    unpaid rentals of books which moved to another category are settled again
+    """
+    from apps.book_rental.models import RentedBook
+
+    user_ids = list(RentedBook.objects.filter(
+        book_id__in=book_ids,
+        has_charges_paid=False,
+    ).values_list('user_id', flat=True).distinct())
+    if user_ids:
+        rebuild_balances(user_ids)
+
+
+def reprice_category(category_id):
+    """
+    Returned rentals are settled on current tariff, unless their charge is frozen,
+    so users having them in the category are settled again
+    """
+    from apps.book_rental.models import RentedBook
+
+    user_ids = list(RentedBook.objects.filter(
+        book__category_id=category_id,
+        return_date__isnull=False,
+        final_charge__isnull=True,
+        has_charges_paid=False,
+    ).values_list('user_id', flat=True).distinct())
+    if user_ids:
+        rebuild_balances(user_ids)
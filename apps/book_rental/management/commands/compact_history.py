@@ -0,0 +1,173 @@
+import gzip
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from apps.book_rental.models import Book, Category, CategoryDayCharge, RentedBook
+from apps.book_rental.tariffs import invalidate_tariff
+
+MODELS = {model._meta.model_name: model for model in (Book, RentedBook, Category, CategoryDayCharge)}
+PERIODS = {
+    'day': lambda history_date: history_date.date(),
+    'week': lambda history_date: history_date.isocalendar()[:2],
+    'month': lambda history_date: (history_date.year, history_date.month),
+}
+# saves changing nothing else than these are no-op
+AUDIT_FIELDS = ('updated_at', 'updated_by_id')
+
+
+def records_to_delete(records, period_key, tracked):
+    """
+    history_ids to delete of one object's records, which are in order of history_date:
+    updates changing no tracked field, then all but first and last updates of every period.
+    Creations and deletions are always kept. Returns (no-op, thinned) ids
+    """
+    no_op = []
+    remaining = []
+    previous = None
+    for record in records:
+        snapshot = tuple(record[field] for field in tracked)
+        if record['history_type'] == '~' and previous is not None and snapshot == previous:
+            no_op.append(record['history_id'])
+        else:
+            remaining.append(record)
+        previous = snapshot
+
+    thinned = []
+    for position, record in enumerate(remaining):
+        if record['history_type'] != '~' or position in (0, len(remaining) - 1):
+            continue
+        key = period_key(record['history_date'])
+        if period_key(remaining[position - 1]['history_date']) == key == \
+                period_key(remaining[position + 1]['history_date']):
+            thinned.append(record['history_id'])
+    return no_op, thinned
+
+
+class Command(BaseCommand):
+    help = 'Compacts history older than a cutoff: no-op updates are dropped and only first and last ' \
+           'version of an object is kept per period. Rows are deleted in small batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than',
+                            default=365,
+                            type=int,
+                            metavar='DAYS',
+                            help='Only history older than these many days is compacted.')
+        parser.add_argument('--period',
+                            default='month',
+                            choices=sorted(PERIODS),
+                            help='First and last version of an object are kept per period.')
+        parser.add_argument('--models',
+                            nargs='+',
+                            default=sorted(MODELS),
+                            choices=sorted(MODELS),
+                            help='Models whose history is compacted.')
+        parser.add_argument('--batch-size',
+                            default=1000,
+                            type=int,
+                            help='Number of rows deleted in one transaction.')
+        parser.add_argument('--objects-per-read',
+                            default=500,
+                            type=int,
+                            help='Number of objects whose history is read at a time.')
+        parser.add_argument('--sleep',
+                            default=0,
+                            type=float,
+                            help='Seconds to wait between delete batches, so that other writers get the table.')
+        parser.add_argument('--archive',
+                            metavar='PATH',
+                            help='Append deleted rows to this gzip compressed JSON lines file before deleting.')
+        parser.add_argument('--dry-run',
+                            action='store_true',
+                            help='Only report what would be deleted.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['objects_per_read'] < 1:
+            raise CommandError("--batch-size and --objects-per-read should be positive")
+        self.options = options
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        archive = gzip.open(options['archive'], 'at', encoding='utf-8') \
+            if options['archive'] and not options['dry_run'] else None
+        try:
+            for model_name in options['models']:
+                self.compact(MODELS[model_name], cutoff, archive)
+        finally:
+            if archive is not None:
+                archive.close()
+        if 'categorydaycharge' in options['models'] and not options['dry_run']:
+            invalidate_tariff()
+
+    def compact(self, model, cutoff, archive):
+        history_model = model.history.model
+        period = self.options['period']
+        if model is CategoryDayCharge and period != 'day':
+            # tariffs as of rent date are the versions at end of each day, see tariffs.TariffHistory
+            period = 'day'
+            self.stdout.write("{}: kept per day, as rent date pricing reads it".format(history_model.__name__))
+        period_key = PERIODS[period]
+        columns = [field.attname for field in history_model._meta.concrete_fields]
+        tracked = [column for column in columns
+                   if not column.startswith('history_') and column not in AUDIT_FIELDS]
+
+        old_history = history_model.objects.filter(history_date__lt=cutoff)
+        start = time.perf_counter()
+        scanned = 0
+        stats = {'no_op': 0, 'thinned': 0}
+        pending = []
+        # rows of pending ids, when archiving
+        rows = {}
+        last_object_id = None
+        while True:
+            objects = old_history.order_by('id').values_list('id', flat=True).distinct()
+            if last_object_id is not None:
+                objects = objects.filter(id__gt=last_object_id)
+            object_ids = list(objects[:self.options['objects_per_read']])
+            if not object_ids:
+                break
+            last_object_id = object_ids[-1]
+
+            records = old_history.filter(id__in=object_ids).order_by('id', 'history_date', 'history_id').values(
+                *columns)
+            by_object = {}
+            for record in records:
+                by_object.setdefault(record['id'], []).append(record)
+                scanned += 1
+            for object_records in by_object.values():
+                no_op, thinned = records_to_delete(object_records, period_key, tracked)
+                stats['no_op'] += len(no_op)
+                stats['thinned'] += len(thinned)
+                pending.extend(no_op + thinned)
+                if archive is not None:
+                    to_delete = set(no_op + thinned)
+                    rows.update((record['history_id'], record) for record in object_records
+                                if record['history_id'] in to_delete)
+            while len(pending) >= self.options['batch_size']:
+                batch, pending = pending[:self.options['batch_size']], pending[self.options['batch_size']:]
+                self.delete(history_model, batch, rows, archive)
+        if pending:
+            self.delete(history_model, pending, rows, archive)
+
+        deleted = stats['no_op'] + stats['thinned']
+        self.stdout.write(self.style.SUCCESS(
+            "{}: {} {} of {} rows older than {:%Y-%m-%d} ({} no-op, {} thinned per {}) in {:.1f}s".format(
+                history_model.__name__, 'would delete' if self.options['dry_run'] else 'deleted', deleted,
+                scanned, cutoff, stats['no_op'], stats['thinned'], period, time.perf_counter() - start)))
+
+    def delete(self, history_model, history_ids, rows, archive):
+        if self.options['dry_run']:
+            return
+        if archive is not None:
+            for history_id in history_ids:
+                archive.write(json.dumps(dict(rows.pop(history_id), model=history_model._meta.label),
+                                         cls=DjangoJSONEncoder) + '\n')
+            archive.flush()
+        with transaction.atomic():
+            history_model.objects.filter(history_id__in=history_ids).delete()
+        if self.options['sleep']:
+            time.sleep(self.options['sleep'])
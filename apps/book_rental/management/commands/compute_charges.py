@@ -0,0 +1,130 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from multiprocessing import cpu_count, get_context
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from apps.book_rental.billing import compute_charge_arrays
+from apps.book_rental.models import BillingChunk, BillingRun, ChargeSnapshot, RentedBook
+from apps.book_rental.tariffs import CURRENT_TARIFF, PRICING_CHOICES
+
+
+def bill_chunk(billing_run_id, start_id, end_id, as_of, pricing):
+    """
+    Bills unpaid rentals having primary key in [start_id, end_id).
+    Snapshots and the chunk record are written in one transaction,
+    so a chunk is either billed completely or not at all.
+    """
+    ids, charges = compute_charge_arrays(
+        RentedBook.objects.filter(pk__gte=start_id, pk__lt=end_id, has_charges_paid=False),
+        as_of=as_of,
+        pricing=pricing,
+    )
+    with transaction.atomic():
+        ChargeSnapshot.objects.bulk_create(
+            ChargeSnapshot(billing_run_id=billing_run_id, rented_book_id=rented_book_id, total_charge=charge)
+            for rented_book_id, charge in zip(ids.tolist(), charges.tolist())
+        )
+        BillingChunk.objects.create(billing_run_id=billing_run_id, start_id=start_id, end_id=end_id, rows=len(ids))
+    return len(ids)
+
+
+class Command(BaseCommand):
+    help = 'Computes outstanding charges of all rented books into ChargeSnapshot.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+                            default=None,
+                            type=int,
+                            help='Number of worker processes, 1 bills in this process. '
+                                 'Default is the number of CPUs.')
+        parser.add_argument('--chunk-size',
+                            default=50000,
+                            type=int,
+                            help='Number of primary keys billed by a worker at a time.')
+        parser.add_argument('--as-of',
+                            default=None,
+                            type=parse_date,
+                            help='Date (YYYY-MM-DD) till which not returned books are charged, '
+                                 'default is today.')
+        parser.add_argument('--pricing',
+                            default=CURRENT_TARIFF,
+                            choices=PRICING_CHOICES,
+                            help='Charge on current tariff or on the tariff active on rent date.')
+        parser.add_argument('--resume',
+                            default=None,
+                            type=int,
+                            metavar='BILLING_RUN_ID',
+                            help='Resume a crashed run, already billed chunks are skipped.')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                billing_run = BillingRun.objects.get(pk=options['resume'])
+            except BillingRun.DoesNotExist:
+                raise CommandError("Billing run {} not found".format(options['resume']))
+        else:
+            if options['chunk_size'] < 1:
+                raise CommandError("--chunk-size should be positive")
+            billing_run = BillingRun.objects.create(as_of=options['as_of'] or date.today(),
+                                                    pricing=options['pricing'],
+                                                    chunk_size=options['chunk_size'])
+
+        chunks = self.pending_chunks(billing_run)
+        total_chunks = len(chunks)
+        self.stdout.write("Billing run {} as of {}: {} chunks to bill".format(
+            billing_run.pk, billing_run.as_of, total_chunks))
+
+        start = time.perf_counter()
+        billed_rows = 0
+        workers = options['workers'] or cpu_count()
+        for done, rows in enumerate(self.bill(billing_run, chunks, workers), start=1):
+            billed_rows += rows
+            elapsed = time.perf_counter() - start
+            self.stdout.write("{}/{} chunks, {} rows, {:.0f} rows/s".format(
+                done, total_chunks, billed_rows, billed_rows / elapsed if elapsed else 0))
+
+        billing_run.finished_at = timezone.now()
+        billing_run.save(update_fields=['finished_at'])
+        self.stdout.write(self.style.SUCCESS("Billing run {} finished, {} rows billed".format(
+            billing_run.pk, billed_rows)))
+
+    @staticmethod
+    def pending_chunks(billing_run):
+        """
+        Primary key ranges of RentedBook not billed yet in given run
+        """
+        ids = RentedBook.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if ids['min_id'] is None:
+            return []
+        billed = set(billing_run.chunks.values_list('start_id', flat=True))
+        chunk_size = billing_run.chunk_size
+        first = ids['min_id'] - ids['min_id'] % chunk_size
+        return [(start_id, start_id + chunk_size)
+                for start_id in range(first, ids['max_id'] + 1, chunk_size)
+                if start_id not in billed]
+
+    @staticmethod
+    def bill(billing_run, chunks, workers):
+        """
+        Bills chunks and yields number of rows billed as chunks finish
+        """
+        if workers <= 1:
+            for start_id, end_id in chunks:
+                yield bill_chunk(billing_run.pk, start_id, end_id, billing_run.as_of, billing_run.pricing)
+            return
+
+        # workers are forked with django already set up, connection is closed before forking
+        # so every worker opens its own DB connection instead of sharing the socket of this one
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('fork')) as executor:
+            futures = [executor.submit(bill_chunk, billing_run.pk, start_id, end_id,
+                                       billing_run.as_of, billing_run.pricing)
+                       for start_id, end_id in chunks]
+            for future in as_completed(futures):
+                yield future.result()
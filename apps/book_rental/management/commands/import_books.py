@@ -0,0 +1,298 @@
+import csv
+import json
+import resource
+import sys
+import time
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from apps.book_rental import autocomplete, ledger, search, versions
+from apps.book_rental.bulk import fill_pks
+from apps.book_rental.models import BOOKS_VERSION, Book, Category
+
+FORMATS = ('csv', 'jsonl')
+UPDATE_FIELDS = ('name', 'description', 'author_id', 'category_id', 'book_quantity')
+MAX_ERRORS_SHOWN = 20
+
+
+class RowError(Exception):
+    pass
+
+
+def read_rows(stream, file_format):
+    """
+    Yields (line_number, row) of a CSV (with header) or JSON lines stream, one row at a time
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError:
+                    yield line_number, None
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class Command(BaseCommand):
+    help = 'Imports books from CSV or JSON lines in chunks, with bulk inserts instead of a save() per book. ' \
+           'Columns are name, author (username), category (name or slug) and optional description, ' \
+           'book_quantity and slug.'
+
+    stealth_options = ('stdin',)
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            nargs='?',
+                            default='-',
+                            help='File to import, - (default) reads stdin.')
+        parser.add_argument('--format',
+                            choices=FORMATS,
+                            help='Format of the rows, default is guessed from file extension, else csv.')
+        parser.add_argument('--chunk-size',
+                            default=5000,
+                            type=int,
+                            help='Number of rows written in one transaction.')
+        parser.add_argument('--upsert',
+                            action='store_true',
+                            help='Update books whose slug exists instead of importing them under a new slug.')
+        parser.add_argument('--create-authors',
+                            action='store_true',
+                            help='Create unknown authors as inactive users, else their rows are skipped.')
+        parser.add_argument('--created-by',
+                            metavar='USERNAME',
+                            help='User recorded as creator of the books, default is the first superuser.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size should be positive")
+        self.upsert = options['upsert']
+        self.create_authors = options['create_authors']
+        self.created_by = self.get_created_by(options['created_by'])
+        self.categories = {}
+        for category_id, name, slug in Category.objects.values_list('id', 'name', 'slug'):
+            self.categories[name.lower()] = self.categories[slug] = category_id
+        # username: id of authors seen so far
+        self.authors = {}
+        self.counts = {'created': 0, 'updated': 0, 'skipped': 0}
+
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        if path == '-':
+            stream = options.get('stdin', sys.stdin)
+        else:
+            try:
+                stream = open(path, newline='', encoding='utf-8')
+            except OSError as error:
+                raise CommandError("Can not open {}: {}".format(path, error))
+
+        start = time.perf_counter()
+        rows = 0
+        try:
+            for chunk in chunked(read_rows(stream, file_format), options['chunk_size']):
+                self.import_chunk(chunk)
+                rows += len(chunk)
+                elapsed = time.perf_counter() - start
+                self.stdout.write("{} rows, {:.0f} rows/s".format(rows, rows / elapsed if elapsed else 0))
+        finally:
+            if stream is not options.get('stdin', sys.stdin):
+                stream.close()
+            # bulk writes skip signals, autocomplete index is built again on next use
+            autocomplete.invalidate()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            "Imported {} rows in {:.1f}s ({:.0f} rows/s, peak memory {:.0f}MB): "
+            "{created} created, {updated} updated, {skipped} skipped".format(
+                rows, elapsed, rows / elapsed if elapsed else 0, peak_memory_mb(), **self.counts)))
+
+    @staticmethod
+    def get_created_by(username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError("User {} not found".format(username))
+        created_by = User.objects.filter(is_superuser=True).order_by('id').first()
+        if created_by is None:
+            raise CommandError("No superuser found, pass --created-by")
+        return created_by
+
+    def import_chunk(self, chunk):
+        """
+        Writes a chunk of rows in one transaction with a fixed number of queries
+        """
+        with transaction.atomic():
+            self.resolve_authors({str(row.get('author') or '').strip() for _, row in chunk if isinstance(row, dict)})
+
+            books = {}
+            for line_number, row in chunk:
+                try:
+                    book = self.parse_row(row)
+                except RowError as error:
+                    self.skip(line_number, error)
+                    continue
+                # in upsert mode later rows of a slug win, else they get a new slug
+                key = book.slug if self.upsert else (book.slug, line_number)
+                books[key] = book
+            books = list(books.values())
+
+            existing = Book.objects.in_bulk([book.slug for book in books], field_name='slug')
+            to_update = []
+            moved = []
+            if self.upsert:
+                moved = [existing[book.slug].pk for book in books
+                         if book.slug in existing and existing[book.slug].category_id != book.category_id]
+                to_update = [self.update_existing(existing[book.slug], book) for book in books
+                             if book.slug in existing]
+                books = [book for book in books if book.slug not in existing]
+            self.deduplicate_slugs(books, set(existing))
+
+            now = timezone.now()
+            for book in books:
+                book._history_date = now
+            Book.objects.bulk_create(books)
+            fill_pks(Book, books, ('slug',))
+            Book.history.bulk_history_create(books, default_user=self.created_by)
+
+            for book in to_update:
+                book.updated_by = self.created_by
+                book.updated_at = book._history_date = now
+            Book.objects.bulk_update(to_update, UPDATE_FIELDS + ('updated_by', 'updated_at'))
+            Book.history.bulk_history_create(to_update, update=True, default_user=self.created_by)
+            if moved:
+                # rentals of books moved to another category are kept in ledger under the new one
+                ledger.rebuild_book_balances(moved)
+
+            # bulk writes skip signals, search documents and version of books are written here
+            search.get_backend().index(search.book_documents(self.with_relations(books + to_update)))
+            versions.bump(BOOKS_VERSION)
+
+        self.counts['created'] += len(books)
+        self.counts['updated'] += len(to_update)
+
+    def parse_row(self, row):
+        if not isinstance(row, dict):
+            raise RowError("not a JSON object")
+        name = str(row.get('name') or '').strip()
+        if not name:
+            raise RowError("name is missing")
+        author_id = self.authors.get(str(row.get('author') or '').strip())
+        if author_id is None:
+            raise RowError("unknown author {!r}".format(row.get('author')))
+        category = str(row.get('category') or '').strip()
+        category_id = self.categories.get(category.lower(), self.categories.get(category))
+        if category_id is None:
+            raise RowError("unknown category {!r}".format(row.get('category')))
+        try:
+            book_quantity = int(row.get('book_quantity') or 0)
+        except (TypeError, ValueError):
+            raise RowError("book_quantity {!r} is not a number".format(row.get('book_quantity')))
+
+        slug_field = Book._meta.get_field('slug')
+        slug = slugify(row.get('slug') or name)[:slug_field.max_length].strip('-')
+        if not slug:
+            raise RowError("no slug can be made of {!r}".format(name))
+        return Book(name=name[:Book._meta.get_field('name').max_length], slug=slug,
+                    description=str(row.get('description') or ''), author_id=author_id, category_id=category_id,
+                    book_quantity=book_quantity, created_by=self.created_by)
+
+    def resolve_authors(self, usernames):
+        """
+        Adds ids of authors not seen yet to the map, creating them if asked
+        """
+        missing = usernames.difference(self.authors)
+        missing.discard('')
+        if not missing:
+            return
+        self.authors.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        missing.difference_update(self.authors)
+        if missing and self.create_authors:
+            User.objects.bulk_create([User(username=username, is_active=False, password=make_password(None))
+                                      for username in sorted(missing)])
+            self.authors.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+
+    @staticmethod
+    def update_existing(book, row_book):
+        for field in UPDATE_FIELDS:
+            setattr(book, field, getattr(row_book, field))
+        return book
+
+    @staticmethod
+    def deduplicate_slugs(books, taken):
+        """
+        Gives books whose slug is taken, in database or by an earlier book, a numbered slug e.g. kite-runner-2
+        """
+        max_length = Book._meta.get_field('slug').max_length
+        suffixes = {}
+        pending = []
+        for book in books:
+            if book.slug in taken:
+                pending.append(book)
+            taken.add(book.slug)
+
+        while pending:
+            candidates = {}
+            for book in pending:
+                base = book.slug
+                number = suffixes.get(base, 1)
+                while True:
+                    number += 1
+                    suffix = '-{}'.format(number)
+                    candidate = base[:max_length - len(suffix)] + suffix
+                    if candidate not in taken and candidate not in candidates:
+                        break
+                suffixes[base] = number
+                candidates[candidate] = book
+            # candidates are checked against the database in one query per round
+            in_database = set(Book.objects.filter(slug__in=candidates).values_list('slug', flat=True))
+            taken.update(in_database)
+            pending = []
+            for candidate, book in candidates.items():
+                if candidate in in_database:
+                    pending.append(book)
+                else:
+                    book.slug = candidate
+                    taken.add(candidate)
+
+    @staticmethod
+    def with_relations(books):
+        """
+        Books with author and category attached, as search documents need their names
+        """
+        authors = User.objects.in_bulk({book.author_id for book in books})
+        categories = Category.objects.in_bulk({book.category_id for book in books})
+        for book in books:
+            book.author = authors[book.author_id]
+            book.category = categories[book.category_id]
+        return books
+
+    def skip(self, line_number, error):
+        self.counts['skipped'] += 1
+        if self.counts['skipped'] <= MAX_ERRORS_SHOWN:
+            self.stderr.write("Line {}: {}".format(line_number, error))
+        elif self.counts['skipped'] == MAX_ERRORS_SHOWN + 1:
+            self.stderr.write("More rows skipped...")
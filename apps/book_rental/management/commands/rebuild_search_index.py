@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.book_rental import search
+from apps.book_rental.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Reindexes books for full text search, needed after bulk writes which skip signals.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since-id',
+                            type=int,
+                            help='Only (re)index books with id above this e.g. after a bulk import.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['since_id'] is None:
+            count = search.rebuild_index()
+        else:
+            count = search.index_books(Book.objects.filter(id__gt=options['since_id']))
+        self.stdout.write(self.style.SUCCESS("Indexed {} books in {:.1f}s".format(count, time.perf_counter() - start)))
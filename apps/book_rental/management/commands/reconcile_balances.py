@@ -0,0 +1,60 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.book_rental import ledger
+from apps.book_rental.models import UserBalance
+
+
+class Command(BaseCommand):
+    help = 'Checks ledger (UserBalance) against a full recomputation from rented books.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tolerance',
+                            default=0.005,
+                            type=float,
+                            help='Allowed difference in charges caused by floating point arithmetic.')
+        parser.add_argument('--fix',
+                            action='store_true',
+                            help='Rebuild balances of the users which do not match.')
+
+    def handle(self, *args, **options):
+        today = date.today()
+        computed = ledger.compute_balances()
+        stored = {balance.user_id: balance for balance in UserBalance.objects.all()}
+
+        mismatched = []
+        for user_id in sorted(set(computed) | set(stored)):
+            balance = computed.get(user_id) or ledger.Balance()
+            expected = UserBalance(user_id=user_id, settled_charges=balance.settled_charges)
+            expected.set_open_rentals(balance.open_rentals)
+            actual = stored.get(user_id) or UserBalance(user_id=user_id)
+
+            if self.matches(expected, actual, today, options['tolerance']):
+                continue
+            mismatched.append(user_id)
+            self.stdout.write("User {}: ledger {:.2f} (settled {:.2f}), computed {:.2f} (settled {:.2f})".format(
+                user_id, actual.total_charge(today), actual.settled_charges,
+                expected.total_charge(today), expected.settled_charges))
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS("Ledger of {} users is reconciled".format(len(stored))))
+            return
+
+        if not options['fix']:
+            raise CommandError("{} users do not match, run with --fix to rebuild them".format(len(mismatched)))
+
+        ledger.rebuild_balances(mismatched)
+        self.stdout.write(self.style.SUCCESS("Rebuilt balances of {} users".format(len(mismatched))))
+
+    @staticmethod
+    def matches(expected, actual, as_of, tolerance):
+        expected_rentals, actual_rentals = expected.get_open_rentals(), actual.get_open_rentals()
+        return (
+            abs(expected.settled_charges - actual.settled_charges) <= tolerance
+            and expected_rentals.keys() == actual_rentals.keys()
+            and all(expected_rentals[key][0] == actual_rentals[key][0]
+                    and abs(expected_rentals[key][1] - actual_rentals[key][1]) <= tolerance
+                    for key in expected_rentals)
+            and abs(expected.total_charge(as_of) - actual.total_charge(as_of)) <= tolerance
+        )
@@ -1,21 +1,109 @@
+import copy
 import datetime
+import time
 
-from django.core.management.base import BaseCommand
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
 
+from apps.book_rental import autocomplete, ledger, search, versions
+from apps.book_rental.bulk import fill_pks
+from apps.book_rental.models import BOOKS_VERSION, Book, Category, CategoryDayCharge, RentedBook
+from apps.book_rental.tariffs import invalidate_tariff
 from apps.book_rental.tests.factories import UserFactory, CategoryFactory, BookFactory, RentedBookFactory, \
-    CategoryDayChargeFactory
+    CategoryDayChargeFactory, STANDARD_DAY_CHARGES
+
+# rows per unit of --scale, --scale 100 is a million users and ten million rentals
+SCALE_UNIT = {'users': 10000, 'authors': 400, 'books': 2000, 'rentals': 100000}
+WINDOW_DAYS = 730
+OPEN_RENTAL_DAYS = 60
+# tariffs were raised twice in the window, from these factors of the standard day charges
+TARIFF_VERSIONS = (0.8, 0.9, 1)
+WORDS = ('the', 'da', 'vinci', 'code', 'dark', 'matter', 'kite', 'runner', 'angels', 'demons', 'lost',
+         'symbol', 'origin', 'inferno', 'digital', 'fortress', 'deception', 'point', 'splendid', 'suns')
+
+
+def skewed(rng, size, population, exponent):
+    """
+    size indexes into range(population) drawn with Zipf like popularity, rank r is picked
+    with weight 1 / r ** exponent and ranks are shuffled over the population
+    """
+    weights = 1 / np.arange(1, population + 1) ** exponent
+    ranks = rng.choice(population, size=size, p=weights / weights.sum())
+    return rng.permutation(population)[ranks]
+
+
+def generate_rentals(seed, users, books, rentals):
+    """
+    Rentals of a seeded random generator as arrays of user and book indexes, rent and return
+    dates (days before today, return is -1 when open), paid flags and fines.
+    Popular books and active users rent most, rentals are spread over WINDOW_DAYS and about
+    one in ten, rented in the last OPEN_RENTAL_DAYS, is not returned yet.
+    Duplicates of (book, user, rent date) are dropped and rentals are in order of rent date
+    """
+    rng = np.random.default_rng(seed)
+    book = skewed(rng, rentals, books, 0.9)
+    user = skewed(rng, rentals, users, 0.7)
+    is_open = rng.random(rentals) < 0.1
+    rented = np.where(is_open, rng.integers(0, OPEN_RENTAL_DAYS, rentals), rng.integers(0, WINDOW_DAYS, rentals))
+    # mostly a week or two, some are kept for months
+    duration = np.ceil(rng.lognormal(np.log(10), 0.8, rentals)).astype(np.int64)
+    returned = np.where(is_open, -1, np.maximum(rented - duration, 0))
+    # bills of rentals returned long ago are mostly paid
+    paid = ~is_open & (rng.random(rentals) < np.where(returned > 30, 0.95, 0.2))
+    fine = np.where(~is_open & (rented - returned > 30) & (rng.random(rentals) < 0.3),
+                    rng.integers(5, 51, rentals), 0).astype(np.float64)
+
+    key = (book.astype(np.int64) * users + user) * WINDOW_DAYS + rented
+    _, first = np.unique(key, return_index=True)
+    keep = first[np.argsort(-rented[first], kind='stable')]
+    return {
+        'user': user[keep], 'book': book[keep], 'rented': rented[keep], 'returned': returned[keep],
+        'paid': paid[keep], 'fine': fine[keep],
+    }
 
 
 class Command(BaseCommand):
-    help = 'Seeds the database.'
+    help = 'Seeds the database with sample data, or with a large generated data set when --scale is given.'
 
     def add_arguments(self, parser):
         parser.add_argument('--books',
-                            default=150,
+                            default=None,
+                            type=int,
+                            help='The number of fake books to create, default is 150, '
+                                 'or {} per unit of --scale.'.format(SCALE_UNIT['books']))
+        parser.add_argument('--scale',
+                            type=float,
+                            help='Generates {users} users, {books} books and {rentals} rentals per unit '
+                                 'with bulk inserts, e.g. --scale 100.'.format(**SCALE_UNIT))
+        parser.add_argument('--seed',
+                            default=0,
                             type=int,
-                            help='The number of fake books to create.')
+                            help='Seed of the random generator, same seed gives the same data (on the same day).')
+        parser.add_argument('--chunk-size',
+                            default=10000,
+                            type=int,
+                            help='Number of rows written in one transaction, with --scale.')
 
     def handle(self, *args, **options):
+        if options['scale'] is None:
+            self.seed_sample(options['books'] if options['books'] is not None else 150)
+            return
+        if options['scale'] <= 0 or options['chunk_size'] < 1:
+            raise CommandError("--scale and --chunk-size should be positive")
+        counts = {name: max(int(unit * options['scale']), 1) for name, unit in SCALE_UNIT.items()}
+        if options['books'] is not None:
+            counts['books'] = options['books']
+        self.seed_scale(counts, options['seed'], options['chunk_size'])
+
+    def seed_sample(self, books):
+        """
+        A few users, the standard categories and rentals to try the API with, plus fake books
+        """
         user1 = UserFactory(first_name='User 1',
                             username='admin',
                             is_superuser=True,
@@ -26,7 +114,7 @@ class Command(BaseCommand):
         user2 = UserFactory(first_name='User 2', is_staff=True)
         user3 = UserFactory(first_name='User 3')
 
-        novel_cat = CategoryFactory(name='novels')
+        novel_cat = CategoryFactory(name='novels', created_by=user1)
         novel_dayswise1 = novel_cat.dayswise_charges.first()
         novel_dayswise1.delete()
 
@@ -37,14 +125,16 @@ class Command(BaseCommand):
             per_day_charge=1.5,
             min_days=3,
             min_charge=4.5,
+            created_by=user1,
         )
         novel_dayswise2 = CategoryDayChargeFactory(
             category=novel_cat,
             days_from=4,
             per_day_charge=1.5,
+            created_by=user1,
         )
 
-        regular_cat = CategoryFactory(name='regular')
+        regular_cat = CategoryFactory(name='regular', created_by=user1)
         regular_dayswise1 = regular_cat.dayswise_charges.first()
         regular_dayswise1.delete()
 
@@ -55,14 +145,16 @@ class Command(BaseCommand):
             per_day_charge=1,
             min_days=2,
             min_charge=2,
+            created_by=user1,
         )
         regular_dayswise2 = CategoryDayChargeFactory(
             category=regular_cat,
             days_from=3,
             per_day_charge=1.5,
+            created_by=user1,
         )
 
-        fiction_cat = CategoryFactory(name='fiction')
+        fiction_cat = CategoryFactory(name='fiction', created_by=user1)
         fiction_dayswise1 = fiction_cat.dayswise_charges.first()
         fiction_dayswise1.delete()
 
@@ -73,6 +165,7 @@ class Command(BaseCommand):
             per_day_charge=1,
             min_days=2,
             min_charge=2,
+            created_by=user1,
         )
         fiction_dayswise2 = CategoryDayChargeFactory(
             category=fiction_cat,
@@ -81,52 +174,227 @@ class Command(BaseCommand):
             per_day_charge=1.5,
             min_days=5,
             min_charge=4.5,
+            created_by=user1,
         )
         fiction_dayswise3 = CategoryDayChargeFactory(
             category=fiction_cat,
             days_from=31,
             per_day_charge=2,
+            created_by=user1,
         )
 
         fiction_book = BookFactory(name="Fiction book",
-                                   category=fiction_cat)
+                                   category=fiction_cat,
+                                   author=user3,
+                                   created_by=user1)
 
         regular_book = BookFactory(name="Regular book",
-                                   category=regular_cat)
+                                   category=regular_cat,
+                                   author=user3,
+                                   created_by=user1)
 
         novel_book = BookFactory(name="Novel book",
-                                 category=novel_cat)
+                                 category=novel_cat,
+                                 author=user3,
+                                 created_by=user1)
 
         RentedBookFactory(
             user=user2,
             book=fiction_book,
             rent_date=datetime.date(2020, 5, 1),
-            return_date=datetime.date(2020, 5, 10)
+            return_date=datetime.date(2020, 5, 10),
+            created_by=user1,
         )
         RentedBookFactory(
             user=user2,
             book=regular_book,
             rent_date=datetime.date(2020, 5, 1),
-            return_date=datetime.date(2020, 6, 4)
+            return_date=datetime.date(2020, 6, 4),
+            created_by=user1,
         )
 
         RentedBookFactory(
             user=user2,
             book=novel_book,
             rent_date=datetime.date(2020, 5, 1),
-            return_date=datetime.date(2020, 6, 1)
+            return_date=datetime.date(2020, 6, 1),
+            created_by=user1,
         )
 
         RentedBookFactory(
             user=user3,
             book=regular_book,
             rent_date=datetime.date(2019, 5, 1),
-            return_date=datetime.date(2020, 5, 1)
+            return_date=datetime.date(2020, 5, 1),
+            created_by=user1,
         )
 
         RentedBookFactory(
             user=user3,
             book=novel_book,
             rent_date=datetime.date(2019, 5, 1),
-            return_date=datetime.date(2020, 5, 1)
+            return_date=datetime.date(2020, 5, 1),
+            created_by=user1,
         )
+
+        categories = [fiction_cat, regular_cat, novel_cat]
+        for number in range(max(books - 3, 0)):
+            BookFactory(category=categories[number % len(categories)], author=user3, created_by=user1)
+
+    def seed_scale(self, counts, seed, chunk_size):
+        """
+        Users, authors, standard categories with a tariff history, books and rentals
+        written with bulk inserts in chunks, then ledger and search index are rebuilt
+        """
+        if User.objects.filter(username='reader_0').exists():
+            raise CommandError("Database is seeded already, flush it first")
+        self.chunk_size = chunk_size
+        today = datetime.date.today()
+        start = time.perf_counter()
+
+        admin = UserFactory(first_name='User 1', username='admin', is_superuser=True, is_staff=True)
+        admin.set_password('admin123')
+        admin.save()
+        # hashing is slow on purpose, all of them share the same password
+        password = make_password('pass123')
+        readers = self.create_users('reader_{}', counts['users'], password)
+        authors = self.create_users('author_{}', counts['authors'], password)
+        categories = self.create_categories(admin, today)
+
+        rentals = generate_rentals(seed, len(readers), counts['books'], counts['rentals'])
+        rng = np.random.default_rng([seed, 1])
+        # stock left on shelf, open rentals are taken out of it
+        stock = rng.integers(1, 21, counts['books'])
+        open_rentals = np.bincount(rentals['book'][rentals['returned'] < 0], minlength=counts['books'])
+        books = self.create_books(rng, counts['books'], np.maximum(stock - open_rentals, 0), authors,
+                                  categories, admin)
+        self.create_rentals(rentals, readers, books, admin, today)
+
+        self.stdout.write("Rebuilding ledger and search index")
+        ledger.rebuild_balances()
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Seeded {} users, {} books and {} rentals in {:.1f}s".format(
+            len(readers) + len(authors) + 1, len(books), len(rentals['book']), time.perf_counter() - start)))
+
+    def write_chunks(self, label, rows, write):
+        """
+        Calls write with chunks of rows, one transaction each, reporting progress
+        """
+        start = time.perf_counter()
+        for first in range(0, len(rows), self.chunk_size):
+            with transaction.atomic():
+                write(rows[first:first + self.chunk_size])
+        elapsed = time.perf_counter() - start
+        self.stdout.write("{} {} in {:.1f}s ({:.0f} rows/s)".format(
+            len(rows), label, elapsed, len(rows) / elapsed if elapsed else 0))
+
+    def create_users(self, username, count, password):
+        """
+        Returns ids of the created users, in order of their number
+        """
+        last_id = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        users = [User(username=username.format(number), password=password) for number in range(count)]
+        self.write_chunks('users', users, User.objects.bulk_create)
+        return list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+
+    @staticmethod
+    def create_categories(admin, today):
+        """
+        Standard categories, whose day wise charges were raised twice over the rental window,
+        so that rent date pricing has versions to pick from. Returns their ids
+        """
+        window_start = timezone.make_aware(datetime.datetime.combine(
+            today - datetime.timedelta(days=WINDOW_DAYS), datetime.time()))
+        step = datetime.timedelta(days=WINDOW_DAYS // len(TARIFF_VERSIONS))
+        category_ids = []
+        for name, day_charges in sorted(STANDARD_DAY_CHARGES.items()):
+            category = Category(name=name, created_by=admin)
+            category._history_date = window_start
+            category.save()
+            # default charge added with the category is replaced by the standard ones
+            CategoryDayCharge.history.filter(category_id=category.id).update(history_date=window_start)
+            default_charge = category.dayswise_charges.get()
+            default_charge._history_date = window_start
+            default_charge.delete()
+
+            charges = [CategoryDayCharge(category=category, created_by=admin, **day_charge)
+                       for day_charge in day_charges]
+            for version, factor in enumerate(TARIFF_VERSIONS):
+                for charge, day_charge in zip(charges, day_charges):
+                    charge.per_day_charge = round(day_charge['per_day_charge'] * factor, 2)
+                    charge.min_charge = round(day_charge.get('min_charge', 0) * factor, 2)
+                    charge._history_date = window_start + step * version
+                    charge.save()
+            category_ids.append(category.id)
+        invalidate_tariff()
+        return category_ids
+
+    def create_books(self, rng, count, quantities, authors, categories, admin):
+        """
+        Returns ids of the created books, a few authors wrote most of them
+        """
+        words = rng.integers(0, len(WORDS), (count, 3))
+        author = skewed(rng, count, len(authors), 1.2)
+        category = rng.integers(0, len(categories), count)
+        now = timezone.now()
+        books = []
+        for number in range(count):
+            name = '{} {}'.format(' '.join(WORDS[word] for word in words[number]).title(), number)
+            book = Book(name=name, slug=slugify(name), description='Description of {}'.format(name),
+                        author_id=authors[author[number]], category_id=categories[category[number]],
+                        book_quantity=int(quantities[number]), created_by=admin)
+            book._history_date = now
+            books.append(book)
+        last_id = Book.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        def write(chunk):
+            Book.objects.bulk_create(chunk)
+            fill_pks(Book, chunk, ('slug',))
+            Book.history.bulk_history_create(chunk, default_user=admin)
+
+        self.write_chunks('books', books, write)
+        versions.bump(BOOKS_VERSION)
+        autocomplete.invalidate()
+        return list(Book.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+
+    def create_rentals(self, rentals, readers, books, admin, today):
+        """
+        Rentals with their history, created on rent date and changed again on return date
+        """
+        dates = {}
+
+        def history_date(days_ago):
+            if days_ago not in dates:
+                dates[days_ago] = timezone.make_aware(datetime.datetime.combine(
+                    today - datetime.timedelta(days=int(days_ago)), datetime.time(12)))
+            return dates[days_ago]
+
+        def write(chunk):
+            rented = []
+            for user, book, days_ago, returned_ago, paid, fine in chunk:
+                rented_book = RentedBook(user_id=readers[user], book_id=books[book],
+                                         rent_date=today - datetime.timedelta(days=int(days_ago)),
+                                         has_charges_paid=bool(paid), fine_charged=float(fine), created_by=admin)
+                if returned_ago >= 0:
+                    rented_book.return_date = today - datetime.timedelta(days=int(returned_ago))
+                rented.append(rented_book)
+            RentedBook.objects.bulk_create(rented)
+            fill_pks(RentedBook, rented, ('book_id', 'user_id', 'rent_date'))
+
+            # created open and unpaid on rent date, returned ones were changed on return date
+            created = []
+            returned = []
+            for rented_book, (_, _, days_ago, returned_ago, _, _) in zip(rented, chunk):
+                created_book = copy.copy(rented_book)
+                created_book.return_date, created_book.has_charges_paid, created_book.fine_charged = None, False, 0
+                created_book._history_date = history_date(days_ago)
+                created.append(created_book)
+                if returned_ago >= 0:
+                    rented_book._history_date = history_date(returned_ago)
+                    returned.append(rented_book)
+            RentedBook.history.bulk_history_create(created, default_user=admin)
+            RentedBook.history.bulk_history_create(returned, update=True, default_user=admin)
+
+        rows = list(zip(rentals['user'].tolist(), rentals['book'].tolist(), rentals['rented'].tolist(),
+                        rentals['returned'].tolist(), rentals['paid'].tolist(), rentals['fine'].tolist()))
+        self.write_chunks('rentals', rows, write)
@@ -0,0 +1,15 @@
+from apps.book_rental import versions
+
+
+class VersionCheckMiddleware:
+    """
+    Drops per process caches (compiled tariffs, autocomplete) another process changed,
+    before the request reads them, see versions.py
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        versions.check()
+        return self.get_response(request)
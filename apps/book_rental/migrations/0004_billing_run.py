@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_rental', '0003_auto_20200618_1620'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateField(help_text='Date till which not returned books are charged')),
+                ('chunk_size', models.IntegerField(help_text='Number of primary keys billed in a chunk')),
+                ('started_at', models.DateTimeField(auto_now_add=True, help_text='Time at which run was started')),
+                ('finished_at', models.DateTimeField(blank=True, help_text='Time at which all the chunks were billed', null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChargeSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_charge', models.FloatField(help_text='Total charge of the rented book as on billing date')),
+                ('billing_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='book_rental.BillingRun')),
+                ('rented_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='book_rental.RentedBook')),
+            ],
+            options={
+                'unique_together': {('billing_run', 'rented_book')},
+            },
+        ),
+        migrations.CreateModel(
+            name='BillingChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_id', models.IntegerField()),
+                ('end_id', models.IntegerField()),
+                ('rows', models.IntegerField(help_text='Number of rentals billed in this chunk')),
+                ('billing_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='book_rental.BillingRun')),
+            ],
+            options={
+                'unique_together': {('billing_run', 'start_id')},
+            },
+        ),
+    ]
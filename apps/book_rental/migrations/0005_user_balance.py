@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('book_rental', '0004_billing_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBalance',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('settled_charges', models.FloatField(default=0, help_text='Charges of returned books which are not paid yet')),
+                ('open_rentals', models.TextField(default='{}', help_text='Not returned books grouped on category and rent date')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='Time at which balance was updated')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_rental', '0005_user_balance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingrun',
+            name='pricing',
+            field=models.CharField(choices=[('current', 'current'), ('rent_date', 'rent_date')], default='current', help_text='Tariff used for charging, current one or the one active on rent date', max_length=10),
+        ),
+    ]
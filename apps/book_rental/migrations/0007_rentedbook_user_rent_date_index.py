@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_rental', '0006_billing_run_pricing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rentedbook',
+            index=models.Index(fields=['user', 'rent_date', 'id'], name='rentedbook_user_rent_date_id'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+# Search table of every vendor, written out here so that later changes of search.py
+# do not change what this migration does. There is no foreign key to book_rental_book:
+# Django does not know of it, and flush would TRUNCATE books without CASCADE.
+# Documents of deleted books are removed by the post_delete signal of Book (see models.py)
+CREATE_SEARCH_TABLE = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE book_rental_book_search "
+        "USING fts5(name, author, category, description, tokenize='unicode61 remove_diacritics 2')",
+    ],
+    'postgresql': [
+        'CREATE TABLE book_rental_book_search (book_id integer PRIMARY KEY, document tsvector NOT NULL)',
+        'CREATE INDEX book_rental_book_search_document ON book_rental_book_search USING GIN (document)',
+    ],
+    'mysql': [
+        'CREATE TABLE book_rental_book_search ('
+        'book_id integer PRIMARY KEY, '
+        'name longtext NOT NULL, author longtext NOT NULL, category longtext NOT NULL, '
+        'description longtext NOT NULL, '
+        'FULLTEXT INDEX book_rental_book_search_document (name, author, category, description), '
+        'FULLTEXT INDEX book_rental_book_search_name (name)'
+        ') ENGINE=InnoDB',
+    ],
+}
+
+
+def create_search_table(apps, schema_editor):
+    for sql in CREATE_SEARCH_TABLE[schema_editor.connection.vendor]:
+        schema_editor.execute(sql)
+
+
+def drop_search_table(apps, schema_editor):
+    schema_editor.execute('DROP TABLE IF EXISTS book_rental_book_search')
+
+
+class Migration(migrations.Migration):
+    """
+    Full text index of books, native to the database (see search.py).
+    Existing books are indexed with `manage.py rebuild_search_index`
+    """
+
+    dependencies = [
+        ('book_rental', '0007_rentedbook_user_rent_date_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_rental', '0008_book_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalrentedbook',
+            name='final_charge',
+            field=models.FloatField(blank=True, help_text='Rent charge frozen when book was returned through API, fine is charged on top of it', null=True),
+        ),
+        migrations.AddField(
+            model_name='rentedbook',
+            name='final_charge',
+            field=models.FloatField(blank=True, help_text='Rent charge frozen when book was returned through API, fine is charged on top of it', null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def drop_book_foreign_key(apps, schema_editor):
+    """
+    Search tables created on PostgreSQL by an earlier 0008_book_search referenced
+    book_rental_book, which made flush (TRUNCATE without CASCADE) fail
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE book_rental_book_search '
+                              'DROP CONSTRAINT IF EXISTS book_rental_book_search_book_id_fkey')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_rental', '0009_rentedbook_final_charge'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_book_foreign_key, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,26 @@
+import json
 from datetime import date
 
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Func, IntegerField, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.utils.text import slugify
-from simple_history.models import HistoricalRecords
+from simple_history.signals import post_create_historical_record
+
+from apps.book_rental import autocomplete, ledger, search, versions
+from apps.book_rental.history import BufferedHistoricalRecords
+from apps.book_rental.tariffs import CURRENT_TARIFF, PRICING_CHOICES, get_tariffs, invalidate_tariff, tariff_for
 
 CATEGORY_CHOICES = (
     ('regular', 'Regular'),
     ('fiction', 'Fiction'),
     ('novels', 'Novels'),
 )
+# version of books and categories (see versions.py), writes bypassing signals have to bump it themselves
+BOOKS_VERSION = 'books'
 
 
 class AuditMixin(models.Model):
@@ -41,7 +50,8 @@ class AuditMixin(models.Model):
                                       null=True,
                                       help_text='Time at which object was updated')
 
-    history = HistoricalRecords(inherit=True)
+    # records are written in bulk after commit when settings.HISTORY_BUFFERED is on
+    history = BufferedHistoricalRecords(inherit=True)
 
     class Meta:
         abstract = True
@@ -133,10 +143,52 @@ class CategoryDayCharge(AuditMixin):
     def __str__(self):
         return "{} to {}: {}".format(self.days_from, self.days_to or "-", self.per_day_charge)
 
+    def save(self, *args, **kwargs):
+        """
+        Saved in a transaction so that ledger is repriced with the change (see reprice_user_balances)
+        """
+        with transaction.atomic():
+            super(CategoryDayCharge, self).save(*args, **kwargs)
+
     class Meta:
         unique_together = ('category', 'days_from')
 
 
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_tariff(sender, instance, **kwargs):
+    """
+    Drops compiled tariff of the category from the cache
+    """
+    invalidate_tariff(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=CategoryDayCharge)
+def invalidate_day_charge_tariff(sender, instance, **kwargs):
+    """
+    Any change in day wise charges needs tariff of its category to be compiled again
+    """
+    invalidate_tariff(instance.category_id)
+
+
+@receiver(post_create_historical_record, sender=CategoryDayCharge.history.model)
+def invalidate_tariff_history(sender, history_instance, **kwargs):
+    """
+    Tariff histories are replayed from these records, which with HISTORY_BUFFERED
+    are written after the transaction commits i.e. after post_save invalidated them
+    """
+    invalidate_tariff(history_instance.category_id)
+
+
+@receiver([post_save, post_delete], sender=CategoryDayCharge)
+def reprice_user_balances(sender, instance, raw=False, **kwargs):
+    """
+    Returned books are settled in ledger on tariff of their category,
+    which changes with day wise charges. Has to run after tariff is invalidated
+    """
+    if not raw:
+        ledger.reprice_category(instance.category_id)
+
+
 class Book(AuditMixin):
     """
     Stores Book related data.
@@ -170,10 +222,191 @@ class Book(AuditMixin):
     def save(self, *args, **kwargs):
         """
         Before saving change the slug with name,
-        which letter will be used in hyperlinked and urls
+        which letter will be used in hyperlinked and urls.
+        Saved in a transaction so that ledger moves with the category (see move_rentals_in_ledger)
         """
         self.slug = slugify(self.name)
-        super(Book, self).save(*args, **kwargs)
+        with transaction.atomic(savepoint=False):
+            super(Book, self).save(*args, **kwargs)
+
+
+@receiver(pre_save, sender=Book)
+def remember_stored_category(sender, instance, raw=False, **kwargs):
+    """
+    Ledger needs to know whether the book moved to another category
+    """
+    if not raw and instance.pk:
+        instance._stored_category_id = Book.objects.filter(pk=instance.pk).values_list(
+            'category_id', flat=True).first()
+
+
+@receiver(post_save, sender=Book)
+def move_rentals_in_ledger(sender, instance, raw=False, **kwargs):
+    """
+    Rentals of the book are kept in ledger under its category
+    """
+    stored_category_id = instance.__dict__.pop('_stored_category_id', None)
+    if not raw and stored_category_id is not None and stored_category_id != instance.category_id:
+        ledger.rebuild_book_balances([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Category)
+def bump_books_version(sender, **kwargs):
+    """
+    ETag of the books list changes with it, see etags.py
+    """
+    versions.bump(BOOKS_VERSION)
+
+
+@receiver(post_save, sender=Book)
+def index_book_for_search(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_book(instance)
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_from_search(sender, instance, **kwargs):
+    search.remove_books([instance.id])
+
+
+@receiver(post_save, sender=Book)
+def update_book_autocomplete(sender, instance, raw=False, **kwargs):
+    """
+    In memory autocomplete index is changed once the transaction commits,
+    so that rolled back books never show up
+    """
+    if not raw:
+        book_id, name, slug = instance.id, instance.name, instance.slug
+        transaction.on_commit(lambda: autocomplete.update_book(book_id, name, slug))
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_from_autocomplete(sender, instance, **kwargs):
+    book_id = instance.id
+    transaction.on_commit(lambda: autocomplete.remove_book(book_id))
+
+
+AUTHOR_NAME_FIELDS = ('first_name', 'last_name', 'username')
+
+
+@receiver(pre_save, sender=Category)
+def remember_stored_category_name(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk:
+        instance._stored_name = Category.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Category)
+def index_category_books_for_search(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Category name is part of search documents of its books, they are indexed again when it changed
+    """
+    stored_name = instance.__dict__.pop('_stored_name', None)
+    if not created and not raw and stored_name != instance.name:
+        search.index_books(instance.book_set.all())
+
+
+@receiver(pre_save, sender=User)
+def remember_stored_author_name(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Saves not touching the name e.g. last_login updates are not looked up
+    """
+    if raw or not instance.pk:
+        return
+    if update_fields is not None and not set(AUTHOR_NAME_FIELDS) & set(update_fields):
+        return
+    instance._stored_author_name = User.objects.filter(pk=instance.pk).values_list(*AUTHOR_NAME_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def index_author_books_for_search(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Author name is part of search documents of the books and of the books list
+    (its ETag is BOOKS_VERSION), both change when the name changed
+    """
+    stored_name = instance.__dict__.pop('_stored_author_name', None)
+    if created or raw or stored_name is None:
+        return
+    if stored_name == tuple(getattr(instance, field) for field in AUTHOR_NAME_FIELDS):
+        return
+    versions.bump(BOOKS_VERSION)
+    search.index_books(Book.objects.filter(author=instance))
+
+
+class DaysBetween(Func):
+    """
+    Number of days between two dates i.e. end - start, as an integer
+    """
+    output_field = IntegerField()
+    arity = 2
+
+    def as_sql(self, compiler, connection, **extra_context):
+        end, start = (compiler.compile(expression) for expression in self.get_source_expressions())
+        template = {
+            'sqlite': 'CAST(julianday(%s) - julianday(%s) AS INTEGER)',
+            'mysql': 'DATEDIFF(%s, %s)',
+            'postgresql': '((%s)::date - (%s)::date)',
+        }.get(connection.vendor, '(%s - %s)')
+        return template % (end[0], start[0]), (*end[1], *start[1])
+
+
+def _float(value):
+    return Cast(Value(value), output_field=FloatField())
+
+
+class RentedBookQuerySet(models.QuerySet):
+
+    def with_charges(self, as_of=None):
+        """
+        Annotates days_rented_db and total_charge_db, the database side
+        equivalents of RentedBook.days_rented and RentedBook.total_charge,
+        so rentals can be ordered, filtered and summed on charges in SQL.
+
+        Pieces of every category's compiled tariff become When clauses,
+        which makes categories ids (and tariffs, if not cached) to be fetched
+        when this method is called.
+
+        as_of is used in place of today for rentals which are not returned yet
+        """
+        tariffs = get_tariffs(Category.objects.values_list('id', flat=True))
+        days_rented = F('days_rented_db')
+
+        charge_whens = []
+        for category_id, tariff in sorted(tariffs.items()):
+            for piece in tariff.pieces:
+                if piece.per_day_charge is None:
+                    charge = _float(piece.total)
+                else:
+                    charge = ExpressionWrapper(
+                        _float(piece.total) + (days_rented - Value(piece.days_calculated)) * _float(
+                            piece.per_day_charge),
+                        output_field=FloatField()
+                    )
+                if piece.days_upto is None:
+                    charge_whens.append(When(book__category_id=category_id, then=charge))
+                else:
+                    charge_whens.append(When(book__category_id=category_id,
+                                             days_rented_db__lte=piece.days_upto,
+                                             then=charge))
+
+        return self.annotate(
+            days_rented_db=DaysBetween(
+                Coalesce(F('return_date'), Value(as_of or date.today(), output_field=models.DateField())),
+                F('rent_date'),
+            )
+        ).annotate(
+            total_charge_db=Case(
+                When(has_charges_paid=True, then=_float(0)),
+                default=ExpressionWrapper(
+                    Coalesce(
+                        F('final_charge'),
+                        Case(*charge_whens, default=_float(0), output_field=FloatField()),
+                    ) + F('fine_charged'),
+                    output_field=FloatField()
+                ),
+                output_field=FloatField(),
+            )
+        )
 
 
 class RentedBook(AuditMixin):
@@ -203,8 +436,26 @@ class RentedBook(AuditMixin):
     fine_charged = models.FloatField(default=0,
                                      help_text='Any fine applied to User for given book')
 
+    final_charge = models.FloatField(null=True,
+                                     blank=True,
+                                     help_text='Rent charge frozen when book was returned through API, '
+                                               'fine is charged on top of it')
+
+    objects = RentedBookQuerySet.as_manager()
+
     class Meta:
         unique_together = ('book', 'user', 'rent_date')
+        indexes = [
+            # user's rentals are cursor paginated on (rent_date, id), see pagination.py
+            models.Index(fields=['user', 'rent_date', 'id'], name='rentedbook_user_rent_date_id'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Saved in a transaction so that ledger (UserBalance) changes with the rental
+        """
+        with transaction.atomic():
+            super(RentedBook, self).save(*args, **kwargs)
 
     @property
     def days_rented(self):
@@ -215,15 +466,25 @@ class RentedBook(AuditMixin):
 
     @property
     def total_charge(self):
-        """
-        Note: make sure you use prefetch_related before calling this method
-        else it will do multiple db hits
+        return self.get_total_charge()
 
+    def get_total_charge(self, as_of=None, pricing=CURRENT_TARIFF):
+        """
         Total Charges for the user for given book.
 
         If not has_charges_paid then calculate on per day basis plus any fine applied
 
         If has_charges_paid then 0 charges
+
+        Day wise charges of the category are compiled once and cached (see tariffs.py),
+        so only the book needs to be fetched, category is never hit.
+
+        as_of is used in place of today for books not returned yet,
+        pricing RENT_DATE_TARIFF charges on the tariff active on rent_date
+        instead of current tariff.
+
+        Books returned through API have their charge frozen in final_charge,
+        tariff changes after the return do not change it.
         """
         """
         Scenerios:
@@ -246,40 +507,143 @@ class RentedBook(AuditMixin):
         """
         if self.has_charges_paid:
             return 0
-        days_rented = self.days_rented
-
-        days_calculated = 0
-        total_charges = 0
-        for dayswise in self.book.category.dayswise_charges.all():
-
-            # if days_calculated is equal to days_rented means no more days left for calculation
-            if days_calculated == days_rented:
-                break
-
-            # if days_rented is less than min_days then apply min_charge
-            # e.g days_rented = 1  and (days_from = 2  : days_to = 4 , min_days= 2)
-            if dayswise.min_days and days_rented <= dayswise.min_days:
-                total_charges += dayswise.min_charge
-                break
-
-            # if days_to has no limit in this slot
-            # e.g days_rented = 4  and (days_from = 2  : days_to = -- (no limit))
-            if not dayswise.days_to:
-                total_charges += ((days_rented - days_calculated) * dayswise.per_day_charge)
-                break
-
-            # if days_rented is between days_from and days_to
-            # e.g days_rented = 4  and (days_from = 2  : days_to = 10)
-            if dayswise.days_from <= days_rented <= dayswise.days_to:
-                days_duration = days_rented - days_calculated
-                total_charges += (days_duration * dayswise.per_day_charge)
-                days_calculated += days_duration
-
-            # if days_rented is between greater days_from but less tha days_to
-            # e.g days_rented = 15  and (days_from = 2  : days_to = 10)
-            elif dayswise.days_from <= days_rented > dayswise.days_to:
-                days_duration = dayswise.days_to - dayswise.days_from
-                total_charges += (days_duration * dayswise.per_day_charge)
-                days_calculated += days_duration
-
-        return total_charges + self.fine_charged
+        if self.final_charge is not None:
+            return self.final_charge + self.fine_charged
+        if as_of is None or self.return_date:
+            days_rented = self.days_rented
+        else:
+            days_rented = (as_of - self.rent_date).days
+        tariff = tariff_for(self.book.category_id, self.rent_date, pricing)
+        return tariff.charge(days_rented) + self.fine_charged
+
+
+@receiver(pre_save, sender=RentedBook)
+def remember_stored_rental_state(sender, instance, raw=False, **kwargs):
+    """
+    Ledger needs to know what rental was before the change
+    """
+    if not raw:
+        instance._stored_rental_state = ledger.stored_rental_state(instance.pk) if instance.pk else None
+
+
+@receiver(post_save, sender=RentedBook)
+def record_rental_in_ledger(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ledger.record_rental_change(instance.__dict__.pop('_stored_rental_state', None),
+                                    ledger.rental_state(instance))
+
+
+@receiver(post_delete, sender=RentedBook)
+def remove_rental_from_ledger(sender, instance, **kwargs):
+    ledger.record_rental_change(ledger.rental_state(instance), None)
+
+
+class UserBalance(models.Model):
+    """
+    Outstanding balance of a user, maintained by ledger.py
+
+    Returned books are settled into settled_charges,
+    not returned books are kept in open_rentals as JSON
+    {"<category_id>:<rent_date>": [count, fine]} and are priced when balance is asked.
+    """
+    user = models.OneToOneField('auth.User',
+                                primary_key=True,
+                                related_name='balance',
+                                on_delete=models.CASCADE)
+
+    settled_charges = models.FloatField(default=0,
+                                        help_text='Charges of returned books which are not paid yet')
+
+    open_rentals = models.TextField(default='{}',
+                                    help_text='Not returned books grouped on category and rent date')
+
+    updated_at = models.DateTimeField(auto_now=True,
+                                      help_text='Time at which balance was updated')
+
+    def __str__(self):
+        return "Balance of {}".format(self.user_id)
+
+    def get_open_rentals(self):
+        return json.loads(self.open_rentals)
+
+    def set_open_rentals(self, open_rentals):
+        self.open_rentals = json.dumps(open_rentals, sort_keys=True)
+
+    def open_charges(self, as_of=None):
+        """
+        Charges of not returned books till as_of, today by default
+        """
+        as_of = as_of or date.today()
+        open_rentals = [(key.split(':'), count, fine) for key, (count, fine) in self.get_open_rentals().items()]
+        tariffs = get_tariffs(int(category_id) for (category_id, _), _, _ in open_rentals)
+        return sum(
+            count * tariffs[int(category_id)].charge((as_of - date.fromisoformat(rent_date)).days) + fine
+            for (category_id, rent_date), count, fine in open_rentals
+        )
+
+    def total_charge(self, as_of=None):
+        return self.settled_charges + self.open_charges(as_of)
+
+
+class BillingRun(models.Model):
+    """
+    A batch billing run of outstanding charges as on given date,
+    see compute_charges management command.
+
+    RentedBook table is billed in chunks of primary key ranges,
+    every billed chunk is recorded so that a crashed run can be resumed.
+    """
+    as_of = models.DateField(help_text='Date till which not returned books are charged')
+
+    pricing = models.CharField(max_length=10,
+                               default=CURRENT_TARIFF,
+                               choices=[(pricing, pricing) for pricing in PRICING_CHOICES],
+                               help_text="Tariff used for charging, current one or the one active on rent date")
+
+    chunk_size = models.IntegerField(help_text='Number of primary keys billed in a chunk')
+
+    started_at = models.DateTimeField(auto_now_add=True,
+                                      help_text='Time at which run was started')
+
+    finished_at = models.DateTimeField(null=True,
+                                       blank=True,
+                                       help_text='Time at which all the chunks were billed')
+
+    def __str__(self):
+        return "Billing as of {}".format(self.as_of)
+
+
+class BillingChunk(models.Model):
+    """
+    Primary key range [start_id, end_id) of RentedBook billed in a BillingRun
+    """
+    billing_run = models.ForeignKey(BillingRun,
+                                    related_name='chunks',
+                                    on_delete=models.CASCADE)
+
+    start_id = models.IntegerField()
+
+    end_id = models.IntegerField()
+
+    rows = models.IntegerField(help_text='Number of rentals billed in this chunk')
+
+    class Meta:
+        unique_together = ('billing_run', 'start_id')
+
+
+class ChargeSnapshot(models.Model):
+    """
+    Outstanding charge of a rented book as computed by a BillingRun
+    """
+    billing_run = models.ForeignKey(BillingRun,
+                                    related_name='snapshots',
+                                    on_delete=models.CASCADE)
+
+    rented_book = models.ForeignKey(RentedBook,
+                                    related_name='+',
+                                    on_delete=models.CASCADE)
+
+    total_charge = models.FloatField(help_text='Total charge of the rented book as on billing date')
+
+    class Meta:
+        unique_together = ('billing_run', 'rented_book')
@@ -0,0 +1,157 @@
+"""
+Keyset (seek) pagination.
+
+Pages are read with e.g. WHERE (rent_date, id) > (last rent_date, last id) instead
+of OFFSET, so with an index on the ordering every page is one index range scan,
+no matter how deep it is. Cursor is the opaque, base64 encoded position of the
+last row of the previous page.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def keyset_filter(ordering, position):
+    """
+    Q for rows after position in ascending ordering, last field of ordering should be unique e.g.
+    ('rent_date', 'id') -> Q(rent_date__gt=rent_date) | Q(rent_date=rent_date, id__gt=id)
+    """
+    condition = Q()
+    for index, field in enumerate(ordering):
+        equal = {previous: value for previous, value in zip(ordering[:index], position)}
+        condition |= Q(**equal, **{'{}__gt'.format(field): position[index]})
+    return condition
+
+
+def encode_cursor(position):
+    """
+    URL safe base64 of the position without '=' padding
+    """
+    encoded = urlsafe_b64encode(json.dumps([str(value) for value in position]).encode('ascii'))
+    return encoded.decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padding = '=' * (-len(cursor) % 4)
+    return json.loads(urlsafe_b64decode((cursor + padding).encode('ascii')).decode('ascii'))
+
+
+def estimated_count(queryset):
+    """
+    Row count of a not filtered queryset from planner statistics on PostgreSQL and MySQL,
+    which is instant on tables of millions of rows. Exact COUNT(*) otherwise
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    estimate = None
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+                estimate = cursor.fetchone()[0]
+            elif connection.vendor == 'mysql':
+                cursor.execute('SELECT TABLE_ROWS FROM information_schema.TABLES '
+                               'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s', [table])
+                row = cursor.fetchone()
+                estimate = row[0] if row else None
+    # never analysed tables have no (-1 on PostgreSQL 14+) statistics
+    if estimate is None or estimate < 0:
+        return queryset.count()
+    return estimate
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward only cursor pagination over ascending ordering
+    """
+    ordering = ('id',)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.get_position(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(self.ordering, position))
+
+        # one extra row tells if there is a next page, without counting
+        results = list(queryset.order_by(*self.ordering)[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.next_position = [getattr(results[-1], field) for field in self.ordering] if self.has_next else None
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_position(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = decode_cursor(encoded)
+            if len(position) != len(self.ordering):
+                raise ValueError
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.ordering, position)]
+        except (TypeError, ValueError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class BookPagination(KeysetPagination):
+    """
+    Books in order of id. Count is left out unless asked with ?count=1,
+    it is estimated when books are not filtered (see estimated_count)
+    """
+    ordering = ('id',)
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = estimated_count(queryset)
+        return super(BookPagination, self).paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super(BookPagination, self).get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+            response.data.move_to_end('count', last=False)
+        return response
+
+
+class RentedBookPagination(KeysetPagination):
+    """
+    User's rentals oldest first, backed by index on RentedBook(user, rent_date, id)
+    """
+    ordering = ('rent_date', 'id')
@@ -0,0 +1,286 @@
+"""
+Renting and returning books.
+
+Stock (Book.book_quantity) is only changed with conditional UPDATEs e.g.
+
+    UPDATE book SET book_quantity = book_quantity - 1 WHERE id = %s AND book_quantity > 0
+
+so no copy is read before it is written, and concurrent checkouts of the
+last copies can not oversell whatever the isolation level is. In the same way,
+of concurrent returns of a rental only the one which sets return_date wins.
+Writes come before reads, so that on SQLite transactions wait for each other
+instead of failing to upgrade their read locks.
+
+Returns freeze the rent charge in RentedBook.final_charge.
+
+Batches of rentals and returns (rent_books, return_rentals) take a fixed
+number of queries whatever their size: rows are locked with a no-op UPDATE,
+read once, stock is changed with one grouped UPDATE and rentals, ledger and
+history are written in bulk. Every item gets its own result, so a batch
+partly succeeds.
+"""
+from collections import Counter
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, When
+from django.utils import timezone
+
+from apps.book_rental import ledger, versions
+from apps.book_rental.bulk import fill_pks
+from apps.book_rental.models import BOOKS_VERSION, Book, RentedBook
+from apps.book_rental.tariffs import get_tariff, get_tariffs
+
+
+class RentalError(Exception):
+    """
+    Rental could not be made or returned, message can be shown to users
+    """
+    code = 'rental_error'
+    message = 'Rental failed'
+
+    def __init__(self, message=None):
+        super(RentalError, self).__init__(message or self.message)
+
+
+class BookNotFound(RentalError):
+    code = 'book_not_found'
+    message = 'Book not found'
+
+
+class OutOfStock(RentalError):
+    code = 'out_of_stock'
+    message = 'No copy of the book is available'
+
+
+class AlreadyRented(RentalError):
+    code = 'already_rented'
+    message = 'Book is already rented by the user today'
+
+
+class UserNotFound(RentalError):
+    code = 'user_not_found'
+    message = 'User not found'
+
+
+class RentalNotFound(RentalError):
+    code = 'rental_not_found'
+    message = 'Rental not found'
+
+
+class AlreadyReturned(RentalError):
+    code = 'already_returned'
+    message = 'Book is already returned'
+
+
+def take_copy(book_id):
+    """
+    Takes one copy out of stock, False if there is none left
+    """
+    if not Book.objects.filter(id=book_id, book_quantity__gt=0).update(
+            book_quantity=F('book_quantity') - 1, updated_at=timezone.now()):
+        return False
+    versions.bump(BOOKS_VERSION)
+    return True
+
+
+def put_back_copy(book_id):
+    Book.objects.filter(id=book_id).update(book_quantity=F('book_quantity') + 1, updated_at=timezone.now())
+    versions.bump(BOOKS_VERSION)
+
+
+def change_stock(changes):
+    """
+    Adds {book_id: change} to stock of the books with one grouped UPDATE
+    """
+    changes = {book_id: change for book_id, change in changes.items() if change}
+    if not changes:
+        return
+    Book.objects.filter(id__in=changes).update(
+        book_quantity=Case(*[When(id=book_id, then=F('book_quantity') + change)
+                             for book_id, change in sorted(changes.items())],
+                           default=F('book_quantity'), output_field=IntegerField()),
+        updated_at=timezone.now(),
+    )
+    versions.bump(BOOKS_VERSION)
+
+
+def lock_rows(queryset):
+    """
+    Locks rows of the queryset till the end of transaction with a no-op UPDATE,
+    unlike select_for_update it also takes the write lock on SQLite
+    """
+    return queryset.update(updated_at=F('updated_at'))
+
+
+@transaction.atomic
+def rent_book(book_id, user_id, created_by, rent_date=None):
+    """
+    Rents a copy of the book to the user, ledger is updated by RentedBook signals
+    """
+    if not take_copy(book_id):
+        if not Book.objects.filter(id=book_id).exists():
+            raise BookNotFound()
+        raise OutOfStock()
+
+    rented_book = RentedBook(book_id=book_id, user_id=user_id, rent_date=rent_date or date.today(),
+                             created_by=created_by)
+    try:
+        rented_book.save()
+    except IntegrityError:
+        # copy is put back with rollback of the transaction
+        raise AlreadyRented()
+    return rented_book
+
+
+@transaction.atomic
+def return_rental(rented_book_id, updated_by, return_date=None, user_id=None):
+    """
+    Returns a rented book and freezes its rent charge in final_charge,
+    when user_id is given only rentals of the user can be returned
+    """
+    rented_books = RentedBook.objects.filter(id=rented_book_id)
+    if user_id is not None:
+        rented_books = rented_books.filter(user_id=user_id)
+
+    # return is claimed before anything is read, so only one of concurrent returns gets
+    # to update and the row is locked (database is reserved on SQLite) for the rest
+    returned = rented_books.filter(return_date__isnull=True).update(
+        return_date=return_date or date.today(),
+        updated_by=updated_by,
+        updated_at=timezone.now(),
+    )
+    if not returned:
+        if rented_books.exists():
+            raise AlreadyReturned()
+        raise RentalNotFound()
+
+    rented_book = rented_books.select_related('book').get()
+    rented_book.final_charge = get_tariff(rented_book.book.category_id).charge(rented_book.days_rented)
+    RentedBook.objects.filter(id=rented_book.id).update(final_charge=rented_book.final_charge)
+
+    put_back_copy(rented_book.book_id)
+    # update() skips signals, ledger and history are written here
+    ledger.record_rental_change(ledger.rental_state(rented_book)._replace(return_date=None, final_charge=None),
+                                ledger.rental_state(rented_book))
+    RentedBook.history.bulk_history_create([rented_book], update=True, default_user=updated_by)
+    return rented_book
+
+
+def create_each(rented_books, results, stock):
+    """
+    Inserts rentals one at a time, each in a savepoint. Ones which already exist
+    fail their item with AlreadyRented and give the copy back to stock.
+    Returns the created rentals
+    """
+    created = []
+    for rented_book in rented_books:
+        try:
+            with transaction.atomic():
+                RentedBook.objects.bulk_create([rented_book])
+        except IntegrityError:
+            results[next(position for position, result in enumerate(results) if result is rented_book)] = \
+                AlreadyRented()
+            stock[rented_book.book_id] += 1
+        else:
+            created.append(rented_book)
+    return created
+
+
+@transaction.atomic
+def rent_books(items, created_by, rent_date=None):
+    """
+    Rents copies of books to users, items are (book_id, user_id) pairs.
+    Returns result of every item in order, the new RentedBook or the RentalError it failed with
+    """
+    rent_date = rent_date or date.today()
+    book_ids = {book_id for book_id, _ in items}
+    user_ids = {user_id for _, user_id in items}
+
+    lock_rows(Book.objects.filter(id__in=book_ids))
+    books = Book.objects.in_bulk(book_ids)
+    user_ids = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    rented = set(RentedBook.objects.filter(book_id__in=books, user_id__in=user_ids, rent_date=rent_date)
+                 .values_list('book_id', 'user_id'))
+
+    stock = Counter({book_id: book.book_quantity for book_id, book in books.items()})
+    results = []
+    rented_books = []
+    for book_id, user_id in items:
+        if book_id not in books:
+            results.append(BookNotFound())
+        elif user_id not in user_ids:
+            results.append(UserNotFound())
+        elif (book_id, user_id) in rented:
+            results.append(AlreadyRented())
+        elif stock[book_id] <= 0:
+            results.append(OutOfStock())
+        else:
+            stock[book_id] -= 1
+            rented.add((book_id, user_id))
+            rented_book = RentedBook(book=books[book_id], user_id=user_id, rent_date=rent_date,
+                                     created_by=created_by)
+            rented_books.append(rented_book)
+            results.append(rented_book)
+    try:
+        with transaction.atomic():
+            RentedBook.objects.bulk_create(rented_books)
+    except IntegrityError:
+        # a rental of same (book, user, rent_date) was committed after the check above
+        rented_books = create_each(rented_books, results, stock)
+    if not rented_books:
+        return results
+
+    change_stock({book_id: stock[book_id] - book.book_quantity for book_id, book in books.items()})
+    fill_pks(RentedBook, rented_books, ('book_id', 'user_id', 'rent_date'))
+
+    # bulk_create skips signals, ledger and history are written here
+    ledger.record_rental_changes([(None, ledger.rental_state(rented_book)) for rented_book in rented_books])
+    RentedBook.history.bulk_history_create(rented_books, default_user=created_by)
+    return results
+
+
+@transaction.atomic
+def return_rentals(rented_book_ids, updated_by, return_date=None, user_id=None):
+    """
+    Returns rented books and freezes their charges, when user_id is given only rentals of the user can be returned.
+    Returns result of every id in order, the returned RentedBook or the RentalError it failed with
+    """
+    return_date = return_date or date.today()
+    queryset = RentedBook.objects.filter(id__in=set(rented_book_ids))
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+
+    lock_rows(queryset)
+    found = {rented_book.id: rented_book for rented_book in queryset.select_related('book')}
+    tariffs = get_tariffs({rented_book.book.category_id for rented_book in found.values()})
+
+    now = timezone.now()
+    results = []
+    changes = []
+    returned = []
+    for rented_book_id in rented_book_ids:
+        rented_book = found.get(rented_book_id)
+        if rented_book is None:
+            results.append(RentalNotFound())
+        elif rented_book.return_date is not None:
+            results.append(AlreadyReturned())
+        else:
+            previous = ledger.rental_state(rented_book)
+            rented_book.return_date = return_date
+            rented_book.updated_by = updated_by
+            rented_book.updated_at = now
+            rented_book.final_charge = tariffs[rented_book.book.category_id].charge(rented_book.days_rented)
+            changes.append((previous, ledger.rental_state(rented_book)))
+            returned.append(rented_book)
+            results.append(rented_book)
+    if not returned:
+        return results
+
+    RentedBook.objects.bulk_update(returned, ['return_date', 'final_charge', 'updated_by', 'updated_at'])
+    change_stock(Counter(rented_book.book_id for rented_book in returned))
+    # bulk_update skips signals, ledger and history are written here
+    ledger.record_rental_changes(changes)
+    RentedBook.history.bulk_history_create(returned, update=True, default_user=updated_by)
+    return results
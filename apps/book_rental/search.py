@@ -0,0 +1,194 @@
+"""
+Full text search of books over name, description, author name and category.
+
+Search documents live in their own table, book_rental_book_search (created by
+migration 0008_book_search), with the native full text index of the database:
+
+    SQLite      FTS5 virtual table, ranked with bm25
+    PostgreSQL  weighted tsvector with GIN index, ranked with ts_rank_cd
+    MySQL       InnoDB FULLTEXT index, ranked with MATCH ... AGAINST
+
+Documents are kept in sync from Book, Category and author (User) signals
+(see models.py). Bulk writes skip signals, run `manage.py rebuild_search_index`
+after them.
+"""
+import re
+from abc import ABC, abstractmethod
+
+from django.db import connections, router
+
+SEARCH_TABLE = 'book_rental_book_search'
+# name matches rank above author, category and then description
+FIELDS = ('name', 'author', 'category', 'description')
+WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+BATCH_SIZE = 1000
+
+
+def search_terms(query):
+    """
+    Words of the query, everything else (operators, quotes) is dropped
+    """
+    return re.findall(r'\w+', query.lower())
+
+
+def book_documents(books):
+    """
+    (book_id, name, author, category, description) of books with author and category selected
+    """
+    return [(book.id, book.name, book.author.get_full_name() or book.author.username,
+             book.category.name, book.description) for book in books]
+
+
+class SearchBackend(ABC):
+    """
+    Full text index of one database, id_column is the column of book ids
+    """
+    id_column = None
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @abstractmethod
+    def upsert(self, cursor, documents):
+        """
+        Inserts or replaces documents (see book_documents) with the cursor
+        """
+
+    def remove(self, book_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM {} WHERE {} = %s'.format(SEARCH_TABLE, self.id_column),
+                               [(book_id,) for book_id in book_ids])
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(SEARCH_TABLE))
+
+    def index(self, documents):
+        with self.connection.cursor() as cursor:
+            self.upsert(cursor, documents)
+
+    @abstractmethod
+    def search(self, terms, limit):
+        """
+        [(book_id, rank)] best match first
+        """
+
+
+class SQLiteSearch(SearchBackend):
+    id_column = 'rowid'
+
+    def upsert(self, cursor, documents):
+        cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(SEARCH_TABLE),
+                           [(document[0],) for document in documents])
+        cursor.executemany('INSERT INTO {} (rowid, {}) VALUES (%s, %s, %s, %s, %s)'.format(
+            SEARCH_TABLE, ', '.join(FIELDS)), documents)
+
+    def search(self, terms, limit):
+        # every word as prefix, bm25 is lower (negative) for better matches
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT rowid, -bm25({table}, {weights}) AS score FROM {table} '
+                           'WHERE {table} MATCH %s ORDER BY score DESC, rowid LIMIT %s'.format(
+                               table=SEARCH_TABLE, weights=', '.join(map(str, WEIGHTS))), [match, limit])
+            return cursor.fetchall()
+
+
+class PostgresSearch(SearchBackend):
+    id_column = 'book_id'
+    # tsvector weights of FIELDS
+    LABELS = ('A', 'B', 'C', 'D')
+
+    def upsert(self, cursor, documents):
+        document = ' || '.join("setweight(to_tsvector('simple', %s), '{}')".format(label) for label in self.LABELS)
+        cursor.executemany('INSERT INTO {} (book_id, document) VALUES (%s, {}) '
+                           'ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document'.format(
+                               SEARCH_TABLE, document), documents)
+
+    def search(self, terms, limit):
+        query = ' & '.join('{}:*'.format(term) for term in terms)
+        # ts_rank_cd weights are in {D, C, B, A} order
+        weights = '{{{}}}'.format(', '.join(str(weight / WEIGHTS[0]) for weight in reversed(WEIGHTS)))
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT book_id, ts_rank_cd(%s::float4[], document, query) AS score '
+                           "FROM {}, to_tsquery('simple', %s) query WHERE document @@ query "
+                           'ORDER BY score DESC, book_id LIMIT %s'.format(SEARCH_TABLE), [weights, query, limit])
+            return cursor.fetchall()
+
+
+class MySQLSearch(SearchBackend):
+    id_column = 'book_id'
+
+    def upsert(self, cursor, documents):
+        cursor.executemany('REPLACE INTO {} (book_id, {}) VALUES (%s, %s, %s, %s, %s)'.format(
+            SEARCH_TABLE, ', '.join(FIELDS)), documents)
+
+    def search(self, terms, limit):
+        # every word is required and matched as prefix, name matches are boosted
+        query = ' '.join('+{}*'.format(term) for term in terms)
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT book_id, MATCH ({fields}) AGAINST (%s IN BOOLEAN MODE) '
+                           '+ {boost} * MATCH (name) AGAINST (%s IN BOOLEAN MODE) AS score FROM {table} '
+                           'WHERE MATCH ({fields}) AGAINST (%s IN BOOLEAN MODE) '
+                           'ORDER BY score DESC, book_id LIMIT %s'.format(
+                               table=SEARCH_TABLE, fields=', '.join(FIELDS), boost=WEIGHTS[0]),
+                           [query, query, query, limit])
+            return cursor.fetchall()
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearch,
+    'postgresql': PostgresSearch,
+    'mysql': MySQLSearch,
+}
+
+
+def get_backend(connection=None):
+    if connection is None:
+        from apps.book_rental.models import Book
+        connection = connections[router.db_for_write(Book)]
+    return BACKENDS[connection.vendor](connection)
+
+
+def index_book(book):
+    get_backend().index(book_documents([book]))
+
+
+def index_books(queryset):
+    """
+    (Re)indexes books of the queryset in batches
+    """
+    backend = get_backend()
+    books = queryset.select_related('author', 'category').order_by('id')
+    count = 0
+    last_id = 0
+    while True:
+        batch = list(books.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            return count
+        backend.index(book_documents(batch))
+        count += len(batch)
+        last_id = batch[-1].id
+
+
+def remove_books(book_ids):
+    get_backend().remove(book_ids)
+
+
+def rebuild_index():
+    """
+    Drops all the documents and indexes every book again
+    """
+    from apps.book_rental.models import Book
+
+    get_backend().clear()
+    return index_books(Book.objects.all())
+
+
+def search_books(query, limit=20):
+    """
+    [(book_id, rank)] of books matching every word of query (as prefix), best match first
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    return get_backend().search(terms, limit)
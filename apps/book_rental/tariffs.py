@@ -0,0 +1,342 @@
+"""
+Compiled tariffs for Category day wise charges.
+
+`RentedBook.total_charge` used to walk every CategoryDayCharge row of the
+book's category on each call. A CompiledTariff walks the slabs once per
+category and turns the result into sorted pieces, where every piece is
+either a constant charge or `total + (days - days_calculated) * per_day_charge`.
+Charge for N days is then a binary search over the piece bounds plus one multiply.
+
+Compiled tariffs are cached per process and invalidated from the
+CategoryDayCharge / Category save and delete signals (see models.py).
+Anything that bypasses signals (queryset.update, bulk_create) must call
+`invalidate_tariff` itself. Other processes drop theirs once the change
+commits (see versions.py), and tariffs compiled from a change which is
+rolled back afterwards are dropped as well.
+
+Rentals are charged on the current tariff of their category by default
+(CURRENT_TARIFF pricing). With RENT_DATE_TARIFF pricing a rental is charged on
+the tariff which was active on its rent_date, resolved from the versions
+replayed out of HistoricalCategoryDayCharge (see TariffHistory).
+"""
+import weakref
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.book_rental import versions
+
+CURRENT_TARIFF = 'current'
+RENT_DATE_TARIFF = 'rent_date'
+PRICING_CHOICES = (CURRENT_TARIFF, RENT_DATE_TARIFF)
+
+Slab = namedtuple('Slab', ['days_from', 'days_to', 'per_day_charge', 'min_charge', 'min_days'])
+
+# charge = total                                          when per_day_charge is None
+# charge = total + (days - days_calculated) * per_day_charge  otherwise
+Piece = namedtuple('Piece', ['days_upto', 'total', 'days_calculated', 'per_day_charge'])
+
+
+def walk_slabs(slabs, days_rented):
+    """
+    Walks the slabs exactly the way RentedBook.total_charge always did
+    and returns the formula used for given days as
+    (total, days_calculated, per_day_charge).
+
+    per_day_charge is None when the charge does not depend on days any more
+    e.g. min_charge applied or all the slabs are exhausted
+    """
+    days_calculated = 0
+    total_charges = 0
+    for slab in slabs:
+
+        # if days_calculated is equal to days_rented means no more days left for calculation
+        if days_calculated == days_rented:
+            break
+
+        # if days_rented is less than min_days then apply min_charge
+        # e.g days_rented = 1  and (days_from = 2  : days_to = 4 , min_days= 2)
+        if slab.min_days and days_rented <= slab.min_days:
+            return total_charges + slab.min_charge, 0, None
+
+        # if days_to has no limit in this slot
+        # e.g days_rented = 4  and (days_from = 2  : days_to = -- (no limit))
+        if not slab.days_to:
+            return total_charges, days_calculated, slab.per_day_charge
+
+        # if days_rented is between days_from and days_to
+        # e.g days_rented = 4  and (days_from = 2  : days_to = 10)
+        if slab.days_from <= days_rented <= slab.days_to:
+            return total_charges, days_calculated, slab.per_day_charge
+
+        # if days_rented is between greater days_from but less tha days_to
+        # e.g days_rented = 15  and (days_from = 2  : days_to = 10)
+        elif slab.days_from <= days_rented > slab.days_to:
+            days_duration = slab.days_to - slab.days_from
+            total_charges += (days_duration * slab.per_day_charge)
+            days_calculated += days_duration
+
+    return total_charges, 0, None
+
+
+class CompiledTariff:
+    """
+    Day wise charges of a single category compiled into pieces.
+
+    The slab walk only compares days_rented against days_from, days_to,
+    min_days and the days calculated so far, which is 0 or a sum of the
+    durations of the first slabs. Between two neighbouring of those boundaries
+    the walk picks the same formula, so walking each boundary and the day after
+    it gives the exact pieces. First and last piece continue forever.
+    """
+
+    def __init__(self, slabs):
+        self.slabs = tuple(slabs)
+        self.pieces = self._compile(self.slabs)
+        self.bounds = [piece.days_upto for piece in self.pieces[:-1]]
+
+    @classmethod
+    def from_day_charges(cls, day_charges):
+        """
+        Build from CategoryDayCharge objects (or any objects having same attributes)
+        """
+        return cls(sorted(
+            (Slab(charge.days_from, charge.days_to, charge.per_day_charge,
+                  charge.min_charge, charge.min_days) for charge in day_charges),
+            key=lambda slab: slab.days_from
+        ))
+
+    @staticmethod
+    def boundaries(slabs):
+        """
+        Sorted numbers days_rented is compared against by the slab walk
+        """
+        boundaries = {0}
+        days_calculated = 0
+        for slab in slabs:
+            boundaries.update(number for number in (slab.days_from, slab.days_to, slab.min_days)
+                              if number is not None)
+            if slab.days_to is not None:
+                days_calculated += slab.days_to - slab.days_from
+                boundaries.add(days_calculated)
+        return sorted(boundaries)
+
+    @classmethod
+    def _compile(cls, slabs):
+        boundaries = cls.boundaries(slabs)
+        # a day before the first boundary, then each boundary and the day after it
+        days = [boundaries[0] - 1]
+        for boundary in boundaries:
+            days.extend(day for day in (boundary, boundary + 1) if day > days[-1])
+
+        pieces = []
+        formula = walk_slabs(slabs, days[0])
+        for day in days[1:]:
+            next_formula = walk_slabs(slabs, day)
+            if next_formula != formula:
+                pieces.append(Piece(day - 1, *formula))
+                formula = next_formula
+        pieces.append(Piece(None, *formula))
+        return pieces
+
+    def charge(self, days_rented):
+        """
+        Charges for given number of days, excluding fine
+        """
+        piece = self.pieces[bisect_left(self.bounds, days_rented)]
+        if piece.per_day_charge is None:
+            return piece.total
+        return piece.total + ((days_rented - piece.days_calculated) * piece.per_day_charge)
+
+
+@lru_cache(maxsize=4096)
+def compile_slabs(slabs):
+    """
+    CompiledTariff of a tuple of Slab sorted on days_from, tariff versions
+    having same slabs share the compiled tariff
+    """
+    return CompiledTariff(slabs)
+
+
+def end_of_day(day):
+    """
+    Tariff active on a day is the one in effect at end of that day
+    """
+    return timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min), timezone.utc)
+
+
+class TariffHistory:
+    """
+    Versions of day wise charges of a category, in order of history_date.
+    Tariff active on a date is found with a bisect over the version dates.
+    """
+
+    def __init__(self, category_id, versions):
+        self.category_id = category_id
+        self.dates = [history_date for history_date, _ in versions]
+        self.slab_sets = [slabs for _, slabs in versions]
+
+    def version_on(self, day):
+        """
+        Index of the version active on given date. Dates before first known
+        version use the first version, as it is the oldest tariff we know of
+        """
+        return max(bisect_left(self.dates, end_of_day(day)) - 1, 0)
+
+    def tariff_on(self, day):
+        if not self.slab_sets:
+            return get_tariff(self.category_id)
+        return compile_slabs(self.slab_sets[self.version_on(day)])
+
+    @classmethod
+    def replay(cls, category_id, historical_charges):
+        """
+        Builds versions from (history_date, history_type, id, Slab) rows of
+        HistoricalCategoryDayCharge ordered on history_date
+        """
+        slabs = {}
+        versions = []
+        for history_date, history_type, day_charge_id, slab in historical_charges:
+            if history_type == '-':
+                slabs.pop(day_charge_id, None)
+            else:
+                slabs[day_charge_id] = slab
+            versions.append((history_date, tuple(sorted(slabs.values(), key=lambda slab: slab.days_from))))
+        return cls(category_id, versions)
+
+
+_tariffs = {}
+_tariff_histories = {}
+# {category_id, None for all: [weak references to Invalidation]} of invalidations not committed yet
+_uncommitted = {}
+
+
+def _drop(category_id=None):
+    if category_id is None:
+        _tariffs.clear()
+        _tariff_histories.clear()
+    else:
+        _tariffs.pop(category_id, None)
+        _tariff_histories.pop(category_id, None)
+
+
+class Invalidation:
+    """
+    on_commit callback of an invalidation made in a transaction. Only the transaction
+    refers to it, the weak references of _uncommitted die when a rollback (of the
+    transaction or of a savepoint) discards it without running it
+    """
+
+    def __init__(self, category_id):
+        self.category_id = category_id
+
+    def __call__(self):
+        references = [reference for reference in _uncommitted.get(self.category_id, [])
+                      if reference() is not self]
+        if references:
+            _uncommitted[self.category_id] = references
+        else:
+            _uncommitted.pop(self.category_id, None)
+        _drop(self.category_id)
+
+
+def _drop_rolled_back():
+    """
+    Tariffs may have been compiled from a change before it committed, they are dropped
+    when the change was rolled back, i.e. its on_commit callback is gone without running
+    """
+    for category_id, references in list(_uncommitted.items()):
+        pending = [reference for reference in references if reference() is not None]
+        if len(pending) < len(references):
+            _drop(category_id)
+            if pending:
+                _uncommitted[category_id] = pending
+            else:
+                del _uncommitted[category_id]
+
+
+def get_tariffs(category_ids):
+    """
+    Returns {category_id: CompiledTariff} for given categories.
+    Categories missing from the cache are compiled with a single query
+    """
+    from apps.book_rental.models import CategoryDayCharge
+
+    if _uncommitted:
+        _drop_rolled_back()
+    category_ids = set(category_ids)
+    missing = category_ids.difference(_tariffs)
+    if missing:
+        day_charges = {category_id: [] for category_id in missing}
+        for charge in CategoryDayCharge.objects.filter(category_id__in=missing):
+            day_charges[charge.category_id].append(charge)
+        for category_id, charges in day_charges.items():
+            _tariffs[category_id] = CompiledTariff.from_day_charges(charges)
+    return {category_id: _tariffs[category_id] for category_id in category_ids}
+
+
+def get_tariff(category_id):
+    """
+    Returns CompiledTariff of a category, compiles it on first use
+    """
+    if _uncommitted:
+        _drop_rolled_back()
+    tariff = _tariffs.get(category_id)
+    if tariff is None:
+        tariff = get_tariffs([category_id])[category_id]
+    return tariff
+
+
+def get_tariff_histories(category_ids):
+    """
+    Returns {category_id: TariffHistory} for given categories.
+    Histories missing from the cache are replayed with a single query
+    """
+    from apps.book_rental.models import CategoryDayCharge
+
+    if _uncommitted:
+        _drop_rolled_back()
+    category_ids = set(category_ids)
+    missing = category_ids.difference(_tariff_histories)
+    if missing:
+        historical_charges = {category_id: [] for category_id in missing}
+        rows = CategoryDayCharge.history.filter(category_id__in=missing).order_by(
+            'history_date', 'history_id'
+        ).values_list('category_id', 'history_date', 'history_type', 'id',
+                      'days_from', 'days_to', 'per_day_charge', 'min_charge', 'min_days')
+        for category_id, history_date, history_type, day_charge_id, *slab in rows:
+            historical_charges[category_id].append((history_date, history_type, day_charge_id, Slab(*slab)))
+        for category_id, charges in historical_charges.items():
+            _tariff_histories[category_id] = TariffHistory.replay(category_id, charges)
+    return {category_id: _tariff_histories[category_id] for category_id in category_ids}
+
+
+def tariff_for(category_id, rent_date, pricing=CURRENT_TARIFF):
+    """
+    CompiledTariff to charge a rental of given category and rent_date with
+    """
+    if pricing == RENT_DATE_TARIFF:
+        history = (not _uncommitted and _tariff_histories.get(category_id)) or \
+            get_tariff_histories([category_id])[category_id]
+        return history.tariff_on(rent_date)
+    return get_tariff(category_id)
+
+
+def invalidate_tariff(category_id=None):
+    """
+    Drops cached tariff and tariff history of given category, or of all categories when None,
+    in this process right away and again, with the other processes, once the transaction commits
+    """
+    _drop(category_id)
+    if transaction.get_connection().in_atomic_block:
+        invalidation = Invalidation(category_id)
+        _uncommitted.setdefault(category_id, []).append(weakref.ref(invalidation))
+        transaction.on_commit(invalidation)
+    versions.bump('tariffs')
+
+
+versions.register('tariffs', _drop)
@@ -60,3 +60,29 @@ class RentedBookFactory(DjangoModelFactory):
 
     class Meta:
         model = RentedBook
+
+
+STANDARD_DAY_CHARGES = {
+    'fiction': [dict(days_from=0, days_to=2, per_day_charge=1, min_days=2, min_charge=2),
+                dict(days_from=3, days_to=30, per_day_charge=1.5, min_days=5, min_charge=4.5),
+                dict(days_from=31, per_day_charge=2)],
+    'regular': [dict(days_from=0, days_to=2, per_day_charge=1, min_days=2, min_charge=2),
+                dict(days_from=3, per_day_charge=1.5)],
+    'novels': [dict(days_from=0, days_to=3, per_day_charge=1.5, min_days=3, min_charge=4.5),
+               dict(days_from=4, per_day_charge=1.5)],
+}
+
+
+def create_standard_categories():
+    """
+    Creates fiction, regular and novels categories with the day wise charges
+    used across the tests (same as seed command), replacing the default charge
+    """
+    categories = {}
+    for name, day_charges in STANDARD_DAY_CHARGES.items():
+        category = CategoryFactory(name=name)
+        category.dayswise_charges.all().delete()
+        for day_charge in day_charges:
+            CategoryDayChargeFactory(category=category, **day_charge)
+        categories[name] = category
+    return categories
@@ -1,11 +1,17 @@
 import datetime
+import json
+import tracemalloc
+from unittest import mock
 
 from django.test.testcases import TestCase
 from django.urls import reverse
 from rest_framework.test import APITestCase
 
+from apps.book_rental.models import RentedBook
+from apps.book_rental.pagination import encode_cursor
+from apps.book_rental.rentals import change_stock
 from apps.book_rental.tests.factories import BookFactory, UserFactory, RentedBookFactory, CategoryFactory, \
-    CategoryDayChargeFactory
+    CategoryDayChargeFactory, create_standard_categories
 from apps.book_rental.views import BookSerializer, RentedBookSerialiser
 
 
@@ -41,15 +47,25 @@ class TestBookAPI(APITestCase):
 
     def test_list_api(self):
         """
-        Test if paginated response gives exact count and urls
+        Test if paginated response gives next page url and count only when asked
         Response is tested in Serialiser test cases
         """
         self.client.force_login(user=self.user)
         response = self.client.get(reverse('books-list'))
         response_data = response.json()
         self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response_data)
+        self.assertEqual([book['id'] for book in response_data['results']], [book.id for book in self.books[:100]])
+        self.assertEqual(response_data['next'],
+                         'http://testserver/api/books/?cursor={}'.format(encode_cursor([self.books[99].id])))
+
+        response_data = self.client.get(response_data['next']).json()
+        self.assertEqual([book['id'] for book in response_data['results']], [book.id for book in self.books[100:]])
+        self.assertIsNone(response_data['next'])
+
+        response_data = self.client.get(reverse('books-list'), {'count': 1, 'page_size': 10}).json()
         self.assertEqual(response_data['count'], 102)
-        self.assertEqual(response_data['next'], 'http://testserver/api/books/?limit=100&offset=100')
+        self.assertEqual(len(response_data['results']), 10)
 
     def test_detail_api(self):
         """
@@ -215,5 +231,221 @@ class TestUserBooksAPI(APITestCase):
                               'return_date': '2020-06-01'}]
 
         actual_response = response.json()
-        self.assertEqual(actual_response, expected_response)
+        self.assertEqual(actual_response, {'next': None, 'results': expected_response})
+        self.assertEqual(response.status_code, 200)
+
+
+class TestUserBooksPagination(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.books = BookFactory.create_batch(5)
+        # two rentals on each date to page through ties of rent_date
+        self.rentals = [RentedBookFactory(user=self.user, book=book, return_date=None,
+                                          rent_date=datetime.date(2020, 5, 1) + datetime.timedelta(days // 2))
+                        for days, book in enumerate(self.books)]
+        self.rentals[0].return_date = datetime.date(2020, 5, 3)
+        self.rentals[0].has_charges_paid = True
+        self.rentals[0].save()
+        self.rentals[3].return_date = datetime.date(2020, 5, 20)
+        self.rentals[3].save()
+        # other user's rentals are not listed
+        RentedBookFactory(book=self.books[0])
+        self.url = reverse('user-books', kwargs={'user_id': self.user.id})
+        self.client.force_login(user=self.user)
+
+    def get_book_ids(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [rental['book_id'] for rental in data['results']], data['next']
+
+    def test_pages(self):
+        """
+        Pages follow (rent_date, id) without duplicates or gaps
+        """
+        book_ids, next_url = self.get_book_ids(self.url, page_size=2)
+        self.assertEqual(book_ids, [book.id for book in self.books[:2]])
+        book_ids, next_url = self.get_book_ids(next_url)
+        self.assertEqual(book_ids, [book.id for book in self.books[2:4]])
+        book_ids, next_url = self.get_book_ids(next_url)
+        self.assertEqual(book_ids, [self.books[4].id])
+        self.assertIsNone(next_url)
+
+    def test_filters(self):
+        self.assertEqual(self.get_book_ids(self.url, status='returned')[0], [self.books[0].id, self.books[3].id])
+        self.assertEqual(self.get_book_ids(self.url, status='open')[0],
+                         [self.books[1].id, self.books[2].id, self.books[4].id])
+        self.assertEqual(self.get_book_ids(self.url, unpaid='true')[0], [book.id for book in self.books[1:]])
+        self.assertEqual(self.get_book_ids(self.url, rent_date_from='2020-05-02', rent_date_to='2020-05-02')[0],
+                         [self.books[2].id, self.books[3].id])
+
+        book_ids, next_url = self.get_book_ids(self.url, status='open', page_size=2)
+        self.assertEqual(book_ids, [self.books[1].id, self.books[2].id])
+        self.assertEqual(self.get_book_ids(next_url)[0], [self.books[4].id])
+
+    def test_stream(self):
+        """
+        Streamed rentals are same as all the pages, filters still apply
+        """
+        response = self.client.get(self.url, {'stream': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(streamed, self.client.get(self.url).json()['results'])
+
+        response = self.client.get(self.url, {'stream': 1, 'status': 'returned'})
+        self.assertEqual([rental['book_id'] for rental in json.loads(b''.join(response.streaming_content))],
+                         [self.books[0].id, self.books[3].id])
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get(self.url, {'status': 'lost'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'rent_date_from': '01-05-2020'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'cursor': 'invalid'}).status_code, 404)
+
+
+class TestQuoteAPI(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        categories = create_standard_categories()
+        self.fiction_books = BookFactory.create_batch(3, category=categories['fiction'])
+        self.regular_book = BookFactory(category=categories['regular'])
+
+    def test_quotes(self):
+        """
+        Every book is quoted on the tariff of its category
+        """
+        self.client.force_login(user=self.user)
+        book_ids = [book.id for book in self.fiction_books] + [self.regular_book.id, 0]
+        response = self.client.post(reverse('quotes'), {'book_ids': book_ids, 'days': [3, 7, 30]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response_data = response.json()
+        self.assertEqual(response_data['not_found'], [0])
+        self.assertEqual(response_data['quotes'][0], {'book_id': self.fiction_books[0].id,
+                                                      'charges': {'3': 6.5, '7': 9.5, '30': 44.0}})
+        self.assertEqual(response_data['quotes'][3], {'book_id': self.regular_book.id,
+                                                      'charges': {'3': 3.5, '7': 9.5, '30': 44.0}})
+
+    def test_no_per_item_queries(self):
+        """
+        Books are fetched with a single query, tariffs from cache
+        """
+        self.client.force_login(user=self.user)
+        data = {'book_ids': [book.id for book in self.fiction_books], 'days': [3]}
+        self.client.post(reverse('quotes'), data, format='json')
+        with self.assertNumQueries(3):  # session, user, books
+            response = self.client.post(reverse('quotes'), data, format='json')
+        self.assertEqual(len(response.json()['quotes']), 3)
+
+    def test_invalid_request(self):
+        self.client.force_login(user=self.user)
+        response = self.client.post(reverse('quotes'), {'book_ids': [], 'days': [-1]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'book_ids', 'days'})
+
+
+class TestUserBooksStreamMemory(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        books = BookFactory.create_batch(100)
+        self.url = reverse('user-books', kwargs={'user_id': self.user.id})
+        self.client.force_login(user=self.user)
+        # bulk_create skips ledger, which is not needed here
+        RentedBook.objects.bulk_create(
+            RentedBook(user=self.user, book=book, created_by=self.user,
+                       rent_date=datetime.date(2000, 1, 1) + datetime.timedelta(days),
+                       return_date=datetime.date(2000, 1, 11) + datetime.timedelta(days))
+            for days in range(1000) for book in books
+        )
+
+    def test_flat_memory(self):
+        """
+        Peak memory streaming 100k rows stays far below size of the response
+        """
+        tracemalloc.start()
+        try:
+            response = self.client.get(self.url, {'stream': 1})
+            rows = size = 0
+            for chunk in response.streaming_content:
+                rows += chunk.count(b'"book_name"')
+                size += len(chunk)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(rows, 100000)
+        self.assertLess(peak, 4 * 1024 * 1024)
+        self.assertLess(peak, size / 4)
+
+
+class TestConditionalGet(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.books = BookFactory.create_batch(3)
+        self.rented_book = RentedBookFactory(user=self.user, book=self.books[0], return_date=None)
+        self.client.force_login(user=self.user)
+
+    def assertNotModified(self, url, response):
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+    def assertModified(self, url, response):
+        modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified['ETag'], response['ETag'])
+        return modified
+
+    def test_books(self):
+        url = reverse('books-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotModified(url, response)
+        # MAX(updated_at) does not move on deletes
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        self.books[0].name = 'Renamed'
+        self.books[0].save()
+        response = self.assertModified(url, response)
+
+        self.books[0].category.save()
+        response = self.assertModified(url, response)
+
+        # author names are in the list
+        author = self.books[0].author
+        author.first_name = 'Renamed'
+        author.save()
+        response = self.assertModified(url, response)
+        author.save(update_fields=['last_login'])
+        self.assertNotModified(url, response)
+
+        # stock is changed with UPDATE, without signals
+        change_stock({self.books[2].id: -1})
+        response = self.assertModified(url, response)
+
+        RentedBook.objects.all().delete()
+        self.books[1].delete()
+        self.assertModified(url, response)
+
+    def test_user_books(self):
+        url = reverse('user-books', kwargs={'user_id': self.user.id})
+        response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
+        self.assertNotModified(url, response)
+
+        # charges of not returned books change every day
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        with mock.patch('apps.book_rental.etags.date') as mock_date:
+            mock_date.today.return_value = tomorrow
+            self.assertModified(url, response)
+
+        day_charge = self.books[0].category.dayswise_charges.get()
+        day_charge.per_day_charge = 5
+        day_charge.save()
+        response = self.assertModified(url, response)
+
+        self.rented_book.return_date = datetime.date.today()
+        self.rented_book.save()
+        response = self.assertModified(url, response)
+
+        # other users' rentals do not change the ETag
+        RentedBookFactory(book=self.books[1])
+        self.assertNotModified(url, response)
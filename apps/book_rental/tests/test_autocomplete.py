@@ -0,0 +1,114 @@
+import uuid
+
+from django.core.cache import cache
+from django.test.testcases import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from apps.book_rental import autocomplete, versions
+from apps.book_rental.autocomplete import AutocompleteIndex, autocomplete_books, normalize
+from apps.book_rental.tests.factories import BookFactory, UserFactory
+
+
+class TestAutocompleteIndex(TestCase):
+
+    def setUp(self):
+        self.index = AutocompleteIndex.build([
+            (1, 'Da Vinci Code', 'da-vinci-code'),
+            (2, 'Les Misérables - Vol.1', 'les-miserables-vol1'),
+            (3, 'Dark Matter', 'dark-matter'),
+            (4, 'Da Vinci Code', 'da-vinci-code-2'),
+        ])
+
+    def test_normalize(self):
+        self.assertEqual(normalize('Les Misérables - Vol.1'), 'les miserables vol 1')
+        self.assertEqual(normalize('  __ '), '')
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('da', 10), [(1, 'Da Vinci Code'), (4, 'Da Vinci Code'),
+                                                       (3, 'Dark Matter')])
+        self.assertEqual(self.index.lookup('DA V', 1), [(1, 'Da Vinci Code')])
+        self.assertEqual(self.index.lookup('les mise', 10), [(2, 'Les Misérables - Vol.1')])
+        # slug
+        self.assertEqual(self.index.lookup('da vinci code 2', 10), [(4, 'Da Vinci Code')])
+        self.assertEqual(self.index.lookup('x', 10), [])
+        self.assertEqual(self.index.lookup('-', 10), [])
+
+    def test_add_and_remove(self):
+        self.index.add(5, 'Dan Brown Collection', 'dan-brown-collection')
+        self.index.add(3, 'Blake Crouch', 'blake-crouch')
+        self.assertEqual([book_id for book_id, name in self.index.lookup('da', 10)], [1, 4, 5])
+        self.assertEqual(self.index.lookup('bla', 10), [(3, 'Blake Crouch')])
+
+        self.index.remove(1)
+        self.index.remove(42)
+        self.assertEqual([book_id for book_id, name in self.index.lookup('da', 10)], [4, 5])
+        self.assertEqual(self.index.keys, sorted(self.index.keys))
+        self.assertEqual(len(self.index.keys), len(self.index.ids))
+
+
+class TestAutocompleteSync(TransactionTestCase):
+
+    def setUp(self):
+        autocomplete.reset()
+        self.book = BookFactory(name='Da Vinci Code')
+
+    def tearDown(self):
+        autocomplete.reset()
+
+    def test_lazy_build(self):
+        """
+        Index is built with one query on first use, lookups do not query
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(autocomplete_books('da'), [(self.book.id, 'Da Vinci Code')])
+        with self.assertNumQueries(0):
+            self.assertEqual(autocomplete_books('vinci'), [])
+
+    def test_signals(self):
+        autocomplete_books('da')
+        other = BookFactory(name='Dark Matter')
+        self.book.name = 'Angels and Demons'
+        self.book.save()
+        self.assertEqual(autocomplete_books('da'), [(other.id, 'Dark Matter')])
+        self.assertEqual(autocomplete_books('angels'), [(self.book.id, 'Angels and Demons')])
+
+        other.delete()
+        self.assertEqual(autocomplete_books('da'), [])
+
+    def test_changed_by_other_process(self):
+        """
+        Index is built again once another process moved the version, changes of this one are applied in place
+        """
+        versions.check()
+        autocomplete_books('da')
+        BookFactory(name='Dark Matter')
+        versions.check()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(autocomplete_books('da')), 2)
+
+        cache.set(versions.KEY_PREFIX + autocomplete.VERSION, uuid.uuid4().hex)
+        versions.check()
+        with self.assertNumQueries(1):
+            self.assertEqual(len(autocomplete_books('da')), 2)
+
+
+class TestAutocompleteAPI(APITestCase):
+
+    def setUp(self):
+        autocomplete.reset()
+        self.user = UserFactory()
+        self.book = BookFactory(name='Da Vinci Code')
+        self.client.force_login(user=self.user)
+
+    def tearDown(self):
+        autocomplete.reset()
+
+    def test_autocomplete(self):
+        response = self.client.get(reverse('books-autocomplete'), {'q': 'Da v'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'results': [{'id': self.book.id, 'name': 'Da Vinci Code'}]})
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get(reverse('books-autocomplete')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('books-autocomplete'), {'q': 'da', 'limit': 0}).status_code, 400)
@@ -0,0 +1,53 @@
+import datetime
+
+from django.test.testcases import TestCase
+
+from apps.book_rental.billing import compute_charges
+from apps.book_rental.models import RentedBook
+from apps.book_rental.tariffs import invalidate_tariff
+from apps.book_rental.tests.factories import BookFactory, UserFactory, RentedBookFactory, \
+    create_standard_categories
+
+
+class TestComputeCharges(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        categories = create_standard_categories()
+        self.books = [BookFactory(name="{} book".format(name), category=category)
+                      for name, category in categories.items()]
+
+    def test_same_as_total_charge(self):
+        """
+        Bulk charges should be exactly same as RentedBook.total_charge
+        """
+        rent_date = datetime.date.today() - datetime.timedelta(days=100)
+        for book in self.books:
+            for days in range(0, 40):
+                RentedBookFactory(user=self.user, book=book,
+                                  rent_date=rent_date + datetime.timedelta(days=days),
+                                  return_date=rent_date + datetime.timedelta(days=2 * days),
+                                  fine_charged=days % 3 * 0.1,
+                                  has_charges_paid=days % 7 == 0)
+            RentedBookFactory(user=self.user, book=book, return_date=None,
+                              rent_date=rent_date - datetime.timedelta(days=1))
+
+        # rentals and tariffs are fetched with a query each
+        invalidate_tariff()
+        with self.assertNumQueries(2):
+            charges = compute_charges()
+
+        rented_books = RentedBook.objects.select_related('book')
+        self.assertEqual(charges, {rented_book.id: rented_book.total_charge for rented_book in rented_books})
+
+    def test_queryset_and_as_of(self):
+        """
+        Only rentals of given queryset are charged, open rentals till as_of
+        """
+        open_rental = RentedBookFactory(user=self.user, book=self.books[1],
+                                        rent_date=datetime.date(2020, 5, 1), return_date=None)
+        RentedBookFactory(book=self.books[1])
+
+        charges = compute_charges(RentedBook.objects.filter(user=self.user), as_of=datetime.date(2020, 5, 7))
+        self.assertEqual(charges, {open_rental.id: 8.0})
+        self.assertEqual(compute_charges(RentedBook.objects.none()), {})
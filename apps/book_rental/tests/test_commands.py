@@ -0,0 +1,267 @@
+import datetime
+import gzip
+import json
+import os
+import tempfile
+from io import StringIO
+
+import numpy as np
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test.testcases import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from apps.book_rental.billing import compute_charges
+from apps.book_rental.ledger import compute_balances
+from apps.book_rental.management.commands.seed import generate_rentals
+from apps.book_rental.models import BillingRun, Book, CategoryDayCharge, ChargeSnapshot, RentedBook, UserBalance
+from apps.book_rental.search import search_books
+from apps.book_rental.tariffs import RENT_DATE_TARIFF, tariff_for
+from apps.book_rental.tests.factories import BookFactory, UserFactory, RentedBookFactory, \
+    create_standard_categories
+
+
+class TestComputeChargesCommand(TestCase):
+
+    def setUp(self):
+        user = UserFactory()
+        categories = create_standard_categories()
+        for name, category in categories.items():
+            book = BookFactory(name="{} book".format(name), category=category)
+            for days in range(10):
+                RentedBookFactory(user=user, book=book,
+                                  rent_date=datetime.date(2020, 5, 1) + datetime.timedelta(days=days),
+                                  return_date=None if days % 3 else datetime.date(2020, 6, 1),
+                                  has_charges_paid=days == 5)
+
+    def test_snapshots(self):
+        """
+        Every unpaid rental gets a snapshot of its charge as of given date
+        """
+        out = StringIO()
+        call_command('compute_charges', workers=1, chunk_size=7, as_of=datetime.date(2020, 7, 1), stdout=out)
+
+        billing_run = BillingRun.objects.get()
+        self.assertIsNotNone(billing_run.finished_at)
+        self.assertIn('rows/s', out.getvalue())
+
+        expected = compute_charges(RentedBook.objects.filter(has_charges_paid=False),
+                                   as_of=datetime.date(2020, 7, 1))
+        snapshots = dict(billing_run.snapshots.values_list('rented_book_id', 'total_charge'))
+        self.assertEqual(len(snapshots), 27)
+        self.assertEqual(snapshots, expected)
+
+    def test_resume(self):
+        """
+        Resumed run bills only the chunks which were not billed
+        """
+        call_command('compute_charges', workers=1, chunk_size=7, stdout=StringIO())
+        billing_run = BillingRun.objects.get()
+        first_chunk = billing_run.chunks.order_by('start_id').first()
+        billing_run.chunks.exclude(pk=first_chunk.pk).delete()
+        billing_run.snapshots.exclude(rented_book_id__lt=first_chunk.end_id).delete()
+
+        call_command('compute_charges', workers=1, resume=billing_run.pk, stdout=StringIO())
+        self.assertEqual(ChargeSnapshot.objects.filter(billing_run=billing_run).count(), 27)
+        self.assertEqual(BillingRun.objects.count(), 1)
+
+
+class TestComputeChargesWorkers(TransactionTestCase):
+    """
+    Forked workers bill on their own connections, so rentals have to be committed
+    """
+    setUp = TestComputeChargesCommand.setUp
+
+    def test_workers(self):
+        """
+        Chunks billed by worker processes give same snapshots as billing in process
+        """
+        call_command('compute_charges', workers=2, chunk_size=7, as_of=datetime.date(2020, 7, 1),
+                     stdout=StringIO())
+
+        billing_run = BillingRun.objects.get()
+        self.assertIsNotNone(billing_run.finished_at)
+        first_id, last_id = RentedBook.objects.earliest('id').id, RentedBook.objects.latest('id').id
+        self.assertEqual(billing_run.chunks.count(), last_id // 7 - first_id // 7 + 1)
+        expected = compute_charges(RentedBook.objects.filter(has_charges_paid=False),
+                                   as_of=datetime.date(2020, 7, 1))
+        self.assertEqual(dict(billing_run.snapshots.values_list('rented_book_id', 'total_charge')), expected)
+
+
+class TestImportBooksCommand(TestCase):
+
+    def setUp(self):
+        self.admin = UserFactory(username='admin', is_superuser=True)
+        self.author = UserFactory(username='khaled')
+        self.categories = create_standard_categories()
+        BookFactory(name='Kite Runner', category=self.categories['fiction'], author=self.author)
+
+    def import_books(self, data, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_books', stdin=StringIO(data), stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv(self):
+        """
+        Taken slugs are numbered, bad rows are skipped, books get history and search documents
+        """
+        out, err = self.import_books(
+            'name,author,category,description,book_quantity\n'
+            'Kite Runner,khaled,fiction,Paperback,3\n'
+            'Kite Runner,khaled,Fiction,Hardcover,1\n'
+            'A Thousand Splendid Suns,khaled,novels,,2\n'
+            'Unknown,nobody,novels,,1\n'
+            'Bad,khaled,horror,,1\n',
+            chunk_size=2)
+        self.assertIn('3 created, 0 updated, 2 skipped', out)
+        self.assertIn('rows/s', out)
+        self.assertIn("Line 5: unknown author 'nobody'", err)
+        self.assertIn("Line 6: unknown category 'horror'", err)
+
+        books = Book.objects.filter(name='Kite Runner').order_by('id')
+        self.assertEqual([(book.slug, book.description, book.book_quantity) for book in books[1:]],
+                         [('kite-runner-2', 'Paperback', 3), ('kite-runner-3', 'Hardcover', 1)])
+        self.assertEqual(Book.history.filter(history_type='+', history_user=self.admin).count(), 3)
+        self.assertEqual(Book.objects.get(slug='a-thousand-splendid-suns').category, self.categories['novels'])
+        self.assertEqual(len(search_books('splendid')), 1)
+
+    def test_jsonl_upsert(self):
+        """
+        Existing slugs are updated in upsert mode, unknown authors are created if asked
+        """
+        out, err = self.import_books(
+            '{"name": "Kite Runner", "author": "hosseini", "category": "novels", "book_quantity": 5}\n'
+            '{"name": "Inferno", "author": "brown", "category": "regular"}\n'
+            '{"name": "Inferno", "author": "brown", "category": "regular", "description": "Langdon"}\n'
+            'not json\n',
+            format='jsonl', upsert=True, create_authors=True)
+        self.assertIn('1 created, 1 updated, 1 skipped', out)
+        self.assertIn('Line 4: not a JSON object', err)
+
+        book = Book.objects.get(slug='kite-runner')
+        self.assertEqual((book.author.username, book.category.name, book.book_quantity), ('hosseini', 'novels', 5))
+        self.assertEqual(book.history.first().history_type, '~')
+        self.assertEqual(Book.objects.get(slug='inferno').description, 'Langdon')
+        self.assertFalse(User.objects.get(username='brown').is_active)
+
+    def test_upsert_moves_rentals(self):
+        """
+        Rentals of books moved to another category are kept in ledger under the new one
+        """
+        RentedBookFactory(book=Book.objects.get(slug='kite-runner'), rent_date=datetime.date(2020, 5, 2),
+                          return_date=None)
+        self.import_books('{"name": "Kite Runner", "author": "khaled", "category": "novels"}\n',
+                          format='jsonl', upsert=True)
+        call_command('reconcile_balances', stdout=StringIO())
+
+
+class TestSeedCommand(TestCase):
+
+    def test_books(self):
+        call_command('seed', books=10, stdout=StringIO())
+        self.assertEqual(Book.objects.count(), 10)
+        self.assertEqual(RentedBook.objects.count(), 5)
+
+    def test_scale(self):
+        """
+        Generated rentals are written with their history, ledger is rebuilt
+        """
+        out = StringIO()
+        call_command('seed', scale=0.002, books=30, seed=1, chunk_size=50, stdout=out)
+        self.assertIn('Seeded 22 users, 30 books', out.getvalue())
+        self.assertEqual(Book.objects.count(), 30)
+        self.assertEqual(Book.history.count(), 30)
+
+        rentals = generate_rentals(1, 20, 30, 200)
+        self.assertEqual(RentedBook.objects.count(), len(rentals['book']))
+        open_rentals = RentedBook.objects.filter(return_date__isnull=True)
+        self.assertEqual(open_rentals.count(), (rentals['returned'] < 0).sum())
+        self.assertFalse(open_rentals.filter(has_charges_paid=True).exists())
+        self.assertEqual(RentedBook.history.count(),
+                         RentedBook.objects.count() * 2 - open_rentals.count())
+        self.assertEqual(UserBalance.objects.count(), len(compute_balances()))
+        # tariffs were raised twice over the rental window
+        self.assertEqual(CategoryDayCharge.history.filter(history_type='~').count(), 2 * 7)
+
+    def test_generate_rentals(self):
+        """
+        Same seed gives same rentals, unique on book, user and rent date
+        """
+        rentals = generate_rentals(3, 50, 20, 1000)
+        again = generate_rentals(3, 50, 20, 1000)
+        self.assertTrue(all(np.array_equal(rentals[key], again[key]) for key in rentals))
+        self.assertFalse(np.array_equal(generate_rentals(4, 50, 20, 1000)['book'], rentals['book']))
+        keys = set(zip(rentals['book'].tolist(), rentals['user'].tolist(), rentals['rented'].tolist()))
+        self.assertEqual(len(keys), len(rentals['book']))
+        returned = rentals['returned'] >= 0
+        self.assertTrue((rentals['returned'][returned] <= rentals['rented'][returned]).all())
+
+
+class TestCompactHistoryCommand(TestCase):
+
+    def setUp(self):
+        self.book = BookFactory(name='Kite Runner', book_quantity=1)
+        # days before it used in tests fall in the same month
+        self.old = datetime.datetime(2020, 1, 28, 12, tzinfo=timezone.utc)
+
+    def save_book(self, days_ago, **changes):
+        for field, value in changes.items():
+            setattr(self.book, field, value)
+        self.book.save()
+        self.book.history.filter(history_id=self.book.history.latest().history_id).update(
+            history_date=self.old - datetime.timedelta(days=days_ago))
+
+    def test_compact(self):
+        """
+        Old no-op updates and updates between first and last of a month are deleted,
+        recent history is kept
+        """
+        self.book.history.update(history_date=self.old - datetime.timedelta(days=100))
+        self.save_book(99, book_quantity=2)
+        self.save_book(98)
+        self.save_book(97, book_quantity=3)
+        self.save_book(96, book_quantity=4)
+        self.save_book(50, book_quantity=5)
+        self.book.book_quantity = 6
+        self.book.save()
+        quantities = list(self.book.history.order_by('history_id').values_list('book_quantity', flat=True))
+        self.assertEqual(quantities, [1, 2, 2, 3, 4, 5, 6])
+
+        out = StringIO()
+        call_command('compact_history', models=['book'], period='month', dry_run=True, stdout=out)
+        self.assertIn('HistoricalBook: would delete 3 of 6 rows', out.getvalue())
+        self.assertIn('(1 no-op, 2 thinned per month)', out.getvalue())
+        self.assertEqual(self.book.history.count(), 7)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'history.jsonl.gz')
+            call_command('compact_history', models=['book'], batch_size=2, archive=path, stdout=out)
+            with gzip.open(path, 'rt') as archive:
+                archived = [json.loads(line) for line in archive]
+        self.assertEqual(list(self.book.history.order_by('history_id').values_list('book_quantity', flat=True)),
+                         [1, 4, 5, 6])
+        self.assertEqual(sorted(row['book_quantity'] for row in archived), [2, 2, 3])
+        self.assertEqual(archived[0]['model'], 'book_rental.HistoricalBook')
+
+    def test_day_charges_kept_per_day(self):
+        """
+        Tariffs as of rent date read end of day versions of day wise charges, which are kept
+        """
+        category = create_standard_categories()['fiction']
+        day_charge = category.dayswise_charges.get(days_from=3)
+        history = CategoryDayCharge.history.filter(category=category)
+        history.update(history_date=self.old - datetime.timedelta(days=10))
+        for hours, per_day_charge in enumerate((2, 3, 4)):
+            day_charge.per_day_charge = per_day_charge
+            day_charge.save()
+            history.filter(history_id=history.latest().history_id).update(
+                history_date=self.old - datetime.timedelta(days=5) + datetime.timedelta(hours=hours))
+        rent_dates = [(self.old - datetime.timedelta(days=days)).date() for days in (10, 6, 5, 4)]
+        tariffs = [tariff_for(category.id, rent_date, RENT_DATE_TARIFF).charge(10) for rent_date in rent_dates]
+
+        out = StringIO()
+        call_command('compact_history', models=['categorydaycharge'], period='month', stdout=out)
+        self.assertIn('deleted 1 of', out.getvalue())
+        self.assertEqual([tariff_for(category.id, rent_date, RENT_DATE_TARIFF).charge(10) for rent_date in rent_dates],
+                         tariffs)
@@ -0,0 +1,106 @@
+import datetime
+
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from apps.book_rental.models import Book
+from apps.book_rental.tariffs import get_tariff_histories
+from apps.book_rental.tests.factories import CategoryFactory, UserFactory
+from apps.mixin.tools import count_queries
+
+
+class TestBufferedHistory(TransactionTestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.category = CategoryFactory(name='fiction')
+
+    def new_book(self, name):
+        book = Book(name=name, author=self.user, category=self.category, created_by=self.user)
+        book.save()
+        return book
+
+    def changes(self, prefix):
+        """
+        Saves and deletes in a transaction, with released and rolled back savepoints.
+        Returns history of the books, in order of insertion
+        """
+        with transaction.atomic():
+            book = self.new_book(prefix + ' one')
+            book.book_quantity = 5
+            book.save()
+            try:
+                with transaction.atomic():
+                    self.new_book(prefix + ' two')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            with transaction.atomic():
+                third = self.new_book(prefix + ' three')
+                with transaction.atomic():
+                    third.description = 'Changed'
+                    third.save()
+            book.delete()
+            self.new_book(prefix + ' four')
+
+        history = Book.history.filter(name__startswith=prefix).order_by('history_id')
+        self.assertEqual(list(history), sorted(history, key=lambda record: record.history_date))
+        return [(record.history_type, record.name[len(prefix):], record.book_quantity, record.description,
+                 record.history_user_id) for record in history]
+
+    def test_same_history(self):
+        """
+        Buffered history has the same records in the same order as unbuffered one
+        """
+        expected = self.changes('plain')
+        self.assertEqual(len(expected), 6)
+        with override_settings(HISTORY_BUFFERED=True):
+            self.assertEqual(self.changes('buffered'), expected)
+
+    @override_settings(HISTORY_BUFFERED=True)
+    def test_rollback(self):
+        try:
+            with transaction.atomic():
+                self.new_book('Rolled back')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(Book.history.exists())
+
+        # buffered records of the rolled back transaction are not written by the next one
+        with transaction.atomic():
+            self.new_book('Committed')
+        self.assertEqual(list(Book.history.values_list('name', flat=True)), ['Committed'])
+
+    @override_settings(HISTORY_BUFFERED=True)
+    def test_bulk_insert(self):
+        """
+        Records of a transaction are inserted at once, outside transactions right away
+        """
+        with count_queries() as queries:
+            with transaction.atomic():
+                for number in range(10):
+                    self.new_book('Book {}'.format(number))
+                self.assertFalse(Book.history.exists())
+        inserts = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT INTO "book_rental_historicalbook"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Book.history.count(), 10)
+
+        self.new_book('Autocommit')
+        self.assertEqual(Book.history.count(), 11)
+
+    @override_settings(HISTORY_BUFFERED=True)
+    def test_tariff_history(self):
+        """
+        Tariff history read after the commit, before buffered records are written, is replayed again
+        """
+        day_charge = self.category.dayswise_charges.get()
+        with transaction.atomic():
+            day_charge.per_day_charge = 2
+            day_charge.save()
+            transaction.on_commit(lambda: get_tariff_histories([self.category.id]))
+            # records of the transaction are written with the last one
+            self.new_book('Written with the tariff')
+        history = get_tariff_histories([self.category.id])[self.category.id]
+        self.assertEqual(history.tariff_on(datetime.date.today()).charge(10), 20.0)
@@ -0,0 +1,155 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test.testcases import TestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from apps.book_rental.models import RentedBook, UserBalance
+from apps.book_rental.tests.factories import BookFactory, UserFactory, RentedBookFactory, \
+    create_standard_categories
+
+
+class TestUserBalanceLedger(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.categories = create_standard_categories()
+        self.fiction_book = BookFactory(name="Fiction book", category=self.categories['fiction'])
+        self.regular_book = BookFactory(name="Regular book", category=self.categories['regular'])
+
+    def assertBalance(self, user, as_of, expected):
+        balance = UserBalance.objects.get(user=user)
+        self.assertAlmostEqual(balance.total_charge(as_of), expected)
+        rented_books = RentedBook.objects.filter(user=user).with_charges(as_of=as_of)
+        self.assertAlmostEqual(sum(rented_book.total_charge_db for rented_book in rented_books), expected)
+
+    def test_rentals_are_recorded(self):
+        """
+        Returned rentals are settled, open ones charged on any date
+        """
+        RentedBookFactory(user=self.user, book=self.fiction_book,
+                          rent_date=datetime.date(2020, 5, 1), return_date=datetime.date(2020, 5, 10))
+        open_rental = RentedBookFactory(user=self.user, book=self.regular_book, fine_charged=1,
+                                        rent_date=datetime.date(2020, 5, 1), return_date=None)
+
+        balance = UserBalance.objects.get(user=self.user)
+        self.assertEqual(balance.settled_charges, 12.5)
+        self.assertBalance(self.user, datetime.date(2020, 5, 7), 12.5 + 8.0 + 1)
+        self.assertBalance(self.user, datetime.date(2020, 6, 7), 12.5 + 2 + 35 * 1.5 + 1)
+
+        # returned
+        open_rental.return_date = datetime.date(2020, 5, 7)
+        open_rental.save()
+        self.assertEqual(UserBalance.objects.get(user=self.user).get_open_rentals(), {})
+        self.assertBalance(self.user, datetime.date(2020, 6, 7), 12.5 + 8.0 + 1)
+
+        # paid
+        open_rental.has_charges_paid = True
+        open_rental.save()
+        self.assertBalance(self.user, datetime.date(2020, 6, 7), 12.5)
+
+        # moved to other user and deleted
+        other_user = UserFactory()
+        open_rental.has_charges_paid = False
+        open_rental.user = other_user
+        open_rental.save()
+        self.assertBalance(self.user, datetime.date(2020, 6, 7), 12.5)
+        self.assertBalance(other_user, datetime.date(2020, 6, 7), 9.0)
+        open_rental.delete()
+        self.assertBalance(other_user, datetime.date(2020, 6, 7), 0)
+
+    def test_tariff_change_reprices_settled(self):
+        """
+        Changing day wise charges changes settled charges of returned books
+        """
+        RentedBookFactory(user=self.user, book=self.regular_book,
+                          rent_date=datetime.date(2020, 5, 1), return_date=datetime.date(2020, 5, 7))
+        self.assertEqual(UserBalance.objects.get(user=self.user).settled_charges, 8.0)
+
+        day_charge = self.categories['regular'].dayswise_charges.get(days_from=3)
+        day_charge.per_day_charge = 3
+        day_charge.save()
+        self.assertEqual(UserBalance.objects.get(user=self.user).settled_charges, 14.0)
+
+
+class TestReconcileBalances(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.categories = create_standard_categories()
+        self.book = BookFactory(name="Regular book", category=self.categories['regular'])
+        RentedBookFactory(user=self.user, book=self.book,
+                          rent_date=datetime.date(2020, 5, 1), return_date=datetime.date(2020, 5, 7))
+        RentedBookFactory(user=self.user, book=self.book,
+                          rent_date=datetime.date(2020, 5, 2), return_date=None)
+
+    def test_reconciled(self):
+        out = StringIO()
+        call_command('reconcile_balances', stdout=out)
+        self.assertIn('Ledger of 1 users is reconciled', out.getvalue())
+
+    def test_drift_is_found_and_fixed(self):
+        """
+        Updates bypassing the ledger are reported and fixed
+        """
+        RentedBook.objects.filter(user=self.user).update(return_date=datetime.date(2020, 5, 9))
+        with self.assertRaises(CommandError):
+            call_command('reconcile_balances', stdout=StringIO())
+
+        call_command('reconcile_balances', fix=True, stdout=StringIO())
+        balance = UserBalance.objects.get(user=self.user)
+        self.assertEqual(balance.settled_charges, 11.0 + 9.5)
+        self.assertEqual(balance.get_open_rentals(), {})
+        call_command('reconcile_balances', stdout=StringIO())
+
+    def test_book_moved_to_other_category(self):
+        """
+        Rentals of a book are settled and kept open under its new category
+        """
+        self.book.category = self.categories['novels']
+        self.book.save()
+        call_command('reconcile_balances', stdout=StringIO())
+        balance = UserBalance.objects.get(user=self.user)
+        self.assertEqual(balance.settled_charges, 6 * 1.5)
+        self.assertEqual(list(balance.get_open_rentals()),
+                         ['{}:2020-05-02'.format(self.categories['novels'].id)])
+
+
+class TestUserBalanceAPI(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        categories = create_standard_categories()
+        RentedBookFactory(user=self.user, book=BookFactory(name="Regular book", category=categories['regular']),
+                          rent_date=datetime.date(2020, 5, 1), return_date=None, fine_charged=1)
+
+    def test_get_api(self):
+        """
+        Balance is a single row read
+        """
+        self.client.force_login(user=self.user)
+        url = reverse('user-balance', kwargs={'user_id': self.user.id})
+        self.client.get(url)  # compiles tariffs
+        with self.assertNumQueries(3):  # session, user, balance
+            response = self.client.get(url, {'as_of': '2020-05-07'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'user_id': self.user.id,
+                                           'as_of': '2020-05-07',
+                                           'settled_charges': 0.0,
+                                           'open_charges': 9.0,
+                                           'total_charge': 9.0})
+
+    def test_errors(self):
+        self.client.force_login(user=self.user)
+        response = self.client.get(reverse('user-balance', kwargs={'user_id': self.user.id}), {'as_of': '7-5-2020'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse('user-balance', kwargs={'user_id': 0}))
+        self.assertEqual(response.status_code, 404)
+
+        user = UserFactory()
+        response = self.client.get(reverse('user-balance', kwargs={'user_id': user.id}))
+        self.assertEqual(response.json()['total_charge'], 0)
@@ -1,8 +1,10 @@
 import datetime
 from unittest.mock import patch, PropertyMock
 
+from django.db.models import Sum
 from django.test.testcases import TestCase
 
+from apps.book_rental.models import RentedBook
 from apps.book_rental.tests.factories import BookFactory, UserFactory, RentedBookFactory, CategoryFactory, \
     CategoryDayChargeFactory
 
@@ -182,3 +184,80 @@ class TestUsersBookSerializer(TestCase):
             # days_rented =  6 days          3 * 1.5 + 3*1.5
             mock_days_rented.return_value = 6
             self.assertEqual(self.novel_rented.total_charge, 9.0)
+
+
+class TestChargesAnnotation(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.fiction_cat = CategoryFactory(name='fiction')
+        self.regular_cat = CategoryFactory(name='regular')
+        self.novel_cat = CategoryFactory(name='novels')
+        self.fiction_cat.dayswise_charges.all().delete()
+        self.regular_cat.dayswise_charges.all().delete()
+        self.novel_cat.dayswise_charges.all().delete()
+
+        CategoryDayChargeFactory(category=self.fiction_cat, days_from=0, days_to=2,
+                                 per_day_charge=1, min_days=2, min_charge=2)
+        CategoryDayChargeFactory(category=self.fiction_cat, days_from=3, days_to=30,
+                                 per_day_charge=1.5, min_days=5, min_charge=4.5)
+        CategoryDayChargeFactory(category=self.fiction_cat, days_from=31, per_day_charge=2)
+        CategoryDayChargeFactory(category=self.regular_cat, days_from=0, days_to=2,
+                                 per_day_charge=1, min_days=2, min_charge=2)
+        CategoryDayChargeFactory(category=self.regular_cat, days_from=3, per_day_charge=1.5)
+        CategoryDayChargeFactory(category=self.novel_cat, days_from=0, days_to=3,
+                                 per_day_charge=1.5, min_days=3, min_charge=4.5)
+        CategoryDayChargeFactory(category=self.novel_cat, days_from=4, per_day_charge=1.5)
+
+        self.books = [BookFactory(name="{} book".format(category.name), category=category)
+                      for category in (self.fiction_cat, self.regular_cat, self.novel_cat)]
+
+    def test_total_charge_db_on_every_slab_boundary(self):
+        """
+        total_charge_db should be same as total_charge on and around every slab boundary
+        """
+        rent_date = datetime.date(2020, 1, 1)
+        for book in self.books:
+            for days in range(0, 40):
+                RentedBookFactory(user=self.user, book=book,
+                                  rent_date=rent_date + datetime.timedelta(days=days),
+                                  return_date=rent_date + datetime.timedelta(days=2 * days))
+
+        rented_books = RentedBook.objects.select_related('book').with_charges()
+        self.assertEqual(len(rented_books), 120)
+        for rented_book in rented_books:
+            self.assertEqual(rented_book.days_rented_db, rented_book.days_rented)
+            self.assertEqual(rented_book.total_charge_db, rented_book.total_charge,
+                             msg='{} for {} days'.format(rented_book.book, rented_book.days_rented))
+
+    def test_paid_fine_and_open_rentals(self):
+        """
+        Paid rentals are 0, fine is added and not returned rentals are charged till as_of
+        """
+        paid = RentedBookFactory(user=self.user, book=self.books[0], has_charges_paid=True, fine_charged=3)
+        fined = RentedBookFactory(user=self.user, book=self.books[0], fine_charged=1.2,
+                                  rent_date=datetime.date(2020, 5, 1), return_date=datetime.date(2020, 5, 10))
+        not_returned = RentedBookFactory(user=self.user, book=self.books[1],
+                                         rent_date=datetime.date(2020, 5, 1), return_date=None)
+
+        rented_books = RentedBook.objects.with_charges(as_of=datetime.date(2020, 5, 7)).in_bulk()
+        self.assertEqual(rented_books[paid.id].total_charge_db, 0)
+        self.assertEqual(rented_books[fined.id].total_charge_db, 12.5 + 1.2)
+        self.assertEqual(rented_books[not_returned.id].days_rented_db, 6)
+        self.assertEqual(rented_books[not_returned.id].total_charge_db, 8.0)
+
+    def test_order_filter_and_sum(self):
+        """
+        Charges can be used for ordering, filtering and aggregation
+        """
+        for days in (1, 9, 35):
+            RentedBookFactory(user=self.user, book=self.books[1],
+                              rent_date=datetime.date(2020, 5, 1) - datetime.timedelta(days=days),
+                              return_date=datetime.date(2020, 5, 1))
+
+        queryset = RentedBook.objects.with_charges()
+        self.assertEqual(list(queryset.order_by('-total_charge_db').values_list('total_charge_db', flat=True)),
+                         [51.5, 12.5, 2.0])
+        self.assertEqual(queryset.filter(total_charge_db__gt=10).count(), 2)
+        self.assertEqual(queryset.filter(user=self.user).aggregate(balance=Sum('total_charge_db'))['balance'],
+                         66.0)
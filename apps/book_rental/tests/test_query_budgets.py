@@ -0,0 +1,88 @@
+import datetime
+
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from apps.book_rental.tariffs import invalidate_tariff
+from apps.book_rental.tests.factories import BookFactory, RentedBookFactory, UserFactory, \
+    create_standard_categories
+from apps.mixin.tools import QueryBudgetMixin
+
+
+class TestQueryBudgets(QueryBudgetMixin, APITestCase):
+    """
+    DB hits of an endpoint should not grow with size of its response
+    """
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.categories = list(create_standard_categories().values())
+        self.client.force_login(user=self.user)
+
+    def create_books(self, count):
+        return [BookFactory(category=self.categories[i % len(self.categories)]) for i in range(count)]
+
+    def create_rentals(self, count):
+        for book in self.create_books(count):
+            RentedBookFactory(user=self.user, book=book,
+                              rent_date=datetime.date(2020, 5, 1),
+                              return_date=datetime.date(2020, 6, 1))
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_books_list(self):
+        """
+        ETag is a version kept in the cache, it costs no query
+        """
+        self.create_books(3)
+        self.assertQueriesDoNotGrow(lambda: self.get(reverse('books-list')),
+                                    lambda: self.create_books(30), max_queries=4)
+
+    def test_books_detail(self):
+        book = self.create_books(1)[0]
+        self.assertQueryBudget(3, self.get, reverse('books-detail', kwargs={'pk': book.id}))
+
+    def test_user_books(self):
+        """
+        includes 2 aggregate queries of the ETag
+        """
+        self.create_rentals(3)
+        self.assertQueriesDoNotGrow(lambda: self.get(reverse('user-books', kwargs={'user_id': self.user.id})),
+                                    lambda: self.create_rentals(30), max_queries=6)
+
+    def test_user_books_cold_tariffs(self):
+        """
+        day wise charges of all the categories are loaded with one query
+        """
+        self.create_rentals(30)
+        invalidate_tariff()
+        self.assertQueryBudget(7, self.get, reverse('user-books', kwargs={'user_id': self.user.id}))
+
+    def test_not_modified(self):
+        """
+        304 Not Modified needs only the ETag queries
+        """
+        self.create_rentals(30)
+        for url in (reverse('books-list'), reverse('user-books', kwargs={'user_id': self.user.id})):
+            etag = self.get(url)['ETag']
+            response = self.assertQueryBudget(4, self.client.get, url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_user_balance(self):
+        url = reverse('user-balance', kwargs={'user_id': self.user.id})
+        self.create_rentals(3)
+        self.assertQueriesDoNotGrow(lambda: self.get(url), lambda: self.create_rentals(30), max_queries=3)
+
+    def test_quotes(self):
+        books = self.create_books(3)
+
+        def quote():
+            response = self.client.post(reverse('quotes'),
+                                        {'book_ids': [book.id for book in books], 'days': [3, 7, 30]},
+                                        format='json')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertQueriesDoNotGrow(quote, lambda: books.extend(self.create_books(30)), max_queries=3)
@@ -0,0 +1,317 @@
+import datetime
+import threading
+from collections import Counter
+from unittest import mock
+
+from django.db import connection
+from django.test.testcases import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase
+
+from apps.book_rental import rentals
+from apps.book_rental.billing import compute_charges
+from apps.book_rental.ledger import compute_balances
+from apps.book_rental.models import Book, RentedBook, UserBalance
+from apps.book_rental.tariffs import get_tariffs
+from apps.book_rental.tests.factories import BookFactory, RentedBookFactory, UserFactory, \
+    create_standard_categories
+from apps.mixin.tools import count_queries
+
+
+class TestRentals(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.category = create_standard_categories()['fiction']
+        self.book = BookFactory(category=self.category, book_quantity=2)
+
+    def test_rent(self):
+        rented_book = rentals.rent_book(self.book.id, self.user.id, self.user)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.book_quantity, 1)
+        self.assertEqual(rented_book.rent_date, datetime.date.today())
+        self.assertEqual(UserBalance.objects.get(user=self.user).get_open_rentals(),
+                         {'{}:{}'.format(self.category.id, datetime.date.today().isoformat()): [1, 0]})
+
+    def test_rent_errors(self):
+        """
+        Failed rentals leave the stock as it was
+        """
+        rentals.rent_book(self.book.id, self.user.id, self.user)
+        with self.assertRaises(rentals.AlreadyRented):
+            rentals.rent_book(self.book.id, self.user.id, self.user)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.book_quantity, 1)
+
+        rentals.rent_book(self.book.id, UserFactory().id, self.user)
+        with self.assertRaises(rentals.OutOfStock):
+            rentals.rent_book(self.book.id, UserFactory().id, self.user)
+        with self.assertRaises(rentals.BookNotFound):
+            rentals.rent_book(self.book.id + 100, self.user.id, self.user)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.book_quantity, 0)
+
+    def test_return(self):
+        """
+        Return puts the copy back and freezes the charge, later tariff changes do not reprice it
+        """
+        rented_book = rentals.rent_book(self.book.id, self.user.id, self.user, rent_date=datetime.date(2020, 5, 1))
+        rented_book = rentals.return_rental(rented_book.id, self.user, return_date=datetime.date(2020, 5, 10))
+        self.assertEqual(rented_book.final_charge, 12.5)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.book_quantity, 2)
+        self.assertEqual(rented_book.history.first().history_type, '~')
+        self.assertEqual(rented_book.history.first().final_charge, 12.5)
+
+        with self.assertRaises(rentals.AlreadyReturned):
+            rentals.return_rental(rented_book.id, self.user)
+        with self.assertRaises(rentals.RentalNotFound):
+            rentals.return_rental(rented_book.id, self.user, user_id=UserFactory().id)
+
+        rented_book.fine_charged = 1
+        rented_book.save()
+        day_charge = self.category.dayswise_charges.get(days_from=3)
+        day_charge.per_day_charge = 10
+        day_charge.save()
+
+        rented_book = RentedBook.objects.get(id=rented_book.id)
+        self.assertEqual(rented_book.total_charge, 13.5)
+        self.assertEqual(RentedBook.objects.with_charges().get(id=rented_book.id).total_charge_db, 13.5)
+        self.assertEqual(compute_charges(), {rented_book.id: 13.5})
+        balance = UserBalance.objects.get(user=self.user)
+        self.assertEqual((balance.settled_charges, balance.get_open_rentals()), (13.5, {}))
+
+        # not frozen rentals still follow the tariff
+        RentedBookFactory(user=self.user, book=self.book,
+                          rent_date=datetime.date(2020, 6, 1), return_date=datetime.date(2020, 6, 10))
+        self.assertEqual(UserBalance.objects.get(user=self.user).settled_charges, 13.5 + 2 + 7 * 10)
+
+
+class TestBatchRentals(TestCase):
+
+    def setUp(self):
+        self.staff = UserFactory(is_staff=True)
+        self.users = UserFactory.create_batch(3)
+        self.category = create_standard_categories()['fiction']
+        self.book = BookFactory(category=self.category, book_quantity=2)
+        self.other_book = BookFactory(category=self.category, book_quantity=1)
+
+    def assertLedgerConsistent(self):
+        balances = compute_balances()
+        for user_balance in UserBalance.objects.all():
+            balance = balances[user_balance.user_id]
+            self.assertEqual((user_balance.settled_charges, user_balance.get_open_rentals()),
+                             (balance.settled_charges, dict(balance.open_rentals)))
+
+    def test_rent_books(self):
+        """
+        Every item succeeds or fails on its own
+        """
+        user_1, user_2, user_3 = self.users
+        results = rentals.rent_books([
+            (self.book.id, user_1.id),
+            (self.book.id, user_1.id),
+            (self.book.id, user_2.id),
+            (self.book.id, user_3.id),
+            (self.other_book.id, user_3.id),
+            (self.book.id + 100, user_1.id),
+            (self.other_book.id, user_3.id + 100),
+        ], self.staff)
+        self.assertEqual([type(result) for result in results], [
+            RentedBook, rentals.AlreadyRented, RentedBook, rentals.OutOfStock, RentedBook,
+            rentals.BookNotFound, rentals.UserNotFound,
+        ])
+        self.assertEqual(set(RentedBook.objects.values_list('id', 'user_id', 'book_id')),
+                         {(result.id, result.user_id, result.book_id) for result in results
+                          if isinstance(result, RentedBook)})
+        self.assertEqual(dict(Book.objects.values_list('id', 'book_quantity')),
+                         {self.book.id: 0, self.other_book.id: 0})
+        self.assertEqual(RentedBook.history.filter(history_type='+').count(), 3)
+        self.assertLedgerConsistent()
+
+    def test_rented_meanwhile(self):
+        """
+        Rental committed by another request after the batch checked for duplicates fails only its own item
+        """
+        user_1, user_2, _ = self.users
+
+        def rented_meanwhile(stock):
+            RentedBookFactory(user=user_1, book=self.book, rent_date=datetime.date.today(), return_date=None)
+            return Counter(stock)
+
+        with mock.patch('apps.book_rental.rentals.Counter', side_effect=rented_meanwhile):
+            results = rentals.rent_books([(self.book.id, user_1.id), (self.book.id, user_2.id)], self.staff)
+        self.assertEqual([type(result) for result in results], [rentals.AlreadyRented, RentedBook])
+        self.assertEqual(RentedBook.objects.get(id=results[1].id).user_id, user_2.id)
+        self.assertEqual(Book.objects.get(id=self.book.id).book_quantity, 1)
+        self.assertEqual(RentedBook.history.filter(history_type='+', user_id=user_2.id).count(), 1)
+        self.assertLedgerConsistent()
+
+    def test_return_rentals(self):
+        rented_books = [RentedBookFactory(user=user, book=self.book, rent_date=datetime.date(2020, 5, 1),
+                                          return_date=None) for user in self.users]
+        results = rentals.return_rentals(
+            [rented_books[0].id, rented_books[1].id, rented_books[0].id, 0], self.staff,
+            return_date=datetime.date(2020, 5, 10))
+        self.assertEqual([type(result) for result in results],
+                         [RentedBook, RentedBook, rentals.AlreadyReturned, rentals.RentalNotFound])
+        self.assertEqual(RentedBook.objects.get(id=rented_books[0].id).final_charge, 12.5)
+        self.assertEqual(Book.objects.get(id=self.book.id).book_quantity, 4)
+        self.assertEqual(RentedBook.history.filter(history_type='~', final_charge=12.5).count(), 2)
+        self.assertLedgerConsistent()
+
+        # users only return their own rentals
+        results = rentals.return_rentals([rented_books[2].id], self.staff, user_id=self.users[0].id)
+        self.assertIsInstance(results[0], rentals.RentalNotFound)
+
+    def test_constant_queries(self):
+        """
+        Queries do not grow with size of the batch
+        """
+        books = BookFactory.create_batch(20, category=self.category, book_quantity=5)
+        users = UserFactory.create_batch(20)
+        # both batches update a balance and create one
+        UserBalance.objects.create(user=users[0])
+
+        def rent(start, count):
+            with count_queries() as queries:
+                results = rentals.rent_books([(book.id, user.id) for book in books[start:start + count]
+                                              for user in users[:count]], self.staff)
+            self.assertTrue(all(isinstance(result, RentedBook) for result in results[:5]))
+            return len(queries), results
+
+        def return_rentals(results):
+            with count_queries() as queries:
+                rentals.return_rentals([result.id for result in results if isinstance(result, RentedBook)],
+                                       self.staff)
+            return len(queries)
+
+        get_tariffs([self.category.id])  # warm up, compiled tariffs are cached
+        small_rent, small_results = rent(0, 2)
+        large_rent, large_results = rent(10, 10)
+        self.assertEqual(small_rent, large_rent)
+        self.assertEqual(return_rentals(small_results), return_rentals(large_results))
+        self.assertLedgerConsistent()
+
+
+class TestRentalAPI(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.staff = UserFactory(is_staff=True)
+        self.book = BookFactory(category=create_standard_categories()['regular'], book_quantity=1)
+        self.client.force_login(user=self.user)
+
+    def test_rent_and_return(self):
+        response = self.client.post(reverse('rentals'), {'book_id': self.book.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['user_id'], data['book_id'], data['final_charge']), (self.user.id, self.book.id, None))
+
+        response = self.client.post(reverse('rentals'), {'book_id': self.book.id}, format='json')
+        self.assertEqual(response.status_code, 409)
+
+        url = reverse('rental-return', kwargs={'rental_id': data['id']})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['final_charge'], 0.0)
+        self.assertEqual(self.client.post(url).status_code, 409)
+
+    def test_permissions(self):
+        other = UserFactory()
+        response = self.client.post(reverse('rentals'), {'book_id': self.book.id, 'user_id': other.id}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.post(reverse('rentals'), {'book_id': 0}, format='json').status_code, 404)
+
+        self.client.force_login(user=self.staff)
+        response = self.client.post(reverse('rentals'), {'book_id': self.book.id, 'user_id': other.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        url = reverse('rental-return', kwargs={'rental_id': response.json()['id']})
+
+        self.client.force_login(user=self.user)
+        self.assertEqual(self.client.post(url).status_code, 404)
+        self.client.force_login(user=self.staff)
+        self.assertEqual(self.client.post(url).status_code, 200)
+
+    def test_batch(self):
+        other_book = BookFactory(category=self.book.category, book_quantity=1)
+        response = self.client.post(reverse('rentals-batch'), {'items': [
+            {'book_id': self.book.id}, {'book_id': other_book.id}, {'book_id': other_book.id}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [201, 201, 409])
+        self.assertEqual(results[2]['code'], 'already_rented')
+        self.assertEqual(results[0]['rental']['book_id'], self.book.id)
+
+        rental_ids = [results[0]['rental']['id'], results[1]['rental']['id']]
+        response = self.client.post(reverse('rentals-batch-return'), {'rental_ids': rental_ids + [0]}, format='json')
+        self.assertEqual([result['status'] for result in response.json()['results']], [200, 200, 404])
+
+    def test_batch_permissions(self):
+        response = self.client.post(reverse('rentals-batch'), {'items': [
+            {'book_id': self.book.id, 'user_id': self.staff.id}]}, format='json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(reverse('rentals-batch'), {'items': [{'book_id': self.book.id}] * 101},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+        self.client.force_login(user=self.staff)
+        response = self.client.post(reverse('rentals-batch'), {'items': [
+            {'book_id': self.book.id, 'user_id': self.user.id}]}, format='json')
+        self.assertEqual(response.json()['results'][0]['rental']['user_id'], self.user.id)
+
+
+class TestConcurrentRentals(TransactionTestCase):
+    """
+    Many threads, each with its own database connection, rent the last copies at once.
+    Throughput is measured by benchmarks/rentals.py
+    """
+    threads = 16
+    copies = 5
+
+    def setUp(self):
+        self.book = BookFactory(book_quantity=self.copies)
+        self.users = UserFactory.create_batch(self.threads)
+
+    def run_threads(self, target):
+        barrier = threading.Barrier(self.threads)
+        results = [None] * self.threads
+
+        def run(index):
+            try:
+                barrier.wait()
+                results[index] = target(index)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def rent(self, index):
+        client = APIClient()
+        client.force_authenticate(user=self.users[index])
+        return client.post(reverse('rentals'), {'book_id': self.book.id}, format='json').status_code
+
+    def test_no_oversell(self):
+        results = self.run_threads(self.rent)
+        self.assertEqual(Counter(results), {201: self.copies, 409: self.threads - self.copies})
+        self.assertEqual(Book.objects.get(id=self.book.id).book_quantity, 0)
+        self.assertEqual(RentedBook.objects.count(), self.copies)
+
+    def test_single_return(self):
+        rented_book = rentals.rent_book(self.book.id, self.users[0].id, self.users[0])
+
+        def return_rental(index):
+            try:
+                rentals.return_rental(rented_book.id, self.users[0])
+            except rentals.AlreadyReturned:
+                return False
+            return True
+
+        results = self.run_threads(return_rental)
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Book.objects.get(id=self.book.id).book_quantity, self.copies)
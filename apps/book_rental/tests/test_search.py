@@ -0,0 +1,177 @@
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test.testcases import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from apps.book_rental.models import Book
+from apps.book_rental.search import MySQLSearch, PostgresSearch, SearchBackend, get_backend, search_books
+from apps.book_rental.tests.factories import BookFactory, CategoryFactory, UserFactory
+
+
+def book_ids(query):
+    return [book_id for book_id, rank in search_books(query)]
+
+
+class TestSearchIndex(TestCase):
+
+    def setUp(self):
+        self.author = UserFactory(first_name='Dan', last_name='Brown')
+        self.category = CategoryFactory(name='fiction')
+        self.da_vinci = BookFactory(name='Da Vinci Code', description='Symbologist in Paris',
+                                    author=self.author, category=self.category)
+        self.angels = BookFactory(name='Angels and Demons', description='Sequel to the Da Vinci Code',
+                                  author=self.author, category=self.category)
+        self.kite_runner = BookFactory(name='The Kite Runner', description='Kabul',
+                                       category=CategoryFactory(name='novels'))
+
+    def test_ranked(self):
+        """
+        Name matches rank above description matches, words are matched as prefixes
+        """
+        self.assertEqual(book_ids('vinci code'), [self.da_vinci.id, self.angels.id])
+        self.assertEqual(book_ids('Vin'), [self.da_vinci.id, self.angels.id])
+        self.assertEqual(book_ids('brown'), [self.da_vinci.id, self.angels.id])
+        self.assertEqual(book_ids('novels'), [self.kite_runner.id])
+        self.assertEqual(book_ids('kite paris'), [])
+        self.assertEqual(book_ids('"* AND OR'), [])
+
+    def test_signals(self):
+        """
+        Index follows changes of books, their authors and categories
+        """
+        self.kite_runner.name = 'A Thousand Splendid Suns'
+        self.kite_runner.save()
+        self.assertEqual(book_ids('kite'), [])
+        self.assertEqual(book_ids('splendid'), [self.kite_runner.id])
+
+        self.author.last_name = 'Green'
+        self.author.save()
+        self.assertEqual(book_ids('brown'), [])
+        self.assertEqual(book_ids('green'), [self.da_vinci.id, self.angels.id])
+
+        self.category.name = 'regular'
+        self.category.save()
+        self.assertEqual(book_ids('regular'), [self.da_vinci.id, self.angels.id])
+
+        self.angels.delete()
+        self.assertEqual(book_ids('vinci'), [self.da_vinci.id])
+
+    def test_name_not_changed(self):
+        """
+        Books are indexed again only when the author or category name changed
+        """
+        with mock.patch('apps.book_rental.search.index_books') as index_books:
+            self.author.email = 'dan@example.com'
+            self.author.save()
+            self.author.save(update_fields=['last_login'])
+            self.category.save()
+        index_books.assert_not_called()
+
+    def test_rebuild_command(self):
+        """
+        Bulk created books are indexed by rebuild command
+        """
+        Book.objects.bulk_create([Book(name='Inferno', slug='inferno', author=self.author,
+                                       category=self.category, created_by=self.author)])
+        self.assertEqual(book_ids('inferno'), [])
+
+        out = StringIO()
+        call_command('rebuild_search_index', since_id=self.kite_runner.id, stdout=out)
+        self.assertIn('Indexed 1 books', out.getvalue())
+        self.assertEqual(book_ids('inferno'), [Book.objects.get(name='Inferno').id])
+
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 4 books', out.getvalue())
+        self.assertEqual(set(book_ids('brown')),
+                         set(Book.objects.filter(author=self.author).values_list('id', flat=True)))
+
+
+class TestSearchAPI(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.book = BookFactory(name='Da Vinci Code')
+        BookFactory(name='Digital Fortress', description='Not by Da Vinci')
+        self.client.force_login(user=self.user)
+
+    def test_search(self):
+        response = self.client.get(reverse('books-search'), {'q': 'da vinci', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['id'], self.book.id)
+        self.assertEqual(results[0]['name'], 'Da Vinci Code')
+        self.assertGreater(results[0]['rank'], 0)
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get(reverse('books-search')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('books-search'), {'q': 'vinci', 'limit': 1000}).status_code, 400)
+
+
+class TestBackendSQL(SimpleTestCase):
+    """
+    SQL of the PostgreSQL and MySQL backends, which only run against those databases
+    """
+    documents = [(1, 'Da Vinci Code', 'Dan Brown', 'fiction', 'Symbologist in Paris')]
+
+    def statements(self, backend_class, call):
+        """
+        (sql, params) the backend executes in call(backend), params of executemany are its first row
+        """
+        connection = mock.MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = []
+        call(backend_class(connection))
+        statements = [(args[0], args[1] if len(args) > 1 else None)
+                      for args, _ in cursor.execute.call_args_list]
+        statements += [(sql, rows[0]) for (sql, rows), _ in cursor.executemany.call_args_list]
+        for sql, params in statements:
+            self.assertEqual(sql.count('%s'), len(params or ()), msg=sql)
+        return statements
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            SearchBackend(mock.MagicMock())
+
+    def test_backend_of_vendor(self):
+        for vendor, backend_class in (('postgresql', PostgresSearch), ('mysql', MySQLSearch)):
+            self.assertIsInstance(get_backend(mock.MagicMock(vendor=vendor)), backend_class)
+
+    def test_migration(self):
+        """
+        Search tables have no foreign key to books, flush would fail on it
+        """
+        migration = import_module('apps.book_rental.migrations.0008_book_search')
+        for vendor in ('sqlite', 'postgresql', 'mysql'):
+            schema_editor = mock.MagicMock()
+            schema_editor.connection.vendor = vendor
+            migration.create_search_table(None, schema_editor)
+            statements = [args[0] for args, _ in schema_editor.execute.call_args_list]
+            self.assertTrue(statements[0].startswith('CREATE '))
+            self.assertFalse([sql for sql in statements if 'REFERENCES' in sql])
+
+    def test_postgres(self):
+        [(upsert, params)] = self.statements(PostgresSearch, lambda backend: backend.index(self.documents))
+        self.assertIn("setweight(to_tsvector('simple', %s), 'A') || ", upsert)
+        self.assertIn('ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document', upsert)
+        self.assertEqual(params, self.documents[0])
+
+        [(search, params)] = self.statements(PostgresSearch, lambda backend: backend.search(['vinci', 'co'], 5))
+        self.assertIn("to_tsquery('simple', %s) query WHERE document @@ query", search)
+        self.assertEqual(params, ['{0.1, 0.2, 0.5, 1.0}', 'vinci:* & co:*', 5])
+
+        [(remove, params)] = self.statements(PostgresSearch, lambda backend: backend.remove([1]))
+        self.assertEqual((remove, params), ('DELETE FROM book_rental_book_search WHERE book_id = %s', (1,)))
+
+    def test_mysql(self):
+        [(upsert, params)] = self.statements(MySQLSearch, lambda backend: backend.index(self.documents))
+        self.assertTrue(upsert.startswith('REPLACE INTO book_rental_book_search (book_id, name, author'))
+        self.assertEqual(params, self.documents[0])
+
+        [(search, params)] = self.statements(MySQLSearch, lambda backend: backend.search(['vinci', 'co'], 5))
+        self.assertIn('+ 10.0 * MATCH (name) AGAINST (%s IN BOOLEAN MODE)', search)
+        self.assertEqual(params, ['+vinci* +co*', '+vinci* +co*', '+vinci* +co*', 5])
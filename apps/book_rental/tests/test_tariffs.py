@@ -0,0 +1,215 @@
+import datetime
+import uuid
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test.testcases import TestCase
+from django.utils import timezone
+
+from apps.book_rental.billing import compute_charges
+from apps.book_rental import versions
+from apps.book_rental.models import CategoryDayCharge
+from apps.book_rental.tariffs import CompiledTariff, RENT_DATE_TARIFF, Slab, get_tariff, get_tariff_histories, \
+    invalidate_tariff, walk_slabs
+from apps.book_rental.tests.factories import BookFactory, CategoryFactory, CategoryDayChargeFactory, \
+    RentedBookFactory, UserFactory, create_standard_categories
+
+FICTION_SLABS = [Slab(0, 2, 1.0, 2.0, 2), Slab(3, 30, 1.5, 4.5, 5), Slab(31, None, 2.0, 0.0, None)]
+REGULAR_SLABS = [Slab(0, 2, 1.0, 2.0, 2), Slab(3, None, 1.5, 0.0, None)]
+NOVEL_SLABS = [Slab(0, 3, 1.5, 4.5, 3), Slab(4, None, 1.5, 0.0, None)]
+DEFAULT_SLABS = [Slab(0, None, 1.0, 0.0, None)]
+# not contiguous, overlapping and closed tariffs are still charged like the slab walk does
+ODD_SLABS = [Slab(0, 5, 1.0, 0.0, None), Slab(4, 10, 2.0, 9.0, 8), Slab(20, 25, 3.0, 0.0, None)]
+
+
+def slab_walk_charge(slabs, days_rented):
+    """
+    Day wise charge loop RentedBook.total_charge had before tariffs were compiled
+    """
+    days_calculated = 0
+    total_charges = 0
+    for dayswise in slabs:
+        if days_calculated == days_rented:
+            break
+        if dayswise.min_days and days_rented <= dayswise.min_days:
+            total_charges += dayswise.min_charge
+            break
+        if not dayswise.days_to:
+            total_charges += ((days_rented - days_calculated) * dayswise.per_day_charge)
+            break
+        if dayswise.days_from <= days_rented <= dayswise.days_to:
+            days_duration = days_rented - days_calculated
+            total_charges += (days_duration * dayswise.per_day_charge)
+            days_calculated += days_duration
+        elif dayswise.days_from <= days_rented > dayswise.days_to:
+            days_duration = dayswise.days_to - dayswise.days_from
+            total_charges += (days_duration * dayswise.per_day_charge)
+            days_calculated += days_duration
+    return total_charges
+
+
+class TestCompiledTariff(TestCase):
+
+    def test_same_charges_as_slab_walk(self):
+        """
+        Compiled tariff should give exactly same charges as slab walk for every day
+        """
+        for slabs in (FICTION_SLABS, REGULAR_SLABS, NOVEL_SLABS, DEFAULT_SLABS, ODD_SLABS, []):
+            tariff = CompiledTariff(slabs)
+            for days in range(-40, 200):
+                self.assertEqual(tariff.charge(days), slab_walk_charge(slabs, days),
+                                 msg='{} days of {}'.format(days, slabs))
+
+    def test_pieces(self):
+        """
+        fiction tariff is compiled into one piece per slab plus min charge pieces
+        """
+        tariff = CompiledTariff(FICTION_SLABS)
+        self.assertEqual(tariff.bounds, [-1, 0, 2, 5, 30])
+        self.assertEqual(tariff.charge(1), 2.0)
+        self.assertEqual(tariff.charge(4), 6.5)
+        self.assertEqual(tariff.charge(30), 44)
+        self.assertEqual(tariff.charge(10 ** 6), 2 + 27 * 1.5 + (10 ** 6 - 29) * 2)
+
+    def test_large_bounds(self):
+        """
+        Compiling walks the slab boundaries, not every day up to them
+        """
+        slabs = [Slab(0, 365000, 1.0, 0.0, None), Slab(365000, None, 2.0, 0.0, None)]
+        with mock.patch('apps.book_rental.tariffs.walk_slabs', wraps=walk_slabs) as walk:
+            tariff = CompiledTariff(slabs)
+        self.assertLess(walk.call_count, 10)
+        for days in (-1, 0, 1, 364999, 365000, 365001, 400000):
+            self.assertEqual(tariff.charge(days), slab_walk_charge(slabs, days))
+
+
+class TestTariffCache(TestCase):
+
+    def setUp(self):
+        self.category = CategoryFactory(name='fiction')
+
+    def test_cached_tariff(self):
+        """
+        Tariff is compiled once and served from cache
+        """
+        tariff = get_tariff(self.category.id)
+        with self.assertNumQueries(0):
+            self.assertIs(get_tariff(self.category.id), tariff)
+
+    def test_invalidated_on_day_charge_change(self):
+        """
+        Saving or deleting day wise charges compiles tariff again
+        """
+        self.assertEqual(get_tariff(self.category.id).charge(10), 10.0)
+
+        default_charge = self.category.dayswise_charges.get()
+        default_charge.per_day_charge = 2
+        default_charge.save()
+        self.assertEqual(get_tariff(self.category.id).charge(10), 20.0)
+
+        CategoryDayChargeFactory(category=self.category, days_from=5, per_day_charge=3)
+        default_charge.days_to = 4
+        default_charge.save()
+        self.assertEqual(get_tariff(self.category.id).charge(10), 4 * 2.0 + 6 * 3.0)
+
+        default_charge.delete()
+        self.assertEqual(get_tariff(self.category.id).charge(10), 10 * 3.0)
+
+    def test_rolled_back_change(self):
+        """
+        Tariff compiled from a change which is rolled back afterwards is not kept
+        """
+        default_charge = self.category.dayswise_charges.get()
+        try:
+            with transaction.atomic():
+                default_charge.per_day_charge = 2
+                default_charge.save()
+                self.assertEqual(get_tariff(self.category.id).charge(10), 20.0)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(get_tariff(self.category.id).charge(10), 10.0)
+
+    def test_changed_by_other_process(self):
+        """
+        Tariffs are compiled again once another process moved the version
+        """
+        versions.check()
+        tariff = get_tariff(self.category.id)
+        versions.check()
+        self.assertIs(get_tariff(self.category.id), tariff)
+
+        cache.set(versions.KEY_PREFIX + 'tariffs', uuid.uuid4().hex)
+        versions.check()
+        self.assertIsNot(get_tariff(self.category.id), tariff)
+
+
+class TestTariffHistory(TestCase):
+    """
+    regular tariff changes from Rs. 1.5 to Rs. 3 per day after 2 days on 2020-05-15
+    """
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.category = create_standard_categories()['regular']
+        self.book = BookFactory(name="Regular book", category=self.category)
+        self.set_history_date(datetime.datetime(2020, 1, 1, tzinfo=timezone.utc))
+
+        day_charge = self.category.dayswise_charges.get(days_from=3)
+        day_charge.per_day_charge = 3
+        day_charge.save()
+        self.set_history_date(datetime.datetime(2020, 5, 15, 10, tzinfo=timezone.utc))
+
+    def set_history_date(self, history_date):
+        CategoryDayCharge.history.filter(history_date__gt=history_date).update(history_date=history_date)
+        invalidate_tariff()
+
+    def test_tariff_on_rent_date(self):
+        """
+        Rentals are charged on tariff active at end of their rent date
+        """
+        history = get_tariff_histories([self.category.id])[self.category.id]
+        self.assertEqual(history.tariff_on(datetime.date(2020, 5, 14)).charge(6), 8.0)
+        self.assertEqual(history.tariff_on(datetime.date(2020, 5, 15)).charge(6), 14.0)
+        # before first known version, which is the default Rs. 1 per day charge of a new category
+        self.assertEqual(history.tariff_on(datetime.date(2019, 1, 1)).charge(6), 6.0)
+
+        before = RentedBookFactory(user=self.user, book=self.book,
+                                   rent_date=datetime.date(2020, 5, 1), return_date=datetime.date(2020, 5, 7))
+        after = RentedBookFactory(user=self.user, book=self.book,
+                                  rent_date=datetime.date(2020, 5, 20), return_date=datetime.date(2020, 5, 26))
+
+        self.assertEqual(before.total_charge, 14.0)
+        self.assertEqual(before.get_total_charge(pricing=RENT_DATE_TARIFF), 8.0)
+        self.assertEqual(after.get_total_charge(pricing=RENT_DATE_TARIFF), 14.0)
+        self.assertEqual(compute_charges(pricing=RENT_DATE_TARIFF), {before.id: 8.0, after.id: 14.0})
+
+    def test_deleted_slab(self):
+        """
+        Deleted day wise charges are not part of later versions
+        """
+        self.category.dayswise_charges.get(days_from=3).delete()
+        self.set_history_date(datetime.datetime(2020, 6, 1, tzinfo=timezone.utc))
+
+        history = get_tariff_histories([self.category.id])[self.category.id]
+        self.assertEqual(len(history.tariff_on(datetime.date(2020, 6, 1)).slabs), 1)
+        self.assertEqual(len(history.tariff_on(datetime.date(2020, 5, 31)).slabs), 2)
+
+    def test_thousands_of_rentals(self):
+        """
+        Versions are resolved from one query and compiled once per version
+        """
+        for revision in range(30):
+            day_charge = self.category.dayswise_charges.get(days_from=3)
+            day_charge.per_day_charge = revision
+            day_charge.save()
+            self.set_history_date(datetime.datetime(2020, 6, 1, tzinfo=timezone.utc) + datetime.timedelta(revision))
+
+        history = get_tariff_histories([self.category.id])[self.category.id]
+        with self.assertNumQueries(0):
+            charges = [history.tariff_on(datetime.date(2020, 5, 1) + datetime.timedelta(days % 60)).charge(days % 40)
+                       for days in range(5000)]
+        self.assertEqual(charges[61], 2 + 19 * 1.5)
+        # rented on 2020-06-05 for 15 days, revision 4 is active
+        self.assertEqual(charges[95], 2 + 13 * 4)
@@ -1,7 +1,8 @@
 from django.conf.urls import url
 from rest_framework import routers
 
-from apps.book_rental.views import BookViewSet, UserBooksAPIView
+from apps.book_rental.views import BookViewSet, UserBooksAPIView, UserBalanceAPIView, QuoteAPIView, \
+    RentalAPIView, RentalReturnAPIView, RentalBatchAPIView, RentalBatchReturnAPIView
 
 router = routers.DefaultRouter()
 router.register(r'books', BookViewSet, basename='books')
@@ -10,4 +11,11 @@ urlpatterns = router.urls
 urlpatterns += [
     url(r'^user-books/(?P<user_id>[0-9]+)/$', UserBooksAPIView.as_view(),
         name='user-books'),
+    url(r'^user-books/(?P<user_id>[0-9]+)/balance/$', UserBalanceAPIView.as_view(),
+        name='user-balance'),
+    url(r'^quotes/$', QuoteAPIView.as_view(), name='quotes'),
+    url(r'^rentals/$', RentalAPIView.as_view(), name='rentals'),
+    url(r'^rentals/(?P<rental_id>[0-9]+)/return/$', RentalReturnAPIView.as_view(), name='rental-return'),
+    url(r'^rentals/batch/$', RentalBatchAPIView.as_view(), name='rentals-batch'),
+    url(r'^rentals/batch/return/$', RentalBatchReturnAPIView.as_view(), name='rentals-batch-return'),
 ]
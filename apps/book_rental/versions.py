@@ -0,0 +1,74 @@
+"""
+Versions of data kept in Django's cache, which is shared by the workers (settings.CACHES).
+
+They invalidate caches every worker keeps in memory (compiled tariffs, autocomplete) across
+processes: a write sets a new version and middleware.VersionCheckMiddleware
+compares versions with the ones seen last, once per request, dropping the
+caches another process changed meanwhile.
+
+They are also validators which cost no query, e.g. ETag of the books list (etags.py).
+"""
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+KEY_PREFIX = 'book_rental:version:'
+
+# {name: callable dropping the cache}
+_invalidators = {}
+_seen = {}
+
+
+def register(name, invalidate):
+    _invalidators[name] = invalidate
+
+
+def set_version(name):
+    """
+    When the version was not moved by another process since last check, this process
+    stays current: its own cache is invalidated by the writer
+    """
+    key = KEY_PREFIX + name
+    previous = cache.get(key)
+    version = uuid.uuid4().hex
+    cache.set(key, version, None)
+    if name in _seen and _seen[name] == previous:
+        _seen[name] = version
+
+
+def bump(name):
+    """
+    New version right away, so that what is read meanwhile from data before the change
+    goes stale as well, and again once the current transaction commits
+    """
+    set_version(name)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: set_version(name))
+
+
+def current(name):
+    """
+    Version of name, a new one is set when the cache has none e.g. after it was cleared
+    """
+    key = KEY_PREFIX + name
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def check():
+    """
+    Drops caches whose version changed since last check, one cache round trip
+    """
+    if not _invalidators:
+        return
+    versions = cache.get_many([KEY_PREFIX + name for name in _invalidators])
+    for name, invalidate in _invalidators.items():
+        version = versions.get(KEY_PREFIX + name)
+        if name in _seen and _seen[name] != version:
+            invalidate()
+        _seen[name] = version
+
@@ -1,17 +1,30 @@
+from datetime import date
+
 from django.contrib.auth.models import User
-from django.db.models import ExpressionWrapper, F, DurationField
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from oauth2_provider.contrib.rest_framework import OAuth2Authentication
 from rest_framework import permissions
 from rest_framework import serializers
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication
-from rest_framework.exceptions import NotFound
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound, PermissionDenied, ValidationError
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
-from rest_framework.status import HTTP_200_OK
+from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_409_CONFLICT
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.viewsets import ReadOnlyModelViewSet
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from apps.book_rental.models import Book, RentedBook
+from apps.book_rental import rentals
+from apps.book_rental.autocomplete import autocomplete_books
+from apps.book_rental.etags import books_etag, user_books_etag
+from apps.book_rental.models import Book, RentedBook, UserBalance
+from apps.book_rental.pagination import BookPagination, RentedBookPagination
+from apps.book_rental.search import search_books
+from apps.book_rental.tariffs import get_tariffs
 
 
 class BookSerializer(serializers.ModelSerializer):
@@ -23,10 +36,25 @@ class BookSerializer(serializers.ModelSerializer):
         exclude = ['created_at', 'created_by', 'updated_at', 'updated_by']
 
 
+class BookSearchSerializer(BookSerializer):
+    rank = serializers.FloatField(read_only=True)
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField()
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class AutocompleteQuerySerializer(serializers.Serializer):
+    q = serializers.CharField()
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
 class BookViewSet(ReadOnlyModelViewSet):
     """
     Returns paginated list of books
-    Default pagination size is 100
+    Default pagination size is 100, pages are keyed on id (see BookPagination)
+    so deep pages cost same as the first one
     """
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -35,7 +63,43 @@ class BookViewSet(ReadOnlyModelViewSet):
                               SessionAuthentication,
                               TokenAuthentication)
     serializer_class = BookSerializer
-    search_fields = ['name']
+    pagination_class = BookPagination
+
+    @method_decorator(condition(etag_func=books_etag))
+    def list(self, request, *args, **kwargs):
+        """
+        Unchanged books are answered with 304 Not Modified, see etags.py
+        """
+        return super(BookViewSet, self).list(request, *args, **kwargs)
+
+    @action(detail=False)
+    def search(self, request):
+        """
+        Books matching every word of q in name, author, category or description,
+        best match first (see search.py)
+        """
+        params = SearchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        ranked = search_books(params.validated_data['q'], params.validated_data['limit'])
+        books = self.get_queryset().in_bulk([book_id for book_id, rank in ranked])
+        results = []
+        for book_id, rank in ranked:
+            book = books.get(book_id)
+            # index is behind until rebuilt after bulk writes
+            if book is not None:
+                book.rank = rank
+                results.append(book)
+        return Response({'results': BookSearchSerializer(results, many=True).data}, status=HTTP_200_OK)
+
+    @action(detail=False)
+    def autocomplete(self, request):
+        """
+        Books whose name (or slug) starts with q, served from memory without a query (see autocomplete.py)
+        """
+        params = AutocompleteQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        books = autocomplete_books(params.validated_data['q'], params.validated_data['limit'])
+        return Response({'results': [{'id': book_id, 'name': name} for book_id, name in books]}, status=HTTP_200_OK)
 
     def get_queryset(self):
         """
@@ -59,11 +123,59 @@ class RentedBookSerialiser(serializers.ModelSerializer):
                   'total_charge', 'rent_date', 'return_date']
 
 
+class RentedBookFilterSerializer(serializers.Serializer):
+    OPEN = 'open'
+    RETURNED = 'returned'
+
+    status = serializers.ChoiceField(choices=[OPEN, RETURNED], required=False)
+    unpaid = serializers.BooleanField(required=False)
+    rent_date_from = serializers.DateField(required=False)
+    rent_date_to = serializers.DateField(required=False)
+    stream = serializers.BooleanField(required=False)
+
+    def filter_queryset(self, queryset):
+        filters = self.validated_data
+        if filters.get('status') == self.OPEN:
+            queryset = queryset.filter(return_date__isnull=True)
+        elif filters.get('status') == self.RETURNED:
+            queryset = queryset.filter(return_date__isnull=False)
+        if filters.get('unpaid'):
+            queryset = queryset.filter(has_charges_paid=False)
+        if 'rent_date_from' in filters:
+            queryset = queryset.filter(rent_date__gte=filters['rent_date_from'])
+        if 'rent_date_to' in filters:
+            queryset = queryset.filter(rent_date__lte=filters['rent_date_to'])
+        return queryset
+
+
+def stream_json_array(items, encoder_class=JSONEncoder):
+    """
+    Yields JSON array of items piece by piece, the array is never built in memory
+    """
+    encoder = encoder_class()
+    yield '['
+    separator = ''
+    for item in items:
+        yield separator + encoder.encode(item)
+        separator = ','
+    yield ']'
+
+
 class UserBooksAPIView(GenericAPIView):
     """
-    Gives a User's rented books with charges and fine applied
+    Gives a User's rented books with charges and fine applied,
+    cursor paginated on (rent_date, id) and filtered by
+    status (open/returned), unpaid and rent_date_from/rent_date_to.
+
+    With ?stream=1 all the (filtered) rented books are streamed as
+    a JSON array without pagination, for exports of large histories.
     """
     serializer_class = RentedBookSerialiser
+    pagination_class = RentedBookPagination
+    stream_chunk_size = 2000
+    # columns needed by RentedBookSerialiser, audit fields are not loaded while streaming
+    stream_fields = ('book__name', 'book__category_id', 'rent_date', 'return_date', 'has_charges_paid', 'fine_charged',
+                     'final_charge')
     permission_classes = (permissions.IsAuthenticated,)
     authentication_classes = (JWTAuthentication,
                               OAuth2Authentication,
@@ -72,15 +184,12 @@ class UserBooksAPIView(GenericAPIView):
 
     def get_queryset(self):
         """
-        queryset with prefetch_related for book and category
+        queryset with select_related for book,
+        category is not needed as charges are priced from cached tariffs
         """
-        return RentedBook.objects.filter(user=self.kwargs['user_id']).annotate(
-            time_spent=ExpressionWrapper(
-                F('return_date') - F('rent_date'),
-                output_field=DurationField()
-            )
-        ).prefetch_related('book')
+        return RentedBook.objects.filter(user=self.kwargs['user_id']).select_related('book')
 
+    @method_decorator(condition(etag_func=user_books_etag))
     def get(self, request, user_id):
 
         try:
@@ -88,7 +197,256 @@ class UserBooksAPIView(GenericAPIView):
         except User.DoesNotExist:
             raise NotFound(detail="User not found")
 
-        queryset = self.get_queryset()
-        serialiser = RentedBookSerialiser(queryset, many=True)
-        data = serialiser.data
+        filters = RentedBookFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        queryset = filters.filter_queryset(self.get_queryset())
+        if filters.validated_data.get('stream'):
+            return self.stream(queryset)
+
+        rented_books = self.paginate_queryset(queryset)
+        # day wise charges of all the categories, which are not cached yet, with one query
+        get_tariffs({rented_book.book.category_id for rented_book in rented_books})
+        serialiser = RentedBookSerialiser(rented_books, many=True)
+        return self.get_paginated_response(serialiser.data)
+
+    def stream(self, queryset):
+        """
+        Rented books are fetched stream_chunk_size rows at a time and serialised row by row,
+        so memory used does not grow with number of rows
+        """
+        get_tariffs(queryset.values_list('book__category_id', flat=True).distinct())
+        serialiser = RentedBookSerialiser()
+        rented_books = queryset.order_by(*self.pagination_class.ordering).only(
+            *self.stream_fields).iterator(chunk_size=self.stream_chunk_size)
+        return StreamingHttpResponse(
+            stream_json_array(serialiser.to_representation(rented_book) for rented_book in rented_books),
+            content_type='application/json'
+        )
+
+
+class UserBalanceAPIView(GenericAPIView):
+    """
+    Gives a User's outstanding balance from the ledger (UserBalance),
+    not returned books are charged till as_of date (today by default)
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    authentication_classes = (JWTAuthentication,
+                              OAuth2Authentication,
+                              SessionAuthentication,
+                              TokenAuthentication)
+
+    def get(self, request, user_id):
+        as_of = request.query_params.get('as_of')
+        if as_of is not None:
+            try:
+                as_of = parse_date(as_of)
+            except ValueError:
+                as_of = None
+            if as_of is None:
+                raise ValidationError({'as_of': 'Date should be in YYYY-MM-DD format'})
+        as_of = as_of or date.today()
+
+        try:
+            balance = UserBalance.objects.get(user_id=user_id)
+        except UserBalance.DoesNotExist:
+            if not User.objects.filter(id=user_id).exists():
+                raise NotFound(detail="User not found")
+            balance = UserBalance(user_id=user_id)
+
+        settled_charges = balance.settled_charges
+        open_charges = balance.open_charges(as_of)
+        data = {'user_id': int(user_id),
+                'as_of': as_of.isoformat(),
+                'settled_charges': settled_charges,
+                'open_charges': open_charges,
+                'total_charge': settled_charges + open_charges}
+        return Response(data, status=HTTP_200_OK)
+
+
+class QuoteSerializer(serializers.Serializer):
+    book_ids = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=1000)
+    days = serializers.ListField(child=serializers.IntegerField(min_value=0), min_length=1, max_length=50)
+
+
+class QuoteAPIView(GenericAPIView):
+    """
+    Quotes rent charges of books for given number of days, without renting them.
+    Categories of all the books are fetched with one query,
+    charges are priced from cached tariffs.
+    """
+    serializer_class = QuoteSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    authentication_classes = (JWTAuthentication,
+                              OAuth2Authentication,
+                              SessionAuthentication,
+                              TokenAuthentication)
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        book_ids = list(dict.fromkeys(serializer.validated_data['book_ids']))
+        days = list(dict.fromkeys(serializer.validated_data['days']))
+
+        categories = dict(Book.objects.filter(id__in=book_ids).values_list('id', 'category_id'))
+        tariffs = get_tariffs(categories.values())
+
+        # books of a category have same charges
+        category_charges = {
+            category_id: {str(day): tariff.charge(day) for day in days}
+            for category_id, tariff in tariffs.items()
+        }
+        data = {
+            'quotes': [{'book_id': book_id, 'charges': category_charges[categories[book_id]]}
+                       for book_id in book_ids if book_id in categories],
+            'not_found': [book_id for book_id in book_ids if book_id not in categories],
+        }
         return Response(data, status=HTTP_200_OK)
+
+
+class Conflict(APIException):
+    status_code = HTTP_409_CONFLICT
+    default_detail = 'Request conflicts with current state'
+    default_code = 'conflict'
+
+
+def rental_api_exception(error):
+    """
+    APIException for a rentals.RentalError
+    """
+    if isinstance(error, (rentals.BookNotFound, rentals.RentalNotFound)):
+        return NotFound(detail=str(error), code=error.code)
+    return Conflict(detail=str(error), code=error.code)
+
+
+class RentalSerializer(RentedBookSerialiser):
+    class Meta(RentedBookSerialiser.Meta):
+        fields = ['id', 'user_id'] + RentedBookSerialiser.Meta.fields + ['final_charge']
+
+
+class RentRequestSerializer(serializers.Serializer):
+    book_id = serializers.IntegerField()
+    user_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=False)
+
+
+class RentalAPIView(GenericAPIView):
+    """
+    Rents a copy of a book, to the logged in user or,
+    by staff, to any user. Stock of the book is decremented atomically
+    """
+    serializer_class = RentRequestSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    authentication_classes = (JWTAuthentication,
+                              OAuth2Authentication,
+                              SessionAuthentication,
+                              TokenAuthentication)
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data.get('user_id', request.user)
+        if user != request.user and not request.user.is_staff:
+            raise PermissionDenied(detail="Only staff can rent books to other users")
+
+        try:
+            rented_book = rentals.rent_book(serializer.validated_data['book_id'], user.id, request.user)
+        except rentals.RentalError as error:
+            raise rental_api_exception(error)
+        return Response(RentalSerializer(rented_book).data, status=HTTP_201_CREATED)
+
+
+class RentalReturnAPIView(GenericAPIView):
+    """
+    Returns a rented book, freezing its charge. Users can return their own rentals, staff any rental
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    authentication_classes = (JWTAuthentication,
+                              OAuth2Authentication,
+                              SessionAuthentication,
+                              TokenAuthentication)
+
+    def post(self, request, rental_id):
+        try:
+            rented_book = rentals.return_rental(int(rental_id), request.user,
+                                                user_id=None if request.user.is_staff else request.user.id)
+        except rentals.RentalError as error:
+            raise rental_api_exception(error)
+        return Response(RentalSerializer(rented_book).data, status=HTTP_200_OK)
+
+
+class RentBatchItemSerializer(serializers.Serializer):
+    book_id = serializers.IntegerField()
+    # checked with the whole batch in rentals.rent_books
+    user_id = serializers.IntegerField(required=False)
+
+
+class RentBatchSerializer(serializers.Serializer):
+    MAX_ITEMS = 100
+
+    items = RentBatchItemSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        if len(items) > self.MAX_ITEMS:
+            raise serializers.ValidationError('At most {} items can be rented at once'.format(self.MAX_ITEMS))
+        return items
+
+
+class ReturnBatchSerializer(serializers.Serializer):
+    rental_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False,
+                                       max_length=RentBatchSerializer.MAX_ITEMS)
+
+
+def batch_results(results, success_status):
+    """
+    Response data of rentals batch results, every item has the status code it would have got alone
+    """
+    data = []
+    for result in results:
+        if isinstance(result, rentals.RentalError):
+            error = rental_api_exception(result)
+            data.append({'status': error.status_code, 'code': result.code, 'detail': str(result)})
+        else:
+            data.append({'status': success_status, 'rental': RentalSerializer(result).data})
+    return {'results': data}
+
+
+class RentalBatchAPIView(GenericAPIView):
+    """
+    Rents many books at once e.g. to a class at a library counter.
+    Items succeed or fail on their own, in a fixed number of queries (see rentals.rent_books)
+    """
+    serializer_class = RentBatchSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    authentication_classes = (JWTAuthentication,
+                              OAuth2Authentication,
+                              SessionAuthentication,
+                              TokenAuthentication)
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = [(item['book_id'], item.get('user_id', request.user.id))
+                 for item in serializer.validated_data['items']]
+        if not request.user.is_staff and any(user_id != request.user.id for _, user_id in items):
+            raise PermissionDenied(detail="Only staff can rent books to other users")
+
+        results = rentals.rent_books(items, request.user)
+        return Response(batch_results(results, HTTP_201_CREATED), status=HTTP_200_OK)
+
+
+class RentalBatchReturnAPIView(GenericAPIView):
+    """
+    Returns many rented books at once. Users can return their own rentals, staff any rental
+    """
+    serializer_class = ReturnBatchSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    authentication_classes = (JWTAuthentication,
+                              OAuth2Authentication,
+                              SessionAuthentication,
+                              TokenAuthentication)
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = rentals.return_rentals(serializer.validated_data['rental_ids'], request.user,
+                                         user_id=None if request.user.is_staff else request.user.id)
+        return Response(batch_results(results, HTTP_200_OK), status=HTTP_200_OK)
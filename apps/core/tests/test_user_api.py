@@ -1,9 +1,11 @@
 from django.contrib.auth.models import User
 from django.test.testcases import TestCase
 from django.urls import reverse
+from oauth2_provider.models import Application
 from rest_framework.test import APITestCase
 
 from apps.core.views import UserSerializer
+from apps.mixin.tools import QueryBudgetMixin
 
 
 class TestUserSetup(TestCase):
@@ -114,3 +116,71 @@ class TestUserSerializer(APITestCase):
         user_instance = ser.save()
         self.assertIsInstance(user_instance, User)
         self.assertEqual(user_instance.email, "first_name@example.com")
+
+
+class TestUserAPIQueryBudget(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username", is_staff=True)
+        self.client.force_login(user=self.user)
+
+    def create_users(self, count):
+        User.objects.bulk_create(User(username="user_{}_{}".format(User.objects.count(), i)) for i in range(count))
+
+    def test_list_api(self):
+        self.create_users(3)
+        self.assertQueriesDoNotGrow(lambda: self.client.get(reverse('users-list')),
+                                    lambda: self.create_users(30), max_queries=4)
+
+    def test_detail_api(self):
+        self.assertQueryBudget(3, self.client.get, reverse('users-detail', kwargs={'pk': self.user.id}))
+
+    def test_auth_token_api(self):
+        self.user.set_password('admin123')
+        self.user.save()
+        self.client.logout()
+        response = self.assertQueryBudget(5, self.client.post, reverse('api_token_auth'),
+                                          data={'username': "test_username", 'password': 'admin123'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_jwt_token_api(self):
+        """
+        Access and refresh tokens are signed, only obtaining them reads the user
+        """
+        self.user.set_password('admin123')
+        self.user.save()
+        self.client.logout()
+        response = self.assertQueryBudget(1, self.client.post, reverse('jwt_token_obtain_pair'),
+                                          data={'username': "test_username", 'password': 'admin123'})
+        self.assertEqual(response.status_code, 200)
+        tokens = response.data
+
+        response = self.assertQueryBudget(0, self.client.post, reverse('jwt_token_refresh'),
+                                          data={'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        response = self.assertQueryBudget(0, self.client.post, reverse('jwt_token_verify'),
+                                          data={'token': tokens['access']})
+        self.assertEqual(response.status_code, 200)
+
+    def test_oauth2_token_api(self):
+        """
+        Tokens are stored, refreshing one revokes the previous tokens
+        """
+        self.user.set_password('admin123')
+        self.user.save()
+        self.client.logout()
+        application = Application.objects.create(name='test', user=self.user,
+                                                 client_type=Application.CLIENT_CONFIDENTIAL,
+                                                 authorization_grant_type=Application.GRANT_PASSWORD)
+        client = {'client_id': application.client_id, 'client_secret': application.client_secret}
+        response = self.assertQueryBudget(7, self.client.post, reverse('oauth2_provider:token'),
+                                          data=dict(client, grant_type='password', username="test_username",
+                                                    password='admin123'))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.assertQueryBudget(19, self.client.post, reverse('oauth2_provider:token'),
+                                          data=dict(client, grant_type='refresh_token',
+                                                    refresh_token=response.json()['refresh_token']))
+        self.assertEqual(response.status_code, 200)
+        response = self.assertQueryBudget(5, self.client.post, reverse('oauth2_provider:revoke-token'),
+                                          data=dict(client, token=response.json()['access_token']))
+        self.assertEqual(response.status_code, 200)
@@ -1,28 +1,98 @@
-from django.db import connection, reset_queries
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 import time
 import functools
+import logging
+
+logger = logging.getLogger('apps.monitoring')
+
+
+def count_queries(using=connection):
+    """
+    Context manager counting DB hits of the block, works with DEBUG=False too
+
+    with count_queries() as queries:
+        ...
+    len(queries)
+    """
+    return CaptureQueriesContext(using)
 
 
 def query_debugger(func):
     """
     Decorator used for query optimisation
-    Gives DB hits for a method
+    Logs DB hits, DB time and duplicate statements of a method,
+    it does not need DEBUG (see apps/monitoring/queries.py)
     """
 
     @functools.wraps(func)
     def inner_func(*args, **kwargs):
-        reset_queries()
+        from apps.monitoring.queries import record_queries
 
-        start_queries = len(connection.queries)
+        with record_queries() as queries:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            end = time.perf_counter()
 
-        start = time.perf_counter()
-        result = func(*args, **kwargs)
-        end = time.perf_counter()
-
-        end_queries = len(connection.queries)
-        print(f"Function : {func.__name__}")
-        print(f"Number of Queries : {end_queries - start_queries}")
-        print(f"Finished in : {(end - start):.2f}s")
+        logger.warning("%s: %d queries (%d duplicate) taking %.2fms, finished in %.2fs",
+                       func.__name__, queries.count, queries.duplicates, queries.duration * 1000, end - start)
         return result
 
-    return inner_func
\ No newline at end of file
+    return inner_func
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(max_queries):
+    """
+    Decorator failing a method if it makes more than max_queries DB hits
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def inner_func(*args, **kwargs):
+            with count_queries() as queries:
+                result = func(*args, **kwargs)
+            if len(queries) > max_queries:
+                raise QueryBudgetExceeded(
+                    "{} made {} queries, budget is {}:\n{}".format(
+                        func.__name__, len(queries), max_queries,
+                        "\n".join(query['sql'] for query in queries.captured_queries)))
+            return result
+
+        return inner_func
+
+    return decorator
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin asserting query budgets of endpoints
+    """
+
+    def assertQueryBudget(self, max_queries, func, *args, **kwargs):
+        """
+        func(*args, **kwargs) should not make more than max_queries DB hits
+        """
+        return query_budget(max_queries)(func)(*args, **kwargs)
+
+    def assertQueriesDoNotGrow(self, func, grow, max_queries=None):
+        """
+        func should make same number of DB hits before and after grow() adds more rows
+        to its result i.e. there is no N+1. Both the calls are within max_queries if given
+        """
+        func()  # warm up caches e.g. compiled tariffs
+        with count_queries() as before:
+            func()
+        grow()
+        func()
+        with count_queries() as after:
+            func()
+        self.assertEqual(
+            len(before), len(after),
+            "queries grew with the result from {} to {}:\n{}".format(
+                len(before), len(after), "\n".join(query['sql'] for query in after.captured_queries)))
+        if max_queries is not None:
+            self.assertLessEqual(len(after), max_queries)
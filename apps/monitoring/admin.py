@@ -0,0 +1,59 @@
+from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html
+
+from apps.monitoring.models import Profile, SlowQuery
+
+
+class SlowQueryAdmin(admin.ModelAdmin):
+    """
+    Read only, rows are captured by QueryMetricsMiddleware
+    """
+    list_display = ('created_at', 'duration_ms', 'view', 'site', 'short_sql')
+    list_filter = ('view', 'database')
+    search_fields = ['sql', 'view', 'path']
+    ordering = ('-created_at',)
+    fields = ('created_at', 'duration_ms', 'database', 'view', 'path', 'site', 'sql', 'params', 'plan')
+    readonly_fields = fields
+
+    def short_sql(self, obj):
+        return obj.sql[:100]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(SlowQuery, SlowQueryAdmin)
+
+
+class ProfileAdmin(admin.ModelAdmin):
+    """
+    Read only, rows are stored by ProfilingMiddleware
+    """
+    list_display = ('created_at', 'user', 'method', 'path', 'view', 'status', 'duration_ms')
+    list_filter = ('view',)
+    search_fields = ['path', 'view']
+    ordering = ('-created_at',)
+    fields = ('created_at', 'user', 'method', 'path', 'view', 'status', 'duration_ms', 'download', 'summary')
+    readonly_fields = fields
+
+    def get_queryset(self, request):
+        """
+        Statistics are only downloaded, user is fetched with the profiles
+        """
+        return super(ProfileAdmin, self).get_queryset(request).defer('stats').select_related('user')
+
+    def download(self, obj):
+        return format_html('<a href="{}">profile-{}.pstats</a>', reverse('profile', args=[obj.id]), obj.id)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(Profile, ProfileAdmin)
@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from apps.monitoring.models import SlowQuery
+
+FIELDS = ('id', 'created_at', 'duration_ms', 'database', 'view', 'path', 'site', 'sql', 'params', 'plan')
+
+
+class Command(BaseCommand):
+    help = 'Dumps captured slow queries with their plans, newest first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit',
+                            default=20,
+                            type=int,
+                            help='Number of queries to dump.')
+        parser.add_argument('--view',
+                            help="Only queries of this view e.g. 'BookViewSet.list'.")
+        parser.add_argument('--order',
+                            default='newest',
+                            choices=('newest', 'slowest'),
+                            help='Newest or slowest queries first.')
+        parser.add_argument('--json',
+                            action='store_true',
+                            help='One JSON object per line instead of text.')
+        parser.add_argument('--clear',
+                            action='store_true',
+                            help='Deletes the dumped queries afterwards.')
+
+    def handle(self, *args, **options):
+        if options['limit'] < 1:
+            raise CommandError("--limit should be positive")
+        queryset = SlowQuery.objects.order_by('-duration_ms' if options['order'] == 'slowest' else '-id')
+        if options['view']:
+            queryset = queryset.filter(view=options['view'])
+        slow_queries = list(queryset.values(*FIELDS)[:options['limit']])
+
+        for slow_query in slow_queries:
+            if options['json']:
+                self.stdout.write(json.dumps(slow_query, cls=DjangoJSONEncoder))
+                continue
+            self.stdout.write(self.style.WARNING(
+                "{created_at:%Y-%m-%d %H:%M:%S} {duration_ms:.1f}ms {view} {path} ({site})".format(**slow_query)))
+            self.stdout.write(slow_query['sql'])
+            if slow_query['params']:
+                self.stdout.write("params: {}".format(slow_query['params']))
+            if slow_query['plan']:
+                self.stdout.write(slow_query['plan'])
+            self.stdout.write('')
+
+        if options['clear'] and slow_queries:
+            SlowQuery.objects.filter(id__in=[slow_query['id'] for slow_query in slow_queries]).delete()
+            self.stderr.write("Deleted {} slow queries".format(len(slow_queries)))
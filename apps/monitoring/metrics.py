@@ -0,0 +1,92 @@
+"""
+Prometheus metrics of requests, recorded by QueryMetricsMiddleware and served at /metrics.
+
+With PROMETHEUS_MULTIPROC_DIR set in the environment (before this module is imported),
+prometheus_client keeps values in mmap files of that directory, one per process, and
+/metrics aggregates the files of all gunicorn workers. The directory has to be emptied
+when the server starts, see docker-entrypoint.sh and config/gunicorn.py.
+Recording a request is a few dict lookups and mmap writes, microseconds.
+"""
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY
+from prometheus_client.multiprocess import MultiProcessCollector
+
+UNRESOLVED = 'unresolved'
+# methods are sent by clients, others are labelled OTHER_METHOD to bound the label values
+METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+OTHER_METHOD = 'other'
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to answer a request, by URL name',
+    ['view', 'method'],
+    buckets=(.005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 10),
+)
+REQUESTS = Counter(
+    'http_requests', 'Answered requests, by URL name and status code',
+    ['view', 'method', 'status'],
+)
+DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries made to answer a request',
+    ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 20, 50, 100, 200),
+)
+DB_TIME = Histogram(
+    'http_request_db_duration_seconds', 'Time spent in database queries of a request',
+    ['view'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5),
+)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Size of response content, streamed responses are not measured',
+    ['view'],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+)
+AUTHENTICATIONS = Counter(
+    'http_request_authentications', 'API requests by the authentication class which authenticated them',
+    ['authenticator'],
+)
+
+
+# labelled children of the metrics, labels() validates and locks on every call
+_children = {}
+
+
+def children(view, method, status):
+    key = (view, method, status)
+    if key not in _children:
+        _children[key] = (REQUEST_LATENCY.labels(view, method), REQUESTS.labels(view, method, status),
+                          DB_QUERIES.labels(view), DB_TIME.labels(view), RESPONSE_SIZE.labels(view))
+    return _children[key]
+
+
+def observe_request(request, response, duration, queries):
+    """
+    Records a request answered in duration seconds, with its queries (queries.QueryRecorder)
+    """
+    resolver_match = getattr(request, 'resolver_match', None)
+    view = resolver_match.view_name if resolver_match else UNRESOLVED
+    method = request.method if request.method in METHODS else OTHER_METHOD
+    latency, requests, db_queries, db_time, response_size = children(view, method, response.status_code)
+    latency.observe(duration)
+    requests.inc()
+    db_queries.observe(queries.count)
+    db_time.observe(queries.duration)
+    if not response.streaming:
+        response_size.observe(len(response.content))
+
+    # rest framework's request, on its responses
+    api_request = getattr(response, 'renderer_context', {}).get('request')
+    if api_request is not None:
+        authenticator = getattr(api_request, '_authenticator', None)
+        AUTHENTICATIONS.labels(type(authenticator).__name__ if authenticator else 'anonymous').inc()
+
+
+def get_registry():
+    """
+    Registry of this process, or one collecting the files of all the processes in multiprocess mode
+    """
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry)
+    return registry
@@ -0,0 +1,115 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+
+from apps.monitoring import metrics, profiling, slow_queries
+from apps.monitoring.queries import record_queries
+
+logger = logging.getLogger('apps.monitoring')
+# SQL of repeated shapes is cut in logs
+MAX_SQL_LOGGED = 1000
+
+
+def view_name(request):
+    """
+    Class and action of the view which answered the request e.g. 'BookViewSet.list',
+    'UserBooksAPIView' or module and name of a function view
+    """
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return ''
+    func = resolver_match.func
+    view_class = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    if view_class is None:
+        return '{}.{}'.format(func.__module__, func.__name__)
+    # viewsets map http methods to actions
+    action = (getattr(func, 'actions', None) or {}).get(request.method.lower())
+    return '{}.{}'.format(view_class.__name__, action) if action else view_class.__name__
+
+
+def server_timing(queries, duration):
+    """
+    Server-Timing header value of a request, shown by browser dev tools next to network timings
+    """
+    return 'db;desc="{} queries, {} duplicate";dur={:.2f}, app;dur={:.2f}'.format(
+        queries.count, queries.duplicates, queries.duration * 1000, duration * 1000)
+
+
+class QueryMetricsMiddleware:
+    """
+    Records query count, DB time and duplicate statements of every request with
+    an execute_wrapper (see queries.py) and sends them in a Server-Timing header
+    when SERVER_TIMING_HEADER is set and as a JSON log line on apps.monitoring logger. Requests repeating a statement
+    shape QUERY_N_PLUS_ONE_THRESHOLD times or more are logged as warnings.
+
+    Statements slower than SLOW_QUERY_MS are EXPLAINed and stored, see slow_queries.py.
+    Latency, queries and response size go to Prometheus metrics, see metrics.py.
+
+    Should be the first middleware, to count queries of the others.
+    Queries of streamed content, made after the response is returned, are not counted
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.n_plus_one_threshold = getattr(settings, 'QUERY_N_PLUS_ONE_THRESHOLD', 5)
+        self.server_timing = getattr(settings, 'SERVER_TIMING_HEADER', False)
+        self.slow_threshold = slow_queries.slow_threshold()
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with record_queries(slow_threshold=self.slow_threshold) as queries:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+        metrics.observe_request(request, response, duration, queries)
+        if queries.slow:
+            slow_queries.capture(queries.slow, view_name(request), request.path)
+
+        if self.server_timing:
+            timing = server_timing(queries, duration)
+            response['Server-Timing'] = '{}, {}'.format(response['Server-Timing'], timing) \
+                if response.has_header('Server-Timing') else timing
+
+        n_plus_one = queries.repeated_shapes(self.n_plus_one_threshold)
+        level = logging.WARNING if n_plus_one else logging.INFO
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': view_name(request),
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'queries': queries.count,
+                'db_ms': round(queries.duration * 1000, 2),
+                'duplicates': queries.duplicates,
+                'n_plus_one': [{'sql': shape[:MAX_SQL_LOGGED], 'count': count} for shape, count in n_plus_one],
+            }))
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Runs requests of staff asking for it (X-Profile header or _profile query parameter)
+    under cProfile and stores the statistics, their id is sent in X-Profile-Id (see profiling.py).
+
+    Should be the last middleware, after AuthenticationMiddleware, so that mostly the view is profiled.
+    Content of streamed responses is made after the profile ends
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.profile_requested(request):
+            return self.get_response(request)
+        user = profiling.staff_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        response, profile = profiling.run_profiled(self.get_response, request)
+        profile.user = user
+        profile.view = view_name(request)[:255]
+        profiling.store(profile)
+        response['X-Profile-Id'] = str(profile.id)
+        return response
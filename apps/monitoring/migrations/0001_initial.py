@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Time at which query was captured')),
+                ('view', models.CharField(blank=True, help_text="View which ran the query e.g. 'BookViewSet.list'", max_length=255)),
+                ('path', models.CharField(blank=True, help_text='Path of the request', max_length=255)),
+                ('site', models.CharField(blank=True, help_text='Innermost project line which ran the query', max_length=255)),
+                ('database', models.CharField(help_text='Database alias the query ran on', max_length=100)),
+                ('sql', models.TextField(help_text='SQL with placeholders')),
+                ('params', models.TextField(blank=True, help_text='Parameters of the SQL as JSON')),
+                ('duration_ms', models.FloatField(help_text='Time the query took')),
+                ('plan', models.TextField(blank=True, help_text='Output of EXPLAIN, or why it could not be run')),
+            ],
+            options={
+                'verbose_name_plural': 'Slow queries',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('monitoring', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Time at which request was profiled')),
+                ('method', models.CharField(help_text='HTTP method of the request', max_length=10)),
+                ('path', models.CharField(help_text='Path of the request', max_length=255)),
+                ('view', models.CharField(blank=True, help_text="View which answered the request e.g. 'UserBooksAPIView'", max_length=255)),
+                ('status', models.IntegerField(help_text='Status code of the response')),
+                ('duration_ms', models.FloatField(help_text='Time the request took under the profiler')),
+                ('stats', models.BinaryField(help_text='Statistics in pstats (marshal) format')),
+                ('summary', models.TextField(help_text='Functions taking most cumulative time, as printed by pstats')),
+                ('user', models.ForeignKey(help_text='Staff user who asked for the profile', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,77 @@
+from django.db import models
+
+
+class SlowQuery(models.Model):
+    """
+    A statement which took longer than settings.SLOW_QUERY_MS in a request,
+    with its query plan. Only the newest SLOW_QUERY_LOG_SIZE are kept, see slow_queries.py
+    """
+    created_at = models.DateTimeField(auto_now_add=True,
+                                      help_text='Time at which query was captured')
+
+    view = models.CharField(max_length=255,
+                            blank=True,
+                            help_text="View which ran the query e.g. 'BookViewSet.list'")
+
+    path = models.CharField(max_length=255,
+                            blank=True,
+                            help_text='Path of the request')
+
+    site = models.CharField(max_length=255,
+                            blank=True,
+                            help_text='Innermost project line which ran the query')
+
+    database = models.CharField(max_length=100,
+                                help_text='Database alias the query ran on')
+
+    sql = models.TextField(help_text='SQL with placeholders')
+
+    params = models.TextField(blank=True,
+                              help_text='Parameters of the SQL as JSON')
+
+    duration_ms = models.FloatField(help_text='Time the query took')
+
+    plan = models.TextField(blank=True,
+                            help_text='Output of EXPLAIN, or why it could not be run')
+
+    def __str__(self):
+        return "{:.0f}ms in {}".format(self.duration_ms, self.view or self.path)
+
+    class Meta:
+        verbose_name_plural = "Slow queries"
+
+
+class Profile(models.Model):
+    """
+    cProfile statistics of a request a staff user asked to profile, see ProfilingMiddleware.
+    Only the newest PROFILE_LOG_SIZE are kept
+    """
+    created_at = models.DateTimeField(auto_now_add=True,
+                                      help_text='Time at which request was profiled')
+
+    user = models.ForeignKey('auth.User',
+                             null=True,
+                             related_name='+',
+                             on_delete=models.SET_NULL,
+                             help_text='Staff user who asked for the profile')
+
+    method = models.CharField(max_length=10,
+                              help_text='HTTP method of the request')
+
+    path = models.CharField(max_length=255,
+                            help_text='Path of the request')
+
+    view = models.CharField(max_length=255,
+                            blank=True,
+                            help_text="View which answered the request e.g. 'UserBooksAPIView'")
+
+    status = models.IntegerField(help_text='Status code of the response')
+
+    duration_ms = models.FloatField(help_text='Time the request took under the profiler')
+
+    stats = models.BinaryField(help_text='Statistics in pstats (marshal) format')
+
+    summary = models.TextField(help_text='Functions taking most cumulative time, as printed by pstats')
+
+    def __str__(self):
+        return "{} {} ({:.0f}ms)".format(self.method, self.path, self.duration_ms)
@@ -0,0 +1,75 @@
+"""
+On demand profiling of requests: staff requests sending an X-Profile header or a
+_profile query parameter are run under cProfile and the statistics are stored as
+Profile rows (the newest PROFILE_LOG_SIZE are kept). The response tells the id
+of the profile in X-Profile-Id, see ProfileAPIView to fetch it.
+
+Other requests only pay for a lookup of the header and the query string.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import time
+
+from django.conf import settings
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from apps.monitoring.models import Profile
+
+SUMMARY_LINES = 50
+
+
+def profile_requested(request):
+    return 'HTTP_X_PROFILE' in request.META or (
+        '_profile' in request.META.get('QUERY_STRING', '') and '_profile' in request.GET)
+
+
+def staff_user(request):
+    """
+    The user of the request if it is staff, authenticated by session or by one
+    of rest framework's authentication classes (JWT, token, OAuth2)
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user if user.is_staff else None
+    api_request = Request(request)
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            user_auth = authentication_class().authenticate(api_request)
+        except APIException:
+            return None
+        if user_auth is not None:
+            return user_auth[0] if user_auth[0].is_staff else None
+    return None
+
+
+def run_profiled(get_response, request):
+    """
+    Returns (response, Profile) of get_response(request) run under cProfile
+    """
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    response = profiler.runcall(get_response, request)
+    duration = time.perf_counter() - start
+    profiler.create_stats()
+    # before pstats.Stats, which empties statistics of the profiler
+    stats = marshal.dumps(profiler.stats)
+
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    return response, Profile(method=request.method, path=request.path[:255], status=response.status_code,
+                             duration_ms=round(duration * 1000, 3), stats=stats, summary=summary.getvalue())
+
+
+def store(profile):
+    """
+    Saves a profile, dropping the ones beyond PROFILE_LOG_SIZE
+    """
+    profile.save()
+    size = getattr(settings, 'PROFILE_LOG_SIZE', 100)
+    oldest_kept = Profile.objects.order_by('-id').values_list('id', flat=True)[size - 1:size]
+    if oldest_kept:
+        Profile.objects.filter(id__lt=oldest_kept[0]).delete()
@@ -0,0 +1,116 @@
+"""
+Query recording built on connection.execute_wrapper, so it works with DEBUG off
+and keeps no query log (connection.queries is only filled with DEBUG on and holds
+up to 9000 statements per connection).
+
+QueryRecorder counts statements and their time, exact duplicates (same SQL and
+parameters) and statement shapes, the SQL without parameters with IN lists of
+any length folded together. A shape repeated many times in one request is the
+N+1 pattern, a query per row of an earlier result. At most MAX_TRACKED distinct
+statements and shapes are kept per recorder, so its memory is bounded.
+
+Given a slow_threshold, statements taking longer are kept too, with the project
+line which ran them (up to MAX_SLOW), see slow_queries.py
+"""
+import os
+import re
+import time
+import traceback
+from collections import Counter, namedtuple
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+MAX_TRACKED = 200
+MAX_SLOW = 10
+# IN (%s, %s, %s) is the same shape as IN (%s)
+PLACEHOLDER_LIST = re.compile(r'\(%s(?:, %s)+\)')
+MONITORING_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SlowStatement = namedtuple('SlowStatement', 'database sql params many duration site')
+
+
+def call_site():
+    """
+    'path:line in function' of the innermost frame in project code, outside this app
+    """
+    for frame in reversed(traceback.extract_stack()):
+        filename = frame.filename
+        if filename.startswith(settings.BASE_DIR) and not filename.startswith(MONITORING_DIR) \
+                and 'site-packages' not in filename:
+            return '{}:{} in {}'.format(os.path.relpath(filename, settings.BASE_DIR), frame.lineno, frame.name)
+    return ''
+
+
+class QueryRecorder:
+    """
+    execute_wrapper recording count, time, duplicates and shapes of the statements
+    """
+
+    def __init__(self, slow_threshold=None):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.shapes = Counter()
+        # seconds
+        self.slow_threshold = slow_threshold
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.duration += duration
+            self.count += 1
+            self.add(sql, params, many)
+            if self.slow_threshold is not None and duration >= self.slow_threshold and len(self.slow) < MAX_SLOW:
+                self.slow.append(SlowStatement(context['connection'].alias, sql, params, many, duration,
+                                               call_site()))
+
+    def add(self, sql, params, many):
+        shape = PLACEHOLDER_LIST.sub('(%s)', sql) if '%s, %s' in sql else sql
+        if shape in self.shapes or len(self.shapes) < MAX_TRACKED:
+            self.shapes[shape] += 1
+        if many:
+            return
+        try:
+            statement = (sql, tuple(params or ()))
+            hash(statement)
+        except TypeError:
+            # e.g. list parameters of array fields
+            return
+        if statement in self.statements or len(self.statements) < MAX_TRACKED:
+            self.statements[statement] += 1
+
+    @property
+    def duplicates(self):
+        """
+        Number of statements which ran before in the same SQL and parameters
+        """
+        return sum(count - 1 for count in self.statements.values())
+
+    def repeated_shapes(self, threshold):
+        """
+        [(shape, count)] of shapes run at least threshold times, most repeated first
+        """
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+@contextmanager
+def record_queries(using=None, slow_threshold=None):
+    """
+    Records queries of the block on given database, or on all of them,
+    keeping statements slower than slow_threshold seconds
+
+    with record_queries() as queries:
+        ...
+    queries.count, queries.duration
+    """
+    recorder = QueryRecorder(slow_threshold)
+    with ExitStack() as stack:
+        for connection in [connections[using]] if using else connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
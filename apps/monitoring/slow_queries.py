@@ -0,0 +1,134 @@
+"""
+Slow query log: statements of a request slower than settings.SLOW_QUERY_MS are
+EXPLAINed and stored as SlowQuery rows, with the view and project line which ran
+them. The table is a ring buffer of the newest SLOW_QUERY_LOG_SIZE rows.
+
+Parameters may hold password hashes, tokens or emails, they are stored only when
+settings.SLOW_QUERY_PARAMS is set. Capture runs in the request, a process captures
+the slow statements of at most SLOW_QUERY_CAPTURES_PER_MINUTE requests a minute.
+
+EXPLAIN (EXPLAIN QUERY PLAN on SQLite) runs on a side connection of its own,
+outside the transaction of the request, which may be broken, and outside the
+query recording. It sees committed schema and data only.
+"""
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections
+from django.db.utils import load_backend
+
+logger = logging.getLogger('apps.monitoring')
+# statements whose plan EXPLAIN shows without running them
+EXPLAINED = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+MAX_PARAMS_LENGTH = 10000
+
+
+def slow_threshold():
+    """
+    settings.SLOW_QUERY_MS in seconds, None when capture is off
+    """
+    slow_query_ms = getattr(settings, 'SLOW_QUERY_MS', None)
+    return slow_query_ms / 1000 if slow_query_ms and slow_query_ms > 0 else None
+
+
+def side_connection(alias):
+    """
+    New connection to the database of alias, it has to be closed
+    """
+    settings_dict = connections.databases[alias]
+    return load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, alias)
+
+
+def explain(connection, sql, params):
+    """
+    Query plan of a statement as text, one line per row of EXPLAIN output
+    """
+    if not sql.lstrip().upper().startswith(EXPLAINED):
+        return ''
+    with connection.cursor() as cursor:
+        cursor.execute('{} {}'.format(connection.ops.explain_query_prefix(), sql), params)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+
+class RateLimit:
+    """
+    Counts captures of the current minute in this process
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = None
+        self.count = 0
+
+    def allow(self, limit):
+        """
+        True when less than limit were allowed this minute, limit 0 is no limit
+        """
+        if not limit:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            if self.start is None or now - self.start >= 60:
+                self.start, self.count = now, 0
+            if self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+
+_rate_limit = RateLimit()
+
+
+def dump_params(params):
+    if not getattr(settings, 'SLOW_QUERY_PARAMS', False):
+        return ''
+    try:
+        dumped = json.dumps(list(params or ()), cls=DjangoJSONEncoder)
+    except TypeError:
+        dumped = repr(params)
+    return dumped[:MAX_PARAMS_LENGTH]
+
+
+def capture(statements, view='', path=''):
+    """
+    Stores slow statements (queries.SlowStatement) of a request with their plans,
+    then drops rows beyond SLOW_QUERY_LOG_SIZE. Errors are logged, never raised.
+    Nothing is stored beyond SLOW_QUERY_CAPTURES_PER_MINUTE calls a minute
+    """
+    from apps.monitoring.models import SlowQuery
+
+    if not _rate_limit.allow(getattr(settings, 'SLOW_QUERY_CAPTURES_PER_MINUTE', 10)):
+        logger.debug("Slow queries of %s not captured, over SLOW_QUERY_CAPTURES_PER_MINUTE", view or path)
+        return
+
+    side_connections = {}
+    entries = []
+    try:
+        for statement in statements:
+            if statement.database not in side_connections:
+                side_connections[statement.database] = side_connection(statement.database)
+            try:
+                plan = '' if statement.many else explain(side_connections[statement.database], statement.sql,
+                                                          statement.params)
+            except DatabaseError as error:
+                plan = 'EXPLAIN failed: {}'.format(error)
+            entries.append(SlowQuery(view=view[:255], path=path[:255], site=statement.site[:255],
+                                     database=statement.database, sql=statement.sql,
+                                     params=dump_params(statement.params),
+                                     duration_ms=round(statement.duration * 1000, 3), plan=plan))
+    finally:
+        for connection in side_connections.values():
+            connection.close()
+
+    try:
+        SlowQuery.objects.bulk_create(entries)
+        size = getattr(settings, 'SLOW_QUERY_LOG_SIZE', 1000)
+        oldest_kept = SlowQuery.objects.order_by('-id').values_list('id', flat=True)[size - 1:size]
+        if oldest_kept:
+            SlowQuery.objects.filter(id__lt=oldest_kept[0]).delete()
+    except DatabaseError:
+        logger.exception("Slow queries of %s could not be stored", view or path)
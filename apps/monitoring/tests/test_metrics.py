@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from apps.book_rental.tests.factories import BookFactory, UserFactory
+from apps.monitoring.metrics import get_registry
+
+
+class TestMetrics(TestCase):
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_metrics(self):
+        client = APIClient()
+        client.force_authenticate(UserFactory())
+        BookFactory.create_batch(2)
+        requests = self.sample('http_requests_total', view='books-list', method='GET', status='200')
+        authentications = self.sample('http_request_authentications_total', authenticator='ForcedAuthentication')
+
+        self.assertEqual(client.get(reverse('books-list')).status_code, 200)
+        self.assertEqual(self.sample('http_requests_total', view='books-list', method='GET', status='200'),
+                         requests + 1)
+        self.assertEqual(self.sample('http_request_authentications_total', authenticator='ForcedAuthentication'),
+                         authentications + 1)
+
+        response = client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        content = response.content.decode()
+        for metric in ('http_request_duration_seconds_bucket', 'http_request_db_queries_sum',
+                       'http_request_db_duration_seconds_count', 'http_response_size_bytes_sum'):
+            self.assertIn('{}{{'.format(metric), content)
+        self.assertIn('view="books-list"', content)
+
+    def test_unresolved(self):
+        requests = self.sample('http_requests_total', view='unresolved', method='GET', status='404')
+        self.client.get('/no-such-page/')
+        self.assertEqual(self.sample('http_requests_total', view='unresolved', method='GET', status='404'),
+                         requests + 1)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_no_token(self):
+        """
+        Without a token only the host itself is answered
+        """
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5').status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='::1').status_code, 200)
+
+    def test_other_method(self):
+        """
+        Methods made up by clients share one label value
+        """
+        requests = self.sample('http_requests_total', view='unresolved', method='other', status='404')
+        self.client.generic('FOO', '/no-such-page/')
+        self.client.generic('BAR', '/no-such-page/')
+        self.assertEqual(self.sample('http_requests_total', view='unresolved', method='other', status='404'),
+                         requests + 2)
+        self.assertIsNone(REGISTRY.get_sample_value('http_requests_total',
+                                                    {'view': 'unresolved', 'method': 'FOO', 'status': '404'}))
+
+    def test_multiprocess(self):
+        """
+        Values of worker processes are aggregated through files of PROMETHEUS_MULTIPROC_DIR
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', 'from apps.monitoring.metrics import REQUESTS; '
+                                                      'REQUESTS.labels("books-list", "GET", 200).inc()'],
+                               cwd=settings.BASE_DIR, env=env, check=True)
+            with mock.patch.dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory):
+                registry = get_registry()
+            self.assertEqual(registry.get_sample_value(
+                'http_requests_total', {'view': 'books-list', 'method': 'GET', 'status': '200'}), 2)
@@ -0,0 +1,71 @@
+import json
+
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from apps.book_rental.models import Book
+from apps.book_rental.tests.factories import BookFactory, UserFactory
+from apps.mixin.tools import count_queries
+from apps.monitoring.middleware import QueryMetricsMiddleware
+from apps.monitoring.queries import record_queries
+
+
+class TestQueryRecorder(TestCase):
+
+    def test_shapes(self):
+        """
+        IN lists of any length are one shape, same SQL and parameters again is a duplicate
+        """
+        books = BookFactory.create_batch(3)
+        with record_queries() as queries:
+            list(Book.objects.filter(id__in=[books[0].id, books[1].id]))
+            list(Book.objects.filter(id__in=[book.id for book in books]))
+            Book.objects.get(id=books[0].id)
+            Book.objects.get(id=books[0].id)
+        self.assertEqual(queries.count, 4)
+        self.assertGreater(queries.duration, 0)
+        self.assertEqual(queries.duplicates, 1)
+        shapes = dict(queries.repeated_shapes(2))
+        self.assertEqual(sorted(shapes.values()), [2, 2])
+        self.assertTrue(any(shape.endswith('IN (%s)') for shape in shapes))
+
+
+@override_settings(DEBUG=False, SERVER_TIMING_HEADER=True)
+class TestQueryMetricsMiddleware(TestCase):
+
+    def test_server_timing(self):
+        user = UserFactory()
+        BookFactory.create_batch(3)
+        client = APIClient()
+        client.force_authenticate(user)
+        with count_queries() as queries:
+            response = client.get(reverse('books-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;desc="{} queries, 0 duplicate";dur=[0-9.]+, app;dur=[0-9.]+$'.format(len(queries)))
+
+    def test_n_plus_one(self):
+        """
+        A query per book is logged as a warning with the repeated statement
+        """
+        books = BookFactory.create_batch(6)
+
+        def view(request):
+            for book in books:
+                Book.objects.get(id=book.id)
+            return HttpResponse()
+
+        with self.assertLogs('apps.monitoring', 'WARNING') as logs:
+            response = QueryMetricsMiddleware(view)(RequestFactory().get('/books/'))
+        self.assertIn('db;desc="6 queries, 0 duplicate"', response['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['path'], record['queries'], record['duplicates']), ('/books/', 6, 0))
+        self.assertEqual(record['n_plus_one'][0]['count'], 6)
+        self.assertIn('FROM "book_rental_book"', record['n_plus_one'][0]['sql'])
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_no_header(self):
+        response = QueryMetricsMiddleware(lambda request: HttpResponse())(RequestFactory().get('/'))
+        self.assertFalse(response.has_header('Server-Timing'))
@@ -0,0 +1,73 @@
+import marshal
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from apps.book_rental.tests.factories import BookFactory, UserFactory
+from apps.monitoring.models import Profile
+
+
+class TestProfiling(TestCase):
+
+    def setUp(self):
+        self.staff = UserFactory(is_staff=True)
+        self.user = UserFactory()
+        BookFactory.create_batch(3)
+        self.client = APIClient()
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(Token.objects.create(user=user).key))
+
+    def test_profile(self):
+        """
+        Staff requests asking for it are profiled, the profile is fetched by id
+        """
+        self.authenticate(self.staff)
+        response = self.client.get(reverse('books-list'), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        profile = Profile.objects.get(id=response['X-Profile-Id'])
+        self.assertEqual((profile.user, profile.view, profile.status, profile.path),
+                         (self.staff, 'BookViewSet.list', 200, reverse('books-list')))
+        self.assertIn('cumulative', profile.summary)
+
+        response = self.client.get(reverse('profile', kwargs={'profile_id': profile.id}))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="profile-{}.pstats"'.format(
+            profile.id))
+        stats = marshal.loads(response.content)
+        self.assertTrue(any(filename.endswith('pagination.py') for filename, _, _ in stats))
+
+        response = self.client.get(reverse('profile', kwargs={'profile_id': profile.id}), {'summary': 1})
+        self.assertIn('pagination.py', response.content.decode())
+
+    def test_query_flag(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('user-books', kwargs={'user_id': self.user.id}), {'_profile': 1})
+        self.assertEqual(Profile.objects.get(id=response['X-Profile-Id']).view, 'UserBooksAPIView')
+
+    def test_not_staff(self):
+        """
+        Requests of other users run as usual and can not fetch profiles
+        """
+        self.authenticate(self.user)
+        response = self.client.get(reverse('books-list'), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('X-Profile-Id'))
+        self.assertFalse(Profile.objects.exists())
+
+        self.client.credentials()
+        self.assertEqual(self.client.get(reverse('books-list'), HTTP_X_PROFILE='1').status_code, 401)
+        self.assertFalse(Profile.objects.exists())
+
+        self.authenticate(self.staff)
+        profile_id = self.client.get(reverse('books-list'), HTTP_X_PROFILE='1')['X-Profile-Id']
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(self.user.auth_token.key))
+        self.assertEqual(self.client.get(reverse('profile', kwargs={'profile_id': profile_id})).status_code, 403)
+
+    @override_settings(PROFILE_LOG_SIZE=2)
+    def test_ring_buffer(self):
+        self.authenticate(self.staff)
+        ids = [int(self.client.get(reverse('books-list'), HTTP_X_PROFILE='1')['X-Profile-Id']) for _ in range(3)]
+        self.assertEqual(list(Profile.objects.order_by('id').values_list('id', flat=True)), ids[1:])
+        self.assertEqual(self.client.get(reverse('profile', kwargs={'profile_id': ids[0]})).status_code, 404)
@@ -0,0 +1,90 @@
+import json
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from apps.book_rental.tests.factories import BookFactory, UserFactory
+from apps.monitoring.models import SlowQuery
+from apps.monitoring.queries import SlowStatement
+from apps.monitoring.slow_queries import RateLimit, capture
+
+
+# every query is slow
+@override_settings(DEBUG=False, SLOW_QUERY_MS=0.000001, SLOW_QUERY_CAPTURES_PER_MINUTE=0)
+class TestSlowQueries(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        BookFactory.create_batch(3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(SLOW_QUERY_PARAMS=True)
+    def test_capture(self):
+        """
+        Slow queries are stored with the view, project line and plan
+        """
+        response = self.client.get(reverse('books-list'))
+        self.assertEqual(response.status_code, 200)
+        slow_query = SlowQuery.objects.filter(view='BookViewSet.list', sql__contains='FROM "book_rental_book"').first()
+        self.assertEqual((slow_query.path, slow_query.database), (reverse('books-list'), 'default'))
+        self.assertTrue(slow_query.site.startswith('apps/'), slow_query.site)
+        # EXPLAIN QUERY PLAN of SQLite
+        self.assertIn('book_rental_book', slow_query.plan)
+        self.assertIsInstance(json.loads(slow_query.params), list)
+
+        self.client.get(reverse('user-books', kwargs={'user_id': self.user.id}))
+        self.assertTrue(SlowQuery.objects.filter(view='UserBooksAPIView').exists())
+
+    def test_params_not_stored(self):
+        """
+        Parameters e.g. the password hash of a login are not stored by default
+        """
+        with self.settings(SLOW_QUERY_PARAMS=False):
+            capture([SlowStatement('default', 'SELECT %s', ['secret'], False, 1.5, '')], view='test')
+        self.assertEqual(SlowQuery.objects.get(view='test').params, '')
+
+    @override_settings(SLOW_QUERY_CAPTURES_PER_MINUTE=2)
+    def test_rate_limit(self):
+        with patch('apps.monitoring.slow_queries._rate_limit', RateLimit()), \
+                patch('apps.monitoring.slow_queries.time.monotonic', return_value=1000):
+            for _ in range(3):
+                capture([SlowStatement('default', 'SELECT 1', [], False, 1.5, '')], view='test')
+            self.assertEqual(SlowQuery.objects.filter(view='test').count(), 2)
+            with patch('apps.monitoring.slow_queries.time.monotonic', return_value=1060):
+                capture([SlowStatement('default', 'SELECT 1', [], False, 1.5, '')], view='test')
+        self.assertEqual(SlowQuery.objects.filter(view='test').count(), 3)
+
+    @override_settings(SLOW_QUERY_LOG_SIZE=3)
+    def test_ring_buffer(self):
+        for _ in range(3):
+            self.client.get(reverse('books-list'))
+        self.assertEqual(SlowQuery.objects.count(), 3)
+        newest = SlowQuery.objects.latest('id')
+        self.client.get(reverse('books-list'))
+        self.assertEqual(SlowQuery.objects.count(), 3)
+        self.assertTrue(SlowQuery.objects.filter(id__gt=newest.id).exists())
+
+    def test_explain_failure(self):
+        capture([SlowStatement('default', 'SELECT * FROM missing_table', [], False, 1.5, '')], view='test')
+        slow_query = SlowQuery.objects.get(view='test')
+        self.assertTrue(slow_query.plan.startswith('EXPLAIN failed'))
+        self.assertEqual(slow_query.duration_ms, 1500)
+
+    def test_command(self):
+        self.client.get(reverse('books-list'))
+        count = SlowQuery.objects.count()
+        out = StringIO()
+        call_command('slow_queries', view='BookViewSet.list', limit=100, stdout=out)
+        self.assertIn('BookViewSet.list', out.getvalue())
+        self.assertIn('FROM "book_rental_book"', out.getvalue())
+
+        out = StringIO()
+        call_command('slow_queries', json=True, limit=1, clear=True, stdout=out, stderr=StringIO())
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+        self.assertIn('sql', json.loads(out.getvalue()))
+        self.assertEqual(SlowQuery.objects.count(), count - 1)
@@ -0,0 +1,7 @@
+from django.conf.urls import url
+
+from apps.monitoring.views import ProfileAPIView
+
+urlpatterns = [
+    url(r'^profiles/(?P<profile_id>[0-9]+)/$', ProfileAPIView.as_view(), name='profile'),
+]
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from apps.monitoring.metrics import get_registry
+from apps.monitoring.models import Profile
+
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def metrics(request):
+    """
+    Metrics in Prometheus text format. When settings.METRICS_TOKEN is set,
+    scrapers have to send it as 'Authorization: Bearer <token>', otherwise
+    only requests from the host itself are answered
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+            return HttpResponseForbidden()
+    elif request.META.get('REMOTE_ADDR') not in LOCAL_ADDRESSES:
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+class ProfileAPIView(APIView):
+    """
+    Admin only. Gives a stored request profile (see ProfilingMiddleware) as a pstats file,
+    e.g. for snakeviz or python -m pstats, or with ?summary=1 the functions
+    taking most cumulative time
+    """
+    permission_classes = (IsAdminUser,)
+    authentication_classes = (JWTAuthentication,
+                              OAuth2Authentication,
+                              SessionAuthentication,
+                              TokenAuthentication)
+
+    def get(self, request, profile_id):
+        try:
+            profile = Profile.objects.get(id=profile_id)
+        except Profile.DoesNotExist:
+            raise NotFound(detail="Profile not found")
+
+        if request.query_params.get('summary'):
+            return HttpResponse(profile.summary, content_type='text/plain; charset=utf-8')
+        response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename="profile-{}.pstats"'.format(profile.id)
+        return response
@@ -0,0 +1,43 @@
+"""
+Stand alone benchmarks, run them from project root e.g.
+
+    python -m benchmarks.tariffs
+
+Benchmarks needing the database run against a throwaway test database,
+the database configured in settings is never touched.
+"""
+import os
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """
+    Creates the test database of settings (TEST NAME, a file for SQLite) for the duration of the block
+    """
+    setup_django()
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile e.g. percentile(latencies, 99)
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
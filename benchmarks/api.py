@@ -0,0 +1,283 @@
+"""
+API benchmark suite: seeds a data set (seed --scale) and drives /api/books/, /api/user-books/<id>/
+and the JWT endpoints in process through Django's test client and over HTTP against gunicorn.
+Records p50/p95/p99 latency, requests per second, queries per request and peak memory as JSON,
+and exits with 1 when a metric regressed from the baseline beyond --threshold percent.
+
+    python -m benchmarks.api --scale 0.1 --output results.json --save-baseline baseline.json
+    python -m benchmarks.api --scale 0.1 --output results.json --baseline baseline.json --threshold 10
+
+In process, peak memory is the peak of Python allocations (tracemalloc) while serving --memory-requests
+requests of the endpoint, in a pass of their own as tracemalloc slows requests down. For gunicorn it is
+the peak RSS of its largest worker so far (read from /proc, Linux only).
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+from benchmarks import percentile, test_database
+
+SERVERS = ('in-process', 'gunicorn')
+CASES = ('books', 'user-books', 'jwt-token', 'jwt-refresh', 'jwt-verify')
+# metrics for which a higher value is a regression, the rest (rps) regress going lower
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request', 'peak_alloc_mb', 'peak_rss_mb')
+METRICS = LOWER_IS_BETTER + ('rps',)
+
+
+def summarize(latencies, elapsed, queries):
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+    }
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Returns (server, case, metric, baseline value, value) of metrics worse than the baseline
+    by more than threshold percent. Query counts do not vary between runs, any increase is a regression
+    """
+    regressions = []
+    for server, cases in sorted(results.items()):
+        for case, metrics in sorted(cases.items()):
+            base = baseline.get(server, {}).get(case, {})
+            for metric in METRICS:
+                old, new = base.get(metric), metrics.get(metric)
+                if old is None or new is None:
+                    continue
+                if metric == 'queries_per_request':
+                    worse = new > old
+                elif metric in LOWER_IS_BETTER:
+                    worse = new > old * (1 + threshold / 100)
+                else:
+                    worse = new < old * (1 - threshold / 100)
+                if worse:
+                    regressions.append((server, case, metric, old, new))
+    return regressions
+
+
+def build_cases(admin_password):
+    """
+    (name, method, path, body, headers) of the benchmarked requests, with tokens of the admin
+    """
+    from django.db.models import Count
+    from django.test import Client
+    from django.urls import reverse
+
+    from apps.book_rental.models import RentedBook
+
+    credentials = {'username': 'admin', 'password': admin_password}
+    tokens = Client().post(reverse('jwt_token_obtain_pair'), credentials).json()
+    auth = {'Authorization': 'Bearer {}'.format(tokens['access'])}
+    # the reader with the longest history
+    user_id = RentedBook.objects.values('user_id').annotate(rentals=Count('id')).order_by(
+        '-rentals', 'user_id').values_list('user_id', flat=True)[0]
+    return [
+        ('books', 'GET', reverse('books-list'), None, auth),
+        ('user-books', 'GET', reverse('user-books', kwargs={'user_id': user_id}), None, auth),
+        ('jwt-token', 'POST', reverse('jwt_token_obtain_pair'), credentials, {}),
+        ('jwt-refresh', 'POST', reverse('jwt_token_refresh'), {'refresh': tokens['refresh']}, {}),
+        ('jwt-verify', 'POST', reverse('jwt_token_verify'), {'token': tokens['access']}, {}),
+    ]
+
+
+def run_in_process(connection, cases, requests, warmup, memory_requests):
+    from django.test import Client
+
+    client = Client()
+
+    def send(method, path, body, headers):
+        extra = {'HTTP_' + name.upper().replace('-', '_'): value for name, value in headers.items()}
+        if method == 'GET':
+            return client.get(path, **extra)
+        return client.post(path, json.dumps(body), content_type='application/json', **extra)
+
+    results = {}
+    for name, method, path, body, headers in cases:
+        for _ in range(warmup):
+            send(method, path, body, headers)
+        latencies = []
+        queries = []
+        statements = []
+
+        def count_statements(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_statements):
+            start = time.perf_counter()
+            for _ in range(requests):
+                sent = time.perf_counter()
+                response = send(method, path, body, headers)
+                latencies.append((time.perf_counter() - sent) * 1000)
+                assert response.status_code == 200, (name, response.status_code)
+                queries.append(len(statements))
+                statements.clear()
+            elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        try:
+            for _ in range(memory_requests):
+                send(method, path, body, headers)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        results[name] = dict(summarize(latencies, elapsed, queries), peak_alloc_mb=round(peak / (1024 * 1024), 1))
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def workers_peak_rss_mb(pid):
+    """
+    Largest peak RSS (VmHWM) of the workers of a gunicorn master, None without /proc
+    """
+    peaks = []
+    try:
+        with open('/proc/{0}/task/{0}/children'.format(pid)) as children:
+            for child in children.read().split():
+                with open('/proc/{}/status'.format(child)) as status:
+                    peaks.extend(int(line.split()[1]) / 1024 for line in status if line.startswith('VmHWM:'))
+    except OSError:
+        return None
+    return round(max(peaks), 1) if peaks else None
+
+
+def run_gunicorn(connection, cases, requests, warmup, workers, concurrency):
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        sys.exit("gunicorn needs a test database on disk, set TEST NAME of the SQLite database")
+    port = free_port()
+    base_url = 'http://127.0.0.1:{}'.format(port)
+    # production like, without DEBUG collecting every query
+    env = dict(os.environ, BENCH_DATABASE_NAME=connection.settings_dict['NAME'], DEBUG='')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'benchmarks.wsgi:application',
+                               '--bind', '127.0.0.1:{}'.format(port), '--workers', str(workers),
+                               '--log-level', 'warning'], env=env)
+
+    def send(case):
+        _, method, path, body, headers = case
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(base_url + path, data=data, method=method,
+                                         headers=dict(headers, **{'Content-Type': 'application/json'}))
+        sent = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            return (time.perf_counter() - sent) * 1000, int(response.headers['X-Bench-Queries'])
+
+    results = {}
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                urllib.request.urlopen(base_url + cases[0][2])
+            except urllib.error.HTTPError:
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    sys.exit("gunicorn did not start, is it installed?")
+                time.sleep(0.2)
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            for case in cases:
+                list(executor.map(send, [case] * warmup))
+                start = time.perf_counter()
+                measured = list(executor.map(send, [case] * requests))
+                elapsed = time.perf_counter() - start
+                results[case[0]] = dict(summarize([latency for latency, _ in measured], elapsed,
+                                                  [queries for _, queries in measured]),
+                                        peak_rss_mb=workers_peak_rss_mb(server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=0.1, help='Data set size, see seed --scale')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--memory-requests', type=int, default=20,
+                        help='Requests per endpoint run in process under tracemalloc')
+    parser.add_argument('--servers', nargs='+', choices=SERVERS, default=list(SERVERS))
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent requests sent to gunicorn')
+    parser.add_argument('--output', help='Writes results to this JSON file')
+    parser.add_argument('--baseline', help='Compares results with this JSON file')
+    parser.add_argument('--threshold', type=float, default=10, help='Allowed regression in percent')
+    parser.add_argument('--save-baseline', metavar='PATH', help='Writes results as the new baseline')
+    args = parser.parse_args()
+
+    with test_database() as connection:
+        import django
+        from django.core.management import call_command
+        from django.test import override_settings
+
+        start = time.perf_counter()
+        call_command('seed', scale=args.scale, seed=args.seed, stdout=StringIO())
+        print('Seeded --scale {} in {:.1f}s'.format(args.scale, time.perf_counter() - start))
+
+        with override_settings(DEBUG=False):
+            cases = [case for case in build_cases('admin123') if case[0] in args.cases]
+            results = {}
+            if 'in-process' in args.servers:
+                results['in-process'] = run_in_process(connection, cases, args.requests, args.warmup,
+                                                       args.memory_requests)
+            if 'gunicorn' in args.servers:
+                # gunicorn reads what is committed, seed data is
+                results['gunicorn'] = run_gunicorn(connection, cases, args.requests, args.warmup, args.workers,
+                                                   args.concurrency)
+        report = {
+            'meta': {'scale': args.scale, 'seed': args.seed, 'requests': args.requests,
+                     'workers': args.workers, 'concurrency': args.concurrency, 'database': connection.vendor,
+                     'python': platform.python_version(), 'django': django.get_version()},
+            'results': results,
+        }
+
+    for server, cases in results.items():
+        for case, metrics in cases.items():
+            memory = 'alloc {}MB'.format(metrics['peak_alloc_mb']) if 'peak_alloc_mb' in metrics \
+                else 'rss {}MB'.format(metrics['peak_rss_mb'])
+            print('{:<10} {:<12} p50 {p50_ms:8.2f}ms  p95 {p95_ms:8.2f}ms  p99 {p99_ms:8.2f}ms  '
+                  '{rps:8.1f} req/s  {queries_per_request:5.1f} queries  peak {}'.format(
+                      server, case, memory, **metrics))
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['meta'].get('scale') != args.scale:
+            print('Baseline was measured on --scale {}'.format(baseline['meta'].get('scale')))
+        regressions = find_regressions(results, baseline['results'], args.threshold)
+        for server, case, metric, old, new in regressions:
+            print('REGRESSION {} {} {}: {} -> {}'.format(server, case, metric, old, new))
+        if regressions:
+            return 1
+        print('No regressions beyond {}% of the baseline'.format(args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
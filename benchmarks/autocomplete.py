@@ -0,0 +1,67 @@
+"""
+Memory and lookup latency of the in memory autocomplete index.
+Built from synthetic titles, no database is needed.
+
+    python -m benchmarks.autocomplete --titles 1000000
+"""
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+
+from benchmarks import percentile, setup_django
+
+WORDS = ('the', 'da', 'vinci', 'code', 'dark', 'matter', 'kite', 'runner', 'angels', 'demons', 'lost',
+         'symbol', 'origin', 'inferno', 'digital', 'fortress', 'deception', 'point', 'splendid', 'suns')
+
+
+def titles(count, seed=0):
+    rng = random.Random(seed)
+    for book_id in range(1, count + 1):
+        name = ' '.join(rng.choice(WORDS).title() for _ in range(rng.randint(2, 5))) + ' {}'.format(book_id)
+        yield book_id, name, '-'.join(name.lower().split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--titles', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    args = parser.parse_args()
+
+    setup_django()
+    from apps.book_rental.autocomplete import AutocompleteIndex
+
+    all_titles = list(titles(args.titles))
+    start = time.perf_counter()
+    AutocompleteIndex.build(all_titles)
+    elapsed = time.perf_counter() - start
+
+    # built again under tracemalloc, which slows it down, to measure memory
+    tracemalloc.start()
+    index = AutocompleteIndex.build((book_id, name, slug) for book_id, name, slug in titles(args.titles))
+    used, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del all_titles
+    print('{} titles ({} keys) built in {:.1f}s'.format(args.titles, len(index.keys), elapsed))
+    print('memory {:.1f}MB ({:.1f}MB per 1M titles), peak while building {:.1f}MB'.format(
+        used / 2 ** 20, used / 2 ** 20 * 1000000 / args.titles, peak / 2 ** 20))
+
+    rng = random.Random(1)
+    prefixes = [' '.join(rng.sample(WORDS, 2))[:rng.randint(1, 12)] for _ in range(args.lookups)]
+    latencies = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        index.lookup(prefix, 10)
+        latencies.append((time.perf_counter() - start) * 1000000)
+    print('lookup p50 {:.1f}us  p99 {:.1f}us  mean {:.1f}us'.format(
+        percentile(latencies, 50), percentile(latencies, 99), statistics.mean(latencies)))
+
+    start = time.perf_counter()
+    for book_id, name, slug in titles(1000, seed=2):
+        index.add(args.titles + book_id, name, slug)
+    print('incremental add {:.1f}us per book'.format((time.perf_counter() - start) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Bulk NumPy billing against the per object RentedBook.total_charge loop.
+
+    python -m benchmarks.billing --rentals 1000000
+"""
+import argparse
+import datetime
+import time
+
+from benchmarks import test_database
+
+BATCH_SIZE = 10000
+
+
+def create_rentals(rentals, users, books):
+    from django.contrib.auth.models import User
+    from apps.book_rental.models import Book, RentedBook
+    from apps.book_rental.tests.factories import create_standard_categories
+
+    categories = list(create_standard_categories().values())
+    admin = User.objects.create(username='bench-admin')
+    User.objects.bulk_create(User(username='bench-{}'.format(i)) for i in range(users))
+    Book.objects.bulk_create(Book(name='Book {}'.format(i), slug='book-{}'.format(i), author=admin,
+                                  category=categories[i % len(categories)], created_by=admin)
+                             for i in range(books))
+    user_ids = list(User.objects.exclude(pk=admin.pk).values_list('id', flat=True))
+    book_ids = list(Book.objects.values_list('id', flat=True))
+
+    today = datetime.date.today()
+    batch = []
+    for i in range(rentals):
+        rent_date = today - datetime.timedelta(days=i // (users * books) + i % 97)
+        returned = i % 5 != 0
+        batch.append(RentedBook(
+            user_id=user_ids[i % users],
+            book_id=book_ids[(i // users) % books],
+            rent_date=rent_date,
+            return_date=rent_date + datetime.timedelta(days=i % 61) if returned else None,
+            has_charges_paid=i % 11 == 0,
+            fine_charged=(i % 4) * 0.5,
+            created_by=admin,
+        ))
+        if len(batch) == BATCH_SIZE:
+            RentedBook.objects.bulk_create(batch)
+            batch = []
+    RentedBook.objects.bulk_create(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rentals', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--books', type=int, default=1000)
+    args = parser.parse_args()
+
+    with test_database():
+        from apps.book_rental.billing import compute_charges
+        from apps.book_rental.models import RentedBook
+
+        start = time.perf_counter()
+        create_rentals(args.rentals, args.users, args.books)
+        print('created {:,} rentals in {:.1f}s'.format(args.rentals, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        expected = {rented_book.id: rented_book.total_charge
+                    for rented_book in RentedBook.objects.select_related('book').iterator(chunk_size=BATCH_SIZE)}
+        per_object = time.perf_counter() - start
+        print('per object loop {:>8.2f}s {:>12,.0f} rentals/s'.format(per_object, args.rentals / per_object))
+
+        start = time.perf_counter()
+        charges = compute_charges()
+        bulk = time.perf_counter() - start
+        print('numpy billing   {:>8.2f}s {:>12,.0f} rentals/s'.format(bulk, args.rentals / bulk))
+
+        assert charges == expected, 'charges differ from RentedBook.total_charge'
+        print('speedup {:.1f}x, results identical'.format(per_object / bulk))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Latency of first and deep pages of /api/books/ with keyset pagination
+against the LimitOffsetPagination it replaced (COUNT(*) plus OFFSET).
+Requests are timed whole, with the ETag (see etags.py) production computes.
+
+    python -m benchmarks.books_pagination --books 5000000
+"""
+import argparse
+import statistics
+import time
+from unittest import mock
+
+from benchmarks import percentile, test_database
+
+BATCH_SIZE = 50000
+
+
+def create_books(books):
+    from django.contrib.auth.models import User
+    from apps.book_rental.models import Book
+    from apps.book_rental.tests.factories import create_standard_categories
+
+    categories = list(create_standard_categories().values())
+    user = User.objects.create(username='bench')
+    for start in range(0, books, BATCH_SIZE):
+        Book.objects.bulk_create(Book(name='Book {}'.format(i), slug='book-{}'.format(i), author=user,
+                                      category=categories[i % len(categories)], created_by=user)
+                                 for i in range(start, min(start + BATCH_SIZE, books)))
+    return user
+
+
+def measure(client, url, params, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url, params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=5000000)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    with test_database():
+        from django.urls import reverse
+        from rest_framework.pagination import LimitOffsetPagination
+        from rest_framework.test import APIClient
+
+        from apps.book_rental.models import Book
+        from apps.book_rental.pagination import encode_cursor
+        from apps.book_rental.views import BookViewSet
+
+        start = time.perf_counter()
+        user = create_books(args.books)
+        print('{} books created in {:.1f}s'.format(args.books, time.perf_counter() - start))
+
+        client = APIClient()
+        client.force_authenticate(user=user)
+        url = reverse('books-list')
+        ids = Book.objects.order_by('id').values_list('id', flat=True)
+        deep_offset = args.books - 100
+        # position of the row just before the deep page
+        deep_id = ids[deep_offset - 1]
+
+        cases = [
+            ('keyset first page', {}),
+            ('keyset deep page', {'cursor': encode_cursor([deep_id])}),
+            ('keyset + count', {'count': 1}),
+        ]
+        for name, params in cases:
+            latencies = measure(client, url, params, args.requests)
+            print('{:<22} p50 {:8.2f}ms  p95 {:8.2f}ms  mean {:8.2f}ms'.format(
+                name, percentile(latencies, 50), percentile(latencies, 95), statistics.mean(latencies)))
+
+        with mock.patch.object(BookViewSet, 'pagination_class', LimitOffsetPagination):
+            for name, params in (('offset first page', {}), ('offset deep page', {'offset': deep_offset})):
+                latencies = measure(client, url, params, args.requests)
+                print('{:<22} p50 {:8.2f}ms  p95 {:8.2f}ms  mean {:8.2f}ms'.format(
+                    name, percentile(latencies, 50), percentile(latencies, 95), statistics.mean(latencies)))
+
+
+if __name__ == '__main__':
+    main()
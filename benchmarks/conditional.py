@@ -0,0 +1,64 @@
+"""
+Throughput of conditional GET (304 Not Modified) against full responses
+of /api/books/ and /api/user-books/<id>/.
+
+    python -m benchmarks.conditional --books 10000 --rentals 1000 --requests 200
+"""
+import argparse
+import datetime
+import time
+
+from benchmarks import test_database
+
+
+def measure(client, url, requests, **headers):
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(url, **headers)
+    elapsed = time.perf_counter() - start
+    return response.status_code, requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--rentals', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    with test_database():
+        from django.contrib.auth.models import User
+        from django.urls import reverse
+        from rest_framework.test import APIClient
+
+        from apps.book_rental.models import Book, RentedBook
+        from apps.book_rental.tests.factories import create_standard_categories
+
+        categories = list(create_standard_categories().values())
+        user = User.objects.create(username='bench')
+        Book.objects.bulk_create(Book(name='Book {}'.format(i), slug='book-{}'.format(i), author=user,
+                                      category=categories[i % len(categories)], created_by=user)
+                                 for i in range(args.books))
+        book_ids = list(Book.objects.values_list('id', flat=True))
+        today = datetime.date.today()
+        RentedBook.objects.bulk_create(
+            RentedBook(user=user, book_id=book_ids[i % len(book_ids)], created_by=user,
+                       rent_date=today - datetime.timedelta(days=i // len(book_ids) + 1),
+                       return_date=None if i % 3 else today)
+            for i in range(args.rentals))
+
+        client = APIClient()
+        client.force_authenticate(user=user)
+        for name, url in (('books', reverse('books-list')),
+                          ('user-books', reverse('user-books', kwargs={'user_id': user.id}))):
+            etag = client.get(url)['ETag']
+            status, full = measure(client, url, args.requests)
+            assert status == 200
+            status, not_modified = measure(client, url, args.requests, HTTP_IF_NONE_MATCH=etag)
+            assert status == 304
+            print('{:<11} 200: {:8.1f} req/s   304: {:8.1f} req/s   x{:.1f}'.format(
+                name, full, not_modified, not_modified / full))
+
+
+if __name__ == '__main__':
+    main()
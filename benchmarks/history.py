@@ -0,0 +1,50 @@
+"""
+Saves of rentals in transactions with history written row by row or buffered (HISTORY_BUFFERED).
+
+    python -m benchmarks.history --saves 5000 --per-transaction 50
+"""
+import argparse
+import time
+
+from benchmarks import test_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--saves', type=int, default=5000)
+    parser.add_argument('--per-transaction', type=int, default=50)
+    args = parser.parse_args()
+
+    with test_database() as connection:
+        from django.db import transaction
+        from django.test import override_settings
+
+        from apps.book_rental.models import RentedBook
+        from apps.book_rental.tests.factories import BookFactory, UserFactory, create_standard_categories
+
+        books = BookFactory.create_batch(10, category=create_standard_categories()['fiction'])
+        users = UserFactory.create_batch(args.saves // len(books) + 1)
+
+        def count_statements(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        for buffered in (False, True):
+            RentedBook.objects.all().delete()
+            statements = []
+            with override_settings(HISTORY_BUFFERED=buffered), connection.execute_wrapper(count_statements):
+                start = time.perf_counter()
+                for first in range(0, args.saves, args.per_transaction):
+                    with transaction.atomic():
+                        for number in range(first, min(first + args.per_transaction, args.saves)):
+                            RentedBook(book=books[number % len(books)], user=users[number // len(books)],
+                                       created_by=users[0]).save()
+                elapsed = time.perf_counter() - start
+            history_inserts = sum('INSERT INTO "book_rental_historicalrentedbook"' in sql for sql in statements)
+            print('{}: {} saves in {:.2f}s ({:.0f} saves/s), {} queries, {} history inserts'.format(
+                'buffered' if buffered else 'row by row', args.saves, elapsed, args.saves / elapsed,
+                len(statements), history_inserts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Bulk catalog import (import_books command) against saving books one by one.
+
+    python -m benchmarks.import_books --rows 200000
+"""
+import argparse
+import csv
+import random
+import tempfile
+import time
+from io import StringIO
+
+from benchmarks import test_database
+
+WORDS = ('the', 'da', 'vinci', 'code', 'dark', 'matter', 'kite', 'runner', 'angels', 'demons', 'lost',
+         'symbol', 'origin', 'inferno', 'digital', 'fortress', 'deception', 'point', 'splendid', 'suns')
+CATEGORIES = ('regular', 'fiction', 'novels')
+
+
+def write_catalog(path, rows, authors, seed=0):
+    """
+    Rows with random titles, some of them repeated so their slugs have to be numbered
+    """
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['name', 'author', 'category', 'description', 'book_quantity'])
+        for row in range(rows):
+            name = ' '.join(rng.choice(WORDS).title() for _ in range(rng.randint(2, 5)))
+            if rng.random() < 0.9:
+                name += ' {}'.format(row)
+            writer.writerow([name, 'author-{}'.format(rng.randrange(authors)), rng.choice(CATEGORIES),
+                             'Description of {}'.format(name), rng.randint(0, 10)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--authors', type=int, default=5000)
+    parser.add_argument('--save-rows', type=int, default=2000, help='Rows saved one by one for comparison')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    with test_database(), tempfile.NamedTemporaryFile(suffix='.csv') as catalog:
+        from django.contrib.auth.models import User
+        from django.core.management import call_command
+
+        from apps.book_rental.models import Book, Category
+        from apps.book_rental.tests.factories import UserFactory, create_standard_categories
+
+        admin = UserFactory(username='admin', is_superuser=True)
+        create_standard_categories()
+        User.objects.bulk_create(User(username='author-{}'.format(author)) for author in range(args.authors))
+        write_catalog(catalog.name, args.rows, args.authors)
+
+        out = StringIO()
+        call_command('import_books', catalog.name, chunk_size=args.chunk_size, stdout=out)
+        print(out.getvalue().splitlines()[-1])
+        print('{} books, {} historical rows'.format(Book.objects.count(), Book.history.count()))
+
+        # the same rows through Book.save(), which numbers no slugs so names are made unique
+        categories = list(Category.objects.all())
+        authors = list(User.objects.filter(username__startswith='author-')[:100])
+        start = time.perf_counter()
+        for row in range(args.save_rows):
+            Book(name='Saved book {}'.format(row), author=authors[row % len(authors)],
+                 category=categories[row % len(categories)], created_by=admin).save()
+        elapsed = time.perf_counter() - start
+        print('Book.save(): {} rows in {:.1f}s ({:.0f} rows/s)'.format(args.save_rows, elapsed,
+                                                                      args.save_rows / elapsed))
+
+
+if __name__ == '__main__':
+    main()
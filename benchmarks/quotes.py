@@ -0,0 +1,53 @@
+"""
+Latency of POST /api/quotes/ quoting 500 books for 3, 7 and 30 days.
+
+    python -m benchmarks.quotes --items 500 --requests 500
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks import percentile, test_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    with test_database():
+        from django.contrib.auth.models import User
+        from django.urls import reverse
+        from rest_framework.test import APIClient
+
+        from apps.book_rental.models import Book
+        from apps.book_rental.tests.factories import create_standard_categories
+
+        categories = list(create_standard_categories().values())
+        user = User.objects.create(username='bench')
+        Book.objects.bulk_create(Book(name='Book {}'.format(i), slug='book-{}'.format(i), author=user,
+                                      category=categories[i % len(categories)], created_by=user)
+                                 for i in range(args.items))
+
+        client = APIClient()
+        client.force_authenticate(user=user)
+        data = {'book_ids': list(Book.objects.values_list('id', flat=True)), 'days': [3, 7, 30]}
+        url = reverse('quotes')
+        client.post(url, data, format='json')  # warm up tariff cache
+
+        latencies = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            response = client.post(url, data, format='json')
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200
+
+        print('{} items x {} days, {} requests'.format(args.items, len(data['days']), args.requests))
+        print('p50 {:.2f}ms  p95 {:.2f}ms  p99 {:.2f}ms  mean {:.2f}ms'.format(
+            percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99),
+            statistics.mean(latencies)))
+
+
+if __name__ == '__main__':
+    main()
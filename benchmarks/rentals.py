@@ -0,0 +1,80 @@
+"""
+Throughput of concurrent checkouts through POST /api/rentals/.
+
+--threads threads, each with its own database connection and user, rent the same
+--books books one after the other, every book has only --copies copies, so most
+attempts race for the last copies and are answered 409. Stock is checked afterwards:
+no book is oversold.
+
+    python -m benchmarks.rentals --threads 16 --books 50 --copies 5
+"""
+import argparse
+import logging
+import threading
+import time
+from collections import Counter
+
+from benchmarks import test_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--books', type=int, default=50)
+    parser.add_argument('--copies', type=int, default=5)
+    args = parser.parse_args()
+    # every 409 is logged as a warning
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+
+    with test_database() as connection:
+        from django.contrib.auth.models import User
+        from django.urls import reverse
+        from rest_framework.test import APIClient
+
+        from apps.book_rental.models import Book, RentedBook
+        from apps.book_rental.tests.factories import create_standard_categories
+
+        category = create_standard_categories()['regular']
+        admin = User.objects.create(username='bench-admin')
+        User.objects.bulk_create(User(username='bench-{}'.format(i)) for i in range(args.threads))
+        users = list(User.objects.exclude(pk=admin.pk).order_by('id'))
+        Book.objects.bulk_create(Book(name='Book {}'.format(i), slug='book-{}'.format(i), author=admin,
+                                      category=category, book_quantity=args.copies, created_by=admin)
+                                 for i in range(args.books))
+        book_ids = list(Book.objects.order_by('id').values_list('id', flat=True))
+        url = reverse('rentals')
+
+        barrier = threading.Barrier(args.threads)
+        statuses = [Counter() for _ in range(args.threads)]
+
+        def rent(index):
+            try:
+                client = APIClient()
+                client.force_authenticate(user=users[index])
+                barrier.wait()
+                for book_id in book_ids:
+                    statuses[index][client.post(url, {'book_id': book_id}, format='json').status_code] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=rent, args=(index,)) for index in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        total = sum(statuses, Counter())
+        attempts = sum(total.values())
+        rented = RentedBook.objects.count()
+        assert total[201] == rented <= args.books * args.copies, total
+        assert sum(Book.objects.values_list('book_quantity', flat=True)) == args.books * args.copies - rented
+
+        print('{} threads renting {} books of {} copies'.format(args.threads, args.books, args.copies))
+        print('{} attempts in {:.2f}s: {:.1f} attempts/s, {:.1f} rentals/s, statuses {}'.format(
+            attempts, elapsed, attempts / elapsed, rented / elapsed, dict(sorted(total.items()))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Charges per second of the day wise slab walk RentedBook.total_charge used to do
+against the compiled tariff lookup.
+
+    python -m benchmarks.tariffs --charges 1000000
+"""
+import argparse
+import random
+import time
+
+from apps.book_rental.tariffs import CompiledTariff, Slab, walk_slabs
+
+TARIFFS = {
+    'fiction': [Slab(0, 2, 1.0, 2.0, 2), Slab(3, 30, 1.5, 4.5, 5), Slab(31, None, 2.0, 0.0, None)],
+    'regular': [Slab(0, 2, 1.0, 2.0, 2), Slab(3, None, 1.5, 0.0, None)],
+    'novels': [Slab(0, 3, 1.5, 4.5, 3), Slab(4, None, 1.5, 0.0, None)],
+}
+
+
+def slab_walk_charge(slabs, days_rented):
+    total, days_calculated, per_day_charge = walk_slabs(slabs, days_rented)
+    if per_day_charge is None:
+        return total
+    return total + ((days_rented - days_calculated) * per_day_charge)
+
+
+def run(label, charge, rentals):
+    start = time.perf_counter()
+    total = 0
+    for tariff, days in rentals:
+        total += charge(tariff, days)
+    elapsed = time.perf_counter() - start
+    print('{:<16} {:>12,.0f} charges/s   (sum {:.1f})'.format(label, len(rentals) / elapsed, total))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--charges', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = list(TARIFFS)
+    rentals = [(rng.choice(names), rng.randint(0, 120)) for _ in range(args.charges)]
+
+    walked = [(TARIFFS[name], days) for name, days in rentals]
+    compiled_tariffs = {name: CompiledTariff(slabs) for name, slabs in TARIFFS.items()}
+    compiled = [(compiled_tariffs[name], days) for name, days in rentals]
+
+    before = run('slab walk', slab_walk_charge, walked)
+    after = run('compiled tariff', lambda tariff, days: tariff.charge(days), compiled)
+    print('speedup {:.1f}x'.format(before / after))
+
+
+if __name__ == '__main__':
+    main()
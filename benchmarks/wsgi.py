@@ -0,0 +1,31 @@
+"""
+WSGI application gunicorn serves in benchmarks.api, against the benchmark's test database
+(BENCH_DATABASE_NAME). Responses carry the number of queries they made in X-Bench-Queries.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+from django.conf import settings  # noqa: E402
+
+# before the first connection is made, apps are not even set up yet
+settings.DATABASES['default']['NAME'] = os.environ['BENCH_DATABASE_NAME']
+
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+from django.db import connection  # noqa: E402
+
+django_application = get_wsgi_application()
+
+
+def application(environ, start_response):
+    queries = []
+
+    def count_queries(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def start_counted_response(status, headers, exc_info=None):
+        return start_response(status, headers + [('X-Bench-Queries', str(len(queries)))], exc_info)
+
+    with connection.execute_wrapper(count_queries):
+        return django_application(environ, start_counted_response)
@@ -0,0 +1,11 @@
+"""
+gunicorn settings, see docker-entrypoint.sh
+
+    gunicorn config.wsgi:application --config config/gunicorn.py
+"""
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # drops live gauges of the worker from /metrics, see apps/monitoring/metrics.py
+    multiprocess.mark_process_dead(worker.pid)
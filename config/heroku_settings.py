@@ -18,6 +18,14 @@ DATABASES = {
         'PORT': os.environ.get('DB_PORT'),
     }
 }
+# dynos may run on several hosts, CACHE_LOCATION lists memcached servers all of them reach, comma separated
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'localhost:11211').split(','),
+    }
+}
+
 if os.environ.get('DATABASE_URL'):
     db_from_env = dj_database_url.config()
     DATABASES['default'].update(db_from_env)
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 import os
+import sys
+import tempfile
 
 import dj_database_url
 
@@ -48,7 +50,8 @@ INSTALLED_APPS = [
 
     # Local Apps
     'apps.core',
-    'apps.book_rental'
+    'apps.book_rental',
+    'apps.monitoring',
 ]
 
 REST_FRAMEWORK = {
@@ -74,7 +77,11 @@ OAUTH2_PROVIDER = {
 }
 
 MIDDLEWARE = [
+    # first, so that queries of the other middleware are counted too
+    'apps.monitoring.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # before any view reads compiled tariffs or the autocomplete index
+    'apps.book_rental.middleware.VersionCheckMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,6 +89,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',
+    # last, so that mostly the view runs under the profiler
+    'apps.monitoring.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -116,6 +125,9 @@ if ENV == 'local':
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            # file, not shared in memory database, so that concurrency tests
+            # wait on locks from other connections instead of failing
+            'TEST': {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')},
         }
     }
 else:
@@ -129,6 +141,32 @@ else:
             'PORT': os.environ.get('MYSQL_PORT', '3306')}
     }
 
+# Shared by the gunicorn workers: versions of their in memory caches (compiled tariffs, autocomplete)
+# are kept here, see apps/book_rental/versions.py. Deployments run more than one app host, which
+# have to share the cache, so they use memcached. A local server runs on a single host
+if ENV == 'local':
+    CACHES = {
+        'default': {
+            'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+            'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'rental_server_cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.memcached.MemcachedCache'),
+            'LOCATION': os.environ.get('CACHE_LOCATION', 'memcached:11211'),
+        }
+    }
+# tests do not share the versions of a running server
+if sys.argv[1:2] == ['test']:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(tempfile.gettempdir(), 'rental_server_test_cache'),
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -166,3 +204,49 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 STATIC_ROOT = '/srv/static/'
+
+# Historical records of changes made in transactions are written in bulk after
+# the transaction commits, instead of one insert per save (see apps/book_rental/history.py)
+HISTORY_BUFFERED = os.environ.get('HISTORY_BUFFERED', '0') == '1'
+
+# Per request query metrics (see apps/monitoring/middleware.py): requests repeating
+# a statement shape this many times are logged as N+1 warnings
+QUERY_N_PLUS_ONE_THRESHOLD = int(os.environ.get('QUERY_N_PLUS_ONE_THRESHOLD', 5))
+# Server-Timing header with query count and DB time of every response. It is sent to any client,
+# anonymous ones included, so keep it off where those figures should not be public
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', '0') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # INFO logs query metrics of every request, WARNING only N+1 ones
+        'apps.monitoring': {
+            'handlers': ['console'],
+            'level': os.environ.get('MONITORING_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+# Statements of a request slower than this are EXPLAINed and stored (see apps/monitoring/slow_queries.py),
+# 0 turns capture off. Only the newest SLOW_QUERY_LOG_SIZE are kept
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 1000))
+# Capture runs in the request, at most this many requests a minute per process are captured, 0 is no limit
+SLOW_QUERY_CAPTURES_PER_MINUTE = int(os.environ.get('SLOW_QUERY_CAPTURES_PER_MINUTE', 10))
+# Parameters may hold password hashes, tokens or emails, they are stored with the SQL only when set
+SLOW_QUERY_PARAMS = os.environ.get('SLOW_QUERY_PARAMS', '0') == '1'
+
+# /metrics (Prometheus) answers only scrapers sending 'Authorization: Bearer <token>' when set,
+# and only requests from localhost when empty
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Staff requests with an X-Profile header or _profile query parameter are profiled
+# (see apps/monitoring/profiling.py), the newest PROFILE_LOG_SIZE profiles are kept
+PROFILE_LOG_SIZE = int(os.environ.get('PROFILE_LOG_SIZE', 100))
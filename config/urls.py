@@ -22,6 +22,7 @@ from rest_framework.authtoken.views import obtain_auth_token
 from rest_framework_simplejwt.views import TokenVerifyView, TokenRefreshView, TokenObtainPairView
 
 from apps.landing_view import index
+from apps.monitoring.views import metrics
 
 urlpatterns = [
     url(r'^$', index, name='index'),
@@ -29,6 +30,8 @@ urlpatterns = [
     url('api/user/', include('apps.core.urls'), name='user_urls'),
 
     url('api/', include('apps.book_rental.urls'), name='book_rental_urls'),
+
+    url('api/monitoring/', include('apps.monitoring.urls'), name='monitoring_urls'),
     # admin
     path('admin/', admin.site.urls),
 
@@ -40,6 +43,8 @@ urlpatterns = [
     path('jwt/token/verify/', TokenVerifyView.as_view(), name='jwt_token_verify'),
     # oauth2_provider
     path('oauth2/', include('oauth2_provider.urls', namespace='oauth2_provider')),
+    # prometheus, see apps/monitoring/metrics.py
+    path('metrics', metrics, name='metrics'),
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
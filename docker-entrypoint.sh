@@ -9,5 +9,11 @@ python manage.py collectstatic --noinput
 echo "Database migrations"
 python manage.py migrate --noinput
 
-gunicorn config.wsgi:application --bind 0.0.0.0:8000
+# Prometheus metrics of the workers are aggregated through files of this directory,
+# values of a previous run have to go
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+gunicorn config.wsgi:application --bind 0.0.0.0:8000 --config config/gunicorn.py
 